@@ -11,4 +11,7 @@
 
 import ffgo.main
 
-ffgo.main.main()
+# The guard prevents worker processes started with the 'spawn' method (cf.
+# multiprocessing) from running FFGo again when they import this script.
+if __name__ == "__main__":
+    ffgo.main.main()
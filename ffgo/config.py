@@ -7,7 +7,6 @@ import gzip
 import contextlib
 import gettext
 import traceback
-import collections
 import itertools
 import textwrap
 from xml.etree import ElementTree
@@ -22,6 +21,9 @@ from .misc import resourceExists, textResourceStream
 from .constants import *
 from .logging import logger, LogLevel
 from .fgdata.aircraft import Aircraft
+from .fgdata.aircraft_catalogue import AircraftCatalogue
+from .fgdata.airport_table import AirportTable
+from .fgdata.airport_cache import AirportDataCache
 
 
 def setupTranslationHelper(config):
@@ -64,6 +66,14 @@ class Config:
         # order, of all Aircraft instances with that name.
         self.aircraftDict = {}
         self.aircraftList = []  # Sorted list of Aircraft instances.
+        # AircraftCatalogue instance, loaded on demand by _readAircraft()
+        self.aircraftCatalogue = None
+        # misc.ProgressFeedbackHandler instance used by _readAircraft(), or
+        # None
+        self.aircraftScanProgressFeedbackHandler = None
+        # AircraftMetadataIndex instance, loaded on demand (cf.
+        # getAircraftMetadataIndex())
+        self._aircraftMetadataIndex = None
 
         self.scenario_list = []  # List of selected scenarios.
         # List of all aircraft carriers found in AI scenario folder.
@@ -92,6 +102,23 @@ class Config:
         self.alreadyProposedChanges = StringVar()
         self.apt_data_source = IntVar()
         self.auto_update_apt = IntVar()
+        # Number of processes used to build the apt digest file (0 means one
+        # per CPU)
+        self.aptDigestBuildProcesses = IntVar()
+        # Whether to precompute the nearest METAR station for every airport
+        self.precomputeNearestMetarStations = IntVar()
+        # Number of airports whose detailed data is kept in memory, whether
+        # to also cache this data on disk and the maximum number of airports
+        # cached on disk (cf. self.aptDatCache)
+        self.aptDataCacheSize = IntVar()
+        self.aptDataDiskCache = IntVar()
+        self.aptDataDiskCacheSize = IntVar()
+        # Whether to read detailed airport data in a background thread for
+        # airports likely to be selected (cf. gui.mainwindow.App)
+        self.aptDataPrefetch = IntVar()
+        # Whether to read metadata from the aircraft -set.xml files in a
+        # background thread (cf. gui.mainwindow.App)
+        self.aircraftMetadataIndexing = IntVar()
         self.carrier = StringVar() # when non-empty, we are in “carrier mode”
         self.FG_aircraft = StringVar()
         self.FG_bin = StringVar()
@@ -100,6 +127,14 @@ class Config:
         self.FG_download_dir = StringVar()
         self.FG_working_dir = StringVar()
 
+        # Whether to answer magnetic declination queries by interpolation in
+        # a grid computed once per day (cf. geo.magfield.EarthMagneticField)
+        self.magDeclGrid = IntVar()
+        # Whether to keep a MagneticField process running to answer queries
+        # for exact declinations (cf. geo.magfield.MagneticFieldCoprocess)
+        self.magFieldCoprocess = IntVar()
+        self.magFieldCoprocess.trace('w', self._onMagFieldCoprocessChanged)
+        self.earthMagneticField = None
         self.MagneticField_bin = StringVar()
         self.MagneticField_bin.trace('w', self.updateMagFieldProvider)
 
@@ -163,11 +198,24 @@ class Config:
                                              self.alreadyProposedChanges,
                          'APT_DATA_SOURCE=': self.apt_data_source,
                          'AUTO_UPDATE_APT=': self.auto_update_apt,
+                         'APT_DIGEST_BUILD_PROCESSES=':
+                                             self.aptDigestBuildProcesses,
+                         'PRECOMPUTE_NEAREST_METAR_STATIONS=':
+                                   self.precomputeNearestMetarStations,
+                         'APT_DATA_CACHE_SIZE=': self.aptDataCacheSize,
+                         'APT_DATA_DISK_CACHE=': self.aptDataDiskCache,
+                         'APT_DATA_DISK_CACHE_SIZE=':
+                                             self.aptDataDiskCacheSize,
+                         'APT_DATA_PREFETCH=': self.aptDataPrefetch,
+                         'AIRCRAFT_METADATA_INDEXING=':
+                                             self.aircraftMetadataIndexing,
                          'FG_BIN=': self.FG_bin,
                          'FG_AIRCRAFT=': self.FG_aircraft,
                          'FG_DOWNLOAD_DIR=': self.FG_download_dir,
                          'FG_WORKING_DIR=': self.FG_working_dir,
                          'MAGNETICFIELD_BIN=': self.MagneticField_bin,
+                         'MAG_DECL_GRID=': self.magDeclGrid,
+                         'MAGNETICFIELD_COPROCESS=': self.magFieldCoprocess,
                          'FILTER_APT_LIST=': self.filteredAptList,
                          'LANG=': self.language,
                          'WINDOW_GEOMETRY=': self.mainWindowGeometry,
@@ -196,10 +244,30 @@ class Config:
         # digest file: nothing so far (this indicates the list of apt.dat files
         # used to build the apt digest file, with some metadata).
         self.aptDatFilesInfoFromDigest = []
+        # AirportTable instance (mapping from ICAO codes to AirportStub
+        # instances), normally obtained from the apt digest file (cf.
+        # readAptDigestFile()).
+        self.airports = AirportTable.fromDigestEntries([])
+        # AirportSpatialIndex instance for self.airports, built or loaded on
+        # demand (cf. getAirportIndex()).
+        self._airportIndex = None
+        # MetarStationIndex instance, built by readMetarDat()
+        self.metarStations = None
+        # SceneryWatcher instance built by the last exploration of the
+        # scenery paths for INSTALLED_APT, until it is handed over to the
+        # GUI's SceneryMonitor (cf. takeSceneryWatcher()).
+        self.sceneryWatcher = None
+        # Set of installed airports, as in INSTALLED_APT (cf.
+        # updateInstalledAptList()); None when not read yet.
+        self._installedApt = None
         # In order to avoid using a lot of memory, detailed airport data is
         # only loaded on demand. Since this is quite slow, keep a cache of the
-        # last retrieved data.
-        self.aptDatCache = collections.deque(maxlen=50)
+        # last retrieved data (in memory, and optionally on disk).
+        self.aptDatCache = AirportDataCache(50)
+        self.aptDataCacheSize.trace("w", self._onAptDataCacheSizeChanged)
+        self.aptDataDiskCache.trace("w", self._onAptDataDiskCacheChanged)
+        self.aptDataDiskCacheSize.trace(
+            "w", self._onAptDataDiskCacheSizeChanged)
 
         self._earlyTranslationsSetup()
         self._createUserDirectories()
@@ -297,8 +365,124 @@ class Config:
         with open(INSTALLED_APT, "w", encoding="utf-8") as fout:
             fout.writelines(airports)
 
+        self._installedApt = None
+
+    def updateInstalledAptList(self, addedTiles, removedTiles):
+        """Apply scenery changes to the list of installed airports.
+
+        'addedTiles' and 'removedTiles' are sets of tiles as returned by
+        SceneryWatcher.poll(). Only the airports they contain are added
+        to or removed from INSTALLED_APT: when there are only
+        additions, they are appended to the file, which is otherwise
+        rewritten from the in-memory set of installed airports.
+
+        Return None if the list didn't change, otherwise a tuple
+        (addedRows, removedRows) of sorted lists of rows of
+        self.airports.
+
+        """
+        airports = self.airports
+        installed = self._installedApt
+        if installed is None:
+            installed = self._installedApt = set(self._readInstalledAptSet())
+
+        addedRows = [ row for row in self._airportRowsInTiles(addedTiles)
+                      if airports.icao(row) not in installed ]
+        removedRows = [ row for row in self._airportRowsInTiles(removedTiles)
+                        if airports.icao(row) in installed ]
+        if not addedRows and not removedRows:
+            return None
+
+        logger.info("Updating '{}' ({} airports added, {} removed)".format(
+            INSTALLED_APT, len(addedRows), len(removedRows)))
+        installed.update(airports.icao(row) for row in addedRows)
+
+        if removedRows:
+            installed.difference_update(airports.icao(row)
+                                        for row in removedRows)
+            with open(INSTALLED_APT, "w", encoding="utf-8") as fout:
+                fout.writelines(icao + '\n' for icao in sorted(installed))
+        else:
+            with open(INSTALLED_APT, "a", encoding="utf-8") as fout:
+                fout.writelines(airports.icao(row) + '\n'
+                                for row in addedRows)
+
+        return (addedRows, removedRows)
+
+    def takeSceneryWatcher(self):
+        """Return the scenery paths to watch and a SceneryWatcher or None.
+
+        The result is a tuple (sceneryPaths, watcher). If the scenery
+        paths have been explored since the last config update, 'watcher'
+        is the corresponding up-to-date SceneryWatcher instance, which
+        is then owned by the caller; otherwise, it is None and
+        'sceneryPaths' are FG_SCENERY, plus the default TerraSync
+        directory inside the download directory (if set), as
+        FlightGear can't be queried at this point.
+
+        """
+        watcher, self.sceneryWatcher = self.sceneryWatcher, None
+        if watcher is not None:
+            return (watcher.sceneryPaths, watcher)
+
+        res = self.FG_scenery.get().split(os.pathsep)
+        downloadDir = self.FG_download_dir.get()
+        if downloadDir:
+            res.append(os.path.join(downloadDir, "TerraSync"))
+
+        return (res, None)
+
+    def _airportRowsInTiles(self, tiles):
+        """Return the sorted list of rows of airports in the given tiles.
+
+        'tiles' should be an iterable of (lat, lon) tuples giving the
+        south-west corner of 1°×1° tiles. Each tile corresponds to
+        exactly one cell of the spatial index, which directly gives the
+        airports it contains.
+
+        """
+        airportIndex = self.getAirportIndex()
+        rows = []
+        for tileLat, tileLon in tiles:
+            rows.extend(airportIndex.tileRows(tileLat, tileLon))
+
+        rows.sort()
+        return rows
+
     def readMetarDat(self):
-        """Fetch METAR station list from metar.dat.gz file"""
+        """Fetch METAR station list from metar.dat.gz file.
+
+        Also build self.metarStations, a MetarStationIndex instance
+        allowing to quickly find the nearest stations of any airport.
+
+        """
+        # This import requires the translation system [_() function] to be in
+        # place.
+        from .fgdata.metar_stations import MetarStationIndex
+
+        res = self._readMetarStationList()
+
+        if os.path.isfile(APT):
+            stamp = MetarStationIndex.computeStamp(APT, self.metar_path,
+                                                   self.airports)
+        else:
+            stamp = None
+
+        if (self.metarStations is not None and stamp is not None and
+            self.metarStations.stamp == stamp):
+            return res          # self.metarStations is up-to-date
+
+        self.metarStations = MetarStationIndex(self.airports, res,
+                                               stamp=stamp)
+        # The nearest station table is only computed when building the apt
+        # digest file (cf. computeMetarNearestStations()). If it is missing or
+        # outdated, queries simply use the spatial index.
+        if stamp is not None and self.precomputeNearestMetarStations.get():
+            self.metarStations.loadNearestTable(METAR_NEAREST_STATIONS)
+
+        return res
+
+    def _readMetarStationList(self):
         logger.info("Opening '{}' for reading".format(self.metar_path))
         res = []
 
@@ -309,6 +493,50 @@ class Config:
 
         return res
 
+    def getMetarStations(self):
+        """Return a MetarStationIndex instance for self.airports.
+
+        self.metarStations is reset whenever self.airports is replaced;
+        in this case, it is rebuilt by readMetarDat().
+
+        """
+        if self.metarStations is None:
+            self.readMetarDat()
+
+        return self.metarStations
+
+    def computeMetarNearestStations(self, progressFeedbackHandler=None):
+        """Compute and save the nearest METAR station for every airport.
+
+        This is only done if PRECOMPUTE_NEAREST_METAR_STATIONS is
+        enabled. It takes a while and the result depends on the apt
+        digest file, therefore this method is called right after the
+        apt digest file has been built (cf. AptDigestBuilder).
+
+        """
+        # These imports require the translation system [_() function] to be
+        # in place.
+        from .fgdata import apt_dat
+        from .fgdata.metar_stations import MetarStationIndex
+
+        if not (self.precomputeNearestMetarStations.get() and
+                os.path.isfile(APT) and os.path.isfile(self.metar_path)):
+            return
+
+        aptDatFilesInfo, airports = apt_dat.AptDatDigest.read(APT)
+        stamp = MetarStationIndex.computeStamp(APT, self.metar_path,
+                                               airports)
+        metarStations = MetarStationIndex(
+            airports, self._readMetarStationList(), stamp=stamp)
+
+        logger.info("Computing the nearest METAR station for every airport")
+        metarStations.computeNearestTable(progressFeedbackHandler)
+        try:
+            metarStations.saveNearestTable(METAR_NEAREST_STATIONS)
+        except OSError as e:
+            logger.warning("Unable to write '{}': {}".format(
+                METAR_NEAREST_STATIONS, e))
+
     def _computeAircraftDirList(self):
         FG_AIRCRAFT_env = os.getenv("FG_AIRCRAFT", "")
         if FG_AIRCRAFT_env:
@@ -469,6 +697,10 @@ class Config:
             # self.aircraftStatsExpiryPeriod.
             self.aircraftStatsManager.save()
 
+        # The scenery paths may change
+        self.sceneryWatcher = None
+        self._installedApt = None
+
         del self.settings
         del self.text
         del self.aircraft_dirs
@@ -488,6 +720,13 @@ class Config:
         self.alreadyProposedChanges.set('')
         self.apt_data_source.set(1)
         self.auto_update_apt.set(1)
+        self.aptDigestBuildProcesses.set('0')
+        self.precomputeNearestMetarStations.set('0')
+        self.aptDataCacheSize.set('50')
+        self.aptDataDiskCache.set('1')
+        self.aptDataDiskCacheSize.set('1000')
+        self.aptDataPrefetch.set('1')
+        self.aircraftMetadataIndexing.set('1')
         self.carrier.set('')
         self.FG_aircraft.set('')
         self.FG_bin.set('')
@@ -496,6 +735,8 @@ class Config:
         self.FG_download_dir.set('')
         self.FG_working_dir.set('')
         self.MagneticField_bin.set('')
+        self.magDeclGrid.set('1')
+        self.magFieldCoprocess.set('1')
         self.language.set('')
         self.baseFontSize.set(DEFAULT_BASE_FONT_SIZE)
         self.mainWindowGeometry.set('')
@@ -638,8 +879,8 @@ class Config:
     def _findInstalledApt(self):
         """Walk through all scenery paths and find installed airports.
 
-        Take geographic coordinates from directory names and compare them
-        with airport coordinates from the apt digest file.
+        Take geographic coordinates from directory names and look up the
+        airports of the corresponding tiles in the spatial index.
 
         The result is a sorted list of airport identifiers for matching
         airports.
@@ -650,6 +891,7 @@ class Config:
         from .fgdata import json_report
         from .fgcmdbuilder import FGCommandBuilder
         from .fgdata.fgversion import FlightGearVersion
+        from .fgdata.scenery_watcher import SceneryWatcher
         fgBin = self.FG_bin.get()
 
         # The fgfs option --json-report appeared in FlightGear 2016.4.1
@@ -669,47 +911,11 @@ class Config:
             # *is* going to use it as a scenery path.
             sceneryPaths = self.FG_scenery.get().split(os.pathsep)
 
-        coord_dict = {}
-
-        for scenery in sceneryPaths:
-            path = os.path.join(scenery, 'Terrain')
-            if os.path.exists(path):
-                for dir in os.listdir(path):
-                    p = os.path.join(path, dir)
-                    for coords in os.listdir(p):
-                        d = os.path.join(p, coords)
-                        if not os.path.isdir(d):
-                            continue
-
-                        logger.debug("Exploring Terrain directory '{}' -> '{}'"
-                                     .format(p, coords))
-                        converted = self._stringToCoordinates(coords)
-                        if converted is not None:
-                            coord_dict[converted] = None
-                        else:
-                            logger.notice(
-                                _("Ignoring directory '{}' (unexpected name)")
-                                .format(d))
-
-        coords = coord_dict.keys()
-        res = []
-        for icao in self.sortedIcao():
-            airport = self.airports[icao]
-            for c in coords:
-                if (c[0][0] < airport.lat < c[0][1] and
-                    c[1][0] < airport.lon < c[1][1]):
-                    res.append(icao)
-
-        return res
-
-    def _calculateRange(self, coordinates):
-        c = coordinates
-        if c.startswith('s') or c.startswith('w'):
-            c = int(c[1:]) * (-1)
-            return c, c + 1
-        else:
-            c = int(c[1:])
-            return c, c + 1
+        self.sceneryWatcher = SceneryWatcher(sceneryPaths)
+        airports = self.airports
+        # Rows are sorted the same way as ICAO codes
+        return [ airports.icao(row) for row in
+                 self._airportRowsInTiles(self.sceneryWatcher.tiles) ]
 
     def _createUserDirectories(self):
         """Create config, log and stats directories if they don't exist."""
@@ -910,11 +1116,21 @@ configurations are kept separate.""")
         suitable for quick building of the aircraft list in the GUI.
 
         """
+        if self.aircraftCatalogue is None:
+            self.aircraftCatalogue = AircraftCatalogue.load(AIRCRAFT_CATALOGUE)
+
         aircraftDict = {}
-        for dir_ in self.aircraft_dirs:
-            if os.path.isdir(dir_):
-                for d in os.listdir(dir_):
-                    self._readAircraftData(dir_, d, aircraftDict)
+        # Only directories modified since the previous scan are read.
+        for path, setFiles in self.aircraftCatalogue.scan(
+                self.aircraft_dirs, self.aircraftScanProgressFeedbackHandler):
+            for f in setFiles:
+                self._appendAircraft(f, aircraftDict, path)
+
+        try:
+            self.aircraftCatalogue.save()
+        except OSError as e:
+            logger.warning("Unable to write '{}': {}".format(
+                AIRCRAFT_CATALOGUE, e))
 
         aircraftList = []
         # First sort by lowercased aircraft name
@@ -925,11 +1141,17 @@ configurations are kept separate.""")
 
         return (aircraftDict, aircraftList)
 
-    def _readAircraftData(self, dir_, d, aircraftDict):
-        path = os.path.join(dir_, d)
-        if os.path.isdir(path):
-            for f in os.listdir(path):
-                self._appendAircraft(f, aircraftDict, path)
+    def getAircraftMetadataIndex(self):
+        """Return the AircraftMetadataIndex instance (loaded on demand)."""
+        # This import requires the translation system [_() function] to be in
+        # place.
+        from .fgdata.aircraft_metadata import AircraftMetadataIndex
+
+        if self._aircraftMetadataIndex is None:
+            self._aircraftMetadataIndex = AircraftMetadataIndex.load(
+                AIRCRAFT_METADATA_INDEX)
+
+        return self._aircraftMetadataIndex
 
     def _appendAircraft(self, f, aircraftDict, path):
         if f.endswith('-set.xml'):
@@ -946,20 +1168,26 @@ configurations are kept separate.""")
                 aircraftDict[name].append(aircraft)
 
     def sortedIcao(self):
-        return sorted(self.airports.keys())
+        # The AirportTable is sorted by ICAO code
+        return self.airports.icaos()
 
     def readAptDigestFile(self):
         """Read the apt digest file.
 
         Recreate a new one if there is already one, but written in an
-        old version of the format. Return a list of AirportStub
-        instances.
+        old version of the format. Return the sorted list of rows of
+        self.airports (an AirportTable instance) corresponding to the
+        airports that should be shown in the airport list.
 
         """
         from .fgdata import apt_dat
 
+        self._airportIndex = None
+        self.metarStations = None
+
         if not os.path.isfile(APT):
-            self.aptDatFilesInfoFromDigest, self.airports = [], {}
+            self.aptDatFilesInfoFromDigest = []
+            self.airports = AirportTable.fromDigestEntries([])
         else:
             for attempt in itertools.count(start=1):
                 try:
@@ -975,19 +1203,60 @@ configurations are kept separate.""")
                 else:
                     break
 
+        if os.path.isfile(APT):
+            # This import requires the translation system [_() function] to
+            # be in place.
+            from .fgdata.airport_index import AirportSpatialIndex
+            # Cached airport data is only valid for this apt digest file
+            self.aptDatCache.setStamp(
+                AirportSpatialIndex.computeDigestStamp(APT, self.airports))
+
         if os.path.isfile(OBSOLETE_APT_TIMESTAMP_FILE):
             # Obsolete file since version 4 of the apt digest file format
             os.unlink(OBSOLETE_APT_TIMESTAMP_FILE)
 
         if self.filteredAptList.get():
-            installedApt = self._readInstalledAptSet()
-            res = [ self.airports[icao] for icao in self.sortedIcao()
-                    if icao in installedApt ]
+            # Rows are sorted the same way as ICAO codes
+            self._installedApt = set(self._readInstalledAptSet())
+            res = sorted(self.airports.rows(self._installedApt))
         else:
-            res = [ self.airports[icao] for icao in self.sortedIcao() ]
+            res = list(range(len(self.airports)))
 
         return res
 
+    # Accept any arguments to allow safe use as a Tkinter variable observer
+    def _onAptDataCacheSizeChanged(self, *args):
+        self.aptDatCache.resize(self.aptDataCacheSize.get())
+
+    # Accept any arguments to allow safe use as a Tkinter variable observer
+    def _onAptDataDiskCacheChanged(self, *args):
+        self.aptDatCache.setDiskCacheDir(
+            APT_DATA_CACHE_DIR if self.aptDataDiskCache.get() else None)
+
+    # Accept any arguments to allow safe use as a Tkinter variable observer
+    def _onAptDataDiskCacheSizeChanged(self, *args):
+        self.aptDatCache.resizeDisk(self.aptDataDiskCacheSize.get())
+
+    def getAirportIndex(self):
+        """Return an AirportSpatialIndex instance for self.airports.
+
+        The index is saved to APT_INDEX, next to the apt digest file,
+        and only rebuilt when the apt digest file changes.
+
+        """
+        # This import requires the translation system [_() function] to be in
+        # place.
+        from .fgdata.airport_index import AirportSpatialIndex
+
+        if self._airportIndex is None:
+            if os.path.isfile(APT) and len(self.airports):
+                self._airportIndex = AirportSpatialIndex.loadOrBuild(
+                    APT_INDEX, APT, self.airports)
+            else:
+                self._airportIndex = AirportSpatialIndex.build(self.airports)
+
+        return self._airportIndex
+
     def _readInstalledAptSet(self):
         """Read the set of locally installed airports from INSTALLED_APT.
 
@@ -1011,6 +1280,12 @@ configurations are kept separate.""")
     def makeAptDigest(self, headText=None):
         """
         Build the FFGo apt digest file from the apt.dat files used by FlightGear"""
+        # self.airports may be backed by a memory mapping of the apt digest
+        # file that is going to be replaced.
+        self.airports.detach()
+        self._airportIndex = None
+        self.metarStations = None
+
         AptDigestBuilder(self.master, self).start(headText)
 
     def autoUpdateApt(self):
@@ -1159,24 +1434,14 @@ configurations are kept separate.""")
         except Exception:
             gettext.install(MESSAGES, LOCALE_DIR)
 
-    # Regexp for directory names such as w040n20
-    _geoDirCre = re.compile(r"[we]\d{3}[ns]\d{2}$")
-
-    def _stringToCoordinates(self, coordinates):
-        """Convert geo coordinates to decimal format."""
-        if not self._geoDirCre.match(coordinates):
-            return None
-
-        lat = coordinates[4:]
-        lon = coordinates[:4]
-
-        lat_range = self._calculateRange(lat)
-        lon_range = self._calculateRange(lon)
-        return lat_range, lon_range
-
     # Accept any arguments to allow safe use as a Tkinter variable observer
     def updateMagFieldProvider(self, *args):
         from .geo.magfield import EarthMagneticField, MagVarUnavailable
+        if self.earthMagneticField is not None:
+            # Only terminates the MagneticField coprocess; never raises.
+            self.earthMagneticField.close()
+            self.earthMagneticField = None
+
         try:
             self.earthMagneticField = EarthMagneticField(self)
         except MagVarUnavailable as e:
@@ -1192,6 +1457,15 @@ configurations are kept separate.""")
                        gps_tool_mod):
             module.setupEarthMagneticFieldProvider(self.earthMagneticField)
 
+    # Accept any arguments to allow safe use as a Tkinter variable observer
+    def _onMagFieldCoprocessChanged(self, *args):
+        # The provider is built by updateMagFieldProvider() when
+        # self.MagneticField_bin is set, which may happen before this option
+        # gets its value (e.g., in update()).
+        if self.earthMagneticField is not None:
+            self.earthMagneticField.useCoprocess(
+                self.magFieldCoprocess.get())
+
 
 class AptDigestBuilderProgressFeedbackHandler(misc.ProgressFeedbackHandler):
     def __init__(self, progressWidget, progressTextVar, progressValueVar,
@@ -1265,7 +1539,11 @@ class AptDigestBuilder:
                   prg=PROGNAME, aptDigest=APT, aptDatFiles=aptDatFilesStr)
         logger.notice(s)
 
-        self.config.aptDatSetManager.writeAptDigestFile(outputFile=APT)
+        self.config.aptDatSetManager.writeAptDigestFile(
+            outputFile=APT,
+            nbProcesses=self.config.aptDigestBuildProcesses.get())
+        self.config.computeMetarNearestStations(
+            self.config.aptDatSetManager.progressFeedbackHandler)
 
     def closeWindow(self):
         self.window.destroy()
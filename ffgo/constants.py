@@ -58,6 +58,23 @@ AIRCRAFT_STATS_FILE = join(STATS_DIR, "aircrafts.json.gz")
 FG_EXECUTABLE = misc.executableFileName("fgfs")
 # Path to airport data file.
 APT = join(USER_DATA_DIR, 'apt')
+# Spatial index for the airports of the apt digest file
+APT_INDEX = join(USER_DATA_DIR, 'apt_index')
+# Directory for the per-apt.dat file parts of the apt digest file (allows
+# incremental rebuilds)
+APT_DIGEST_SEGMENTS_DIR = join(USER_DATA_DIR, 'apt_digest_segments')
+# Directory for seekable copies of the gzipped apt.dat files
+APT_DAT_SEEKABLE_DIR = join(USER_DATA_DIR, 'apt_dat_seekable')
+# Directory for the on-disk tier of the airport data cache
+APT_DATA_CACHE_DIR = join(USER_DATA_DIR, 'apt_data_cache')
+# Nearest METAR station for every airport of the apt digest file (optional)
+METAR_NEAREST_STATIONS = join(USER_DATA_DIR, 'metar_nearest_stations')
+# Magnetic declinations sampled on a global grid for the current day
+MAG_DECL_GRID = join(USER_DATA_DIR, 'magnetic_declination_grid')
+# Cached listings of the aircraft directories
+AIRCRAFT_CATALOGUE = join(USER_DATA_DIR, 'aircraft_catalogue')
+# Metadata read from the aircraft -set.xml files
+AIRCRAFT_METADATA_INDEX = join(USER_DATA_DIR, 'aircraft_metadata_index')
 # Path to locally installed airport list.
 INSTALLED_APT = join(USER_DATA_DIR, 'apt_installed')
 # Path to config file.
@@ -99,6 +116,23 @@ DEFAULT_AIRCRAFT = 'c172p'
 DEFAULT_AIRPORT = 'KSFO'
 # Tooltip delay in milliseconds.
 TOOLTIP_DELAY = '600'
+# Delay in milliseconds before prefetching airport data after the selected
+# airport or the contents of the airport list changed.
+PREFETCH_AIRPORT_DATA_DELAY = 300
+# Delay in milliseconds after which a progress window is shown while reading
+# the aircraft directories.
+AIRCRAFT_SCAN_PROGRESS_DELAY = 500
+# Interval in milliseconds between checks for scenery tiles added or removed
+# (e.g., by TerraSync) when the airport list is limited to installed airports.
+SCENERY_WATCH_INTERVAL = 10000
+# Airports within this distance (in meters) of the selected airport are
+# candidates for prefetching if they have been used...
+PREFETCH_AIRPORT_DATA_NEIGHBOURS_RADIUS = 200000
+# ... and the most used ones are kept, up to this number.
+PREFETCH_AIRPORT_DATA_NB_NEIGHBOURS = 5
+# Maximum number of geodesic calculation results memoized by the GPS Tool and
+# the Airport Finder (cf. GeodCalc in geo/geodesy.py).
+GEODESIC_MEMO_SIZE = 20000
 # Standard width for automatically-wrapped tooltips.
 AUTOWRAP_TOOLTIP_WIDTH = "400p"
 # Used for the About box contents for instance...
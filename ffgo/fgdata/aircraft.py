@@ -35,6 +35,9 @@ class Aircraft:
         # count in question (this initial value is likely to be later
         # overridden by AircraftStatsManager.load()).
         self.useCountForShow = useCountForShow
+        # AircraftMetadata instance read from the -set.xml file, if
+        # available (cf. the 'aircraft_metadata' module)
+        self.metadata = None
 
         # Good for displaying to the user
         self.setFile = os.path.join(self.dir, "{}-set.xml".format(self.name))
@@ -66,4 +69,22 @@ class Aircraft:
         return hash(self._realSetFile)
 
     def tooltipText(self):
-        return self.dir
+        if self.metadata is None:
+            return self.dir
+
+        md = self.metadata
+        l = [self.dir]
+        if md.description:
+            l.append(md.description)
+        if md.author:
+            l.append(_("Author: {}").format(md.author))
+        if md.status:
+            l.append(_("Status: {}").format(md.status))
+        if md.rating:
+            l.append(_("Rating: {}").format(
+                ", ".join("{} {}".format(name, value)
+                          for name, value in md.rating)))
+        if md.tags:
+            l.append(_("Tags: {}").format(", ".join(md.tags)))
+
+        return "\n".join(l)
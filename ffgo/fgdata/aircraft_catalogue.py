@@ -0,0 +1,227 @@
+# aircraft_catalogue.py --- Cache for the listings of aircraft directories
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016  Florent Rougon
+#
+# This file is distributed under the terms of the DO WHAT THE FUCK YOU WANT TO
+# PUBLIC LICENSE version 2, dated December 2004, by Sam Hocevar. You should
+# have received a copy of this license along with this file. You can also find
+# it at <http://www.wtfpl.net/>.
+
+import os
+import stat
+import time
+import pickle
+import concurrent.futures
+
+from .. import misc
+from ..logging import logger
+
+
+class AircraftCatalogue:
+    """Cache for the directory listings needed to find aircraft.
+
+    Finding the available aircraft requires listing each directory of
+    Config.aircraft_dirs, then each of their subdirectories in order to
+    find the -set.xml files. With large hangars, this means thousands
+    of directory reads (which scan() performs in parallel, since they
+    can be slow on network file systems). This class remembers the
+    listings along with the modification time of the corresponding
+    directories, so that only the directories that changed since the
+    last scan need to be read again.
+
+    The catalogue can be saved to a file (pickled) and reloaded in
+    later FFGo sessions.
+
+    """
+
+    FMT_VERSION = 2
+    # Listings of directories modified less than this number of seconds
+    # before being read are not kept: a subsequent change could leave the
+    # modification time unchanged on file systems with coarse timestamps.
+    RACY_DELAY = 2.0
+    SET_FILE_SUFFIX = "-set.xml"
+    # Number of threads used to examine the aircraft directories
+    SCAN_THREADS = 8
+    # Number of directories examined between two progress updates
+    PROGRESS_INTERVAL = 100
+
+    def __init__(self, path=None, listings=None):
+        self.path = path
+        # (directory path, suffix) -> (mtime in ns, tuple of entry names);
+        # 'suffix' is None for a listing of subdirectories, SET_FILE_SUFFIX
+        # for a listing of -set.xml files.
+        self.listings = listings if listings is not None else {}
+        self._used = set()
+        self._modified = False
+
+    @classmethod
+    def load(cls, path):
+        """Load a catalogue saved with save().
+
+        Return an empty catalogue associated with 'path' if the file
+        doesn't exist or can't be read.
+
+        """
+        try:
+            with open(path, "rb") as f:
+                fmtVersion, listings = pickle.load(f)
+        except FileNotFoundError:
+            return cls(path)
+        except Exception as e:
+            # Unreadable or incompatible data
+            logger.debug("Can't load the aircraft catalogue from '{}': {!r}"
+                         .format(path, e))
+            return cls(path)
+
+        if fmtVersion != cls.FMT_VERSION:
+            return cls(path)
+
+        return cls(path, listings)
+
+    def save(self):
+        """Write the catalogue to self.path (atomically), if needed.
+
+        Listings that weren't used during the last scan() are dropped
+        beforehand.
+
+        """
+        unused = [ key for key in self.listings if key not in self._used ]
+        for key in unused:
+            del self.listings[key]
+
+        if self.path is None or not (unused or self._modified):
+            return
+
+        tmpPath = self.path + ".new"
+        with open(tmpPath, "wb") as f:
+            pickle.dump((self.FMT_VERSION, self.listings), f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(tmpPath, self.path)
+        self._modified = False
+
+    @classmethod
+    def _scanDir(cls, path, entry, dirsOnly=False):
+        """Read directory 'path' unless 'entry' is still valid for it.
+
+        'entry' is the cached (mtime, names) tuple for 'path', or None.
+        If 'dirsOnly' is true, only the names of subdirectories are
+        listed, otherwise only the names of -set.xml files.
+
+        Return None if 'path' is not a directory, otherwise a tuple
+        (entry, isNew, cacheable) where 'entry' is an up-to-date
+        (mtime, names) tuple. The names are in the order given by
+        os.scandir() (same as os.listdir()).
+
+        This method doesn't modify the instance, so that it can be run
+        in worker threads.
+
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+
+        if not stat.S_ISDIR(st.st_mode):
+            return None
+        elif entry is not None and entry[0] == st.st_mtime_ns:
+            return (entry, False, True)
+
+        if hasattr(os, "scandir"):
+            # Directory entries usually come with their type, which saves
+            # one stat() per entry compared to os.path.isdir().
+            it = os.scandir(path)
+            if dirsOnly:
+                names = tuple(e.name for e in it if e.is_dir())
+            else:
+                names = tuple(e.name for e in it
+                              if e.name.endswith(cls.SET_FILE_SUFFIX))
+        else:
+            names = os.listdir(path)
+            if dirsOnly:
+                names = tuple(name for name in names
+                              if os.path.isdir(os.path.join(path, name)))
+            else:
+                names = tuple(name for name in names
+                              if name.endswith(cls.SET_FILE_SUFFIX))
+
+        cacheable = (time.time() - st.st_mtime >= cls.RACY_DELAY)
+        return ((st.st_mtime_ns, names), True, cacheable)
+
+    def _update(self, key, res):
+        """Record a result of _scanDir() for 'key'; return the names."""
+        if res is None:
+            return None
+
+        entry, isNew, cacheable = res
+        self._used.add(key)
+
+        if not isNew:
+            pass
+        elif cacheable:
+            self.listings[key] = entry
+            self._modified = True
+        elif key in self.listings:
+            del self.listings[key]
+            self._modified = True
+
+        return entry[1]
+
+    def scan(self, aircraftDirs, progressFeedbackHandler=None):
+        """Find the -set.xml files in the subdirectories of 'aircraftDirs'.
+
+        Return a list of (path, setFiles) tuples where 'path' is a
+        subdirectory of an element of 'aircraftDirs' (such as
+        <dir>/c172p) and 'setFiles' the names of the -set.xml files it
+        contains. Elements of 'aircraftDirs' that aren't directories are
+        ignored. The order is the same as when walking the directories
+        with os.listdir().
+
+        The subdirectories of each element of 'aircraftDirs' are
+        examined in parallel by a pool of SCAN_THREADS threads. If
+        'progressFeedbackHandler' is not None, it should be a
+        misc.ProgressFeedbackHandler instance; it is only called from
+        the thread running this method.
+
+        """
+        if progressFeedbackHandler is None:
+            progressFeedbackHandler = misc.ProgressFeedbackHandler()
+
+        self._used.clear()
+        roots = []
+        for dir_ in aircraftDirs:
+            key = (dir_, None)
+            names = self._update(
+                key, self._scanDir(dir_, self.listings.get(key),
+                                   dirsOnly=True))
+            if names is not None:
+                roots.append((dir_, names))
+
+        nbDirs = sum(len(names) for dir_, names in roots)
+        progressFeedbackHandler.startPhase(
+            _("Looking for aircraft..."), 0, max(nbDirs, 1))
+        done = 0
+        res = []
+
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.SCAN_THREADS) as executor:
+            for dir_, names in roots:
+                keys = [ (os.path.join(dir_, d), self.SET_FILE_SUFFIX)
+                         for d in names ]
+                results = executor.map(
+                    lambda key: self._scanDir(key[0],
+                                              self.listings.get(key)),
+                    keys)
+
+                for key, result in zip(keys, results):
+                    setFiles = self._update(key, result)
+                    if setFiles is not None:
+                        res.append((key[0], setFiles))
+
+                    done += 1
+                    if not done % self.PROGRESS_INTERVAL:
+                        progressFeedbackHandler.setValue(done)
+
+        progressFeedbackHandler.setValue(max(nbDirs, 1))
+        return res
@@ -0,0 +1,441 @@
+# aircraft_metadata.py --- Index of metadata read from aircraft -set.xml files
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016  Florent Rougon
+#
+# This file is distributed under the terms of the DO WHAT THE FUCK YOU WANT TO
+# PUBLIC LICENSE version 2, dated December 2004, by Sam Hocevar. You should
+# have received a copy of this license along with this file. You can also find
+# it at <http://www.wtfpl.net/>.
+
+"""Index of metadata read from aircraft -set.xml files.
+
+The -set.xml file of an aircraft is a PropertyList XML file. Any
+element may have an 'include' attribute naming another PropertyList
+file, whose contents is merged into the element (before the element's
+own children, which therefore take precedence). Aircraft often put
+their /sim properties in included files, sometimes several levels
+deep.
+
+SetFileParser follows the includes lazily, i.e., only those found on
+the paths of the properties of interest (/sim/description, /sim/author,
+/sim/status, /sim/rating/* and /sim/tags/tag); included files are
+memoized, so that files included by many aircraft are only read once.
+AircraftMetadataIndex stores the results along with the modification
+times of all files read, and AircraftMetadataIndexer updates it in a
+background thread.
+
+"""
+
+import os
+import re
+import pickle
+import threading
+from xml.etree import ElementTree
+
+from ..logging import logger
+
+
+_wordCre = re.compile(r"\w+")
+
+class AircraftMetadata:
+    """Metadata for an aircraft, as found in its -set.xml file.
+
+    'rating' is a tuple of (name, value) tuples such as ("FDM", 4), in
+    document order; 'tags' is a tuple of strings. Missing text fields
+    are empty strings.
+
+    """
+
+    __slots__ = ("description", "author", "status", "rating", "tags",
+                 "searchKey")
+
+    def __init__(self, description="", author="", status="", rating=(),
+                 tags=()):
+        self.description = description
+        self.author = author
+        self.status = status
+        self.rating = tuple(rating)
+        self.tags = tuple(tags)
+        # Text searched by the aircraft chooser (cf. searchKeyForText())
+        self.searchKey = self.searchKeyForText(
+            "\n".join((description, author, status) + self.tags))
+
+    @classmethod
+    def searchKeyForText(cls, text):
+        """Return a string for word-prefix searches in 'text'.
+
+        The result is made of the lowercased words of 'text', each one
+        preceded by a space. Thus, if 'key' is the result for a query
+        and 'searchKey' the one for an aircraft, 'key in searchKey'
+        tells whether the query words appear in the metadata, the last
+        one possibly being a prefix of a word in the metadata.
+
+        """
+        return "".join(" " + word for word in _wordCre.findall(text.lower()))
+
+    def __getstate__(self):
+        return (self.description, self.author, self.status, self.rating,
+                self.tags)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __repr__(self):
+        return "{}.{}{!r}".format(__name__, type(self).__name__,
+                                  self.__getstate__())
+
+    def __eq__(self, other):
+        return (type(self) is type(other) and
+                self.__getstate__() == other.__getstate__())
+
+    def __hash__(self):
+        return hash(self.__getstate__())
+
+
+class SetFileParser:
+    """Extract AircraftMetadata from -set.xml files.
+
+    Include paths are looked up relative to the directory of the
+    including file, then relative to the parent of the aircraft
+    directory for paths starting with 'Aircraft/', and finally relative
+    to 'fgRoot' (if not empty). Included files are memoized for the
+    lifetime of the instance; -set.xml files are not, since each of
+    them is normally parsed only once.
+
+    """
+
+    # Maximum nesting level of includes (protects against include loops)
+    MAX_INCLUDE_DEPTH = 20
+
+    def __init__(self, fgRoot=""):
+        self.fgRoot = fgRoot
+        # Path of an included file -> root Element of the file, or None if
+        # it couldn't be read
+        self._trees = {}
+
+    @classmethod
+    def _parseFile(cls, path):
+        """Return the root Element of 'path', or None if it can't be read."""
+        try:
+            return ElementTree.parse(path).getroot()
+        except (OSError, ElementTree.ParseError) as e:
+            logger.debug("Can't read aircraft metadata from '{}': {}"
+                         .format(path, e))
+            return None
+
+    def _tree(self, path):
+        """Memoizing version of _parseFile(), for included files."""
+        try:
+            return self._trees[path]
+        except KeyError:
+            root = self._trees[path] = self._parseFile(path)
+            return root
+
+    def _resolveInclude(self, name, baseDir, aircraftDir):
+        candidates = [os.path.join(baseDir, name)]
+        parts = name.split('/', 1)
+        if len(parts) == 2 and parts[0] == "Aircraft":
+            candidates.append(os.path.join(os.path.dirname(aircraftDir),
+                                           parts[1]))
+        if self.fgRoot:
+            candidates.append(os.path.join(self.fgRoot, name))
+
+        for path in candidates:
+            if os.path.isfile(path):
+                return path
+
+        return None
+
+    def _children(self, element, baseDir, ctx, depth=0):
+        """Return the children of 'element' after include expansion.
+
+        The result is a list of (child, baseDir) tuples, where 'baseDir'
+        is the directory of the file containing 'child'. 'ctx' is a
+        tuple (aircraftDir, deps) where 'deps' is a set to which the
+        paths of included files are added.
+
+        """
+        res = []
+        name = element.get("include")
+
+        if name is not None and depth < self.MAX_INCLUDE_DEPTH:
+            path = self._resolveInclude(name, baseDir, ctx[0])
+            if path is not None:
+                ctx[1].add(path)
+                root = self._tree(path)
+                if root is not None:
+                    res.extend(self._children(root, os.path.dirname(path),
+                                              ctx, depth + 1))
+
+        res.extend((child, baseDir) for child in element)
+        return res
+
+    def _find(self, nodes, tag, ctx):
+        """Return the children named 'tag' of the (element, baseDir) nodes."""
+        return [ (child, childBaseDir)
+                 for element, baseDir in nodes
+                 for child, childBaseDir in self._children(element, baseDir,
+                                                           ctx)
+                 if child.tag == tag ]
+
+    def _childrenOfAll(self, nodes, ctx):
+        return [ pair for element, baseDir in nodes
+                 for pair in self._children(element, baseDir, ctx) ]
+
+    @classmethod
+    def _select(cls, nodes, tag):
+        """Return the (element, baseDir) nodes whose element is named 'tag'."""
+        return [ pair for pair in nodes if pair[0].tag == tag ]
+
+    @classmethod
+    def _text(cls, nodes):
+        # Later nodes override earlier ones
+        for element, baseDir in reversed(nodes):
+            if element.text is not None and element.text.strip():
+                return " ".join(element.text.split())
+
+        return ""
+
+    def parse(self, setFile):
+        """Read the metadata of an aircraft.
+
+        Return a tuple (metadata, deps) where 'metadata' is an
+        AircraftMetadata instance (None if 'setFile' can't be read) and
+        'deps' a sorted list of the paths of all files read, starting
+        with 'setFile' itself.
+
+        """
+        deps = set()
+        aircraftDir = os.path.dirname(setFile)
+        ctx = (aircraftDir, deps)
+
+        root = self._parseFile(setFile)
+        if root is None:
+            return (None, [setFile])
+
+        sim = self._find([(root, aircraftDir)], "sim", ctx)
+        # Children of all /sim nodes, with includes expanded once for all
+        simChildren = self._childrenOfAll(sim, ctx)
+        rating = []
+        for criterion, baseDir in self._childrenOfAll(
+                self._select(simChildren, "rating"), ctx):
+            try:
+                rating.append((criterion.tag, int(criterion.text.strip())))
+            except (AttributeError, ValueError):
+                pass
+
+        tags = []
+        for tag, baseDir in self._find(self._select(simChildren, "tags"),
+                                       "tag", ctx):
+            if tag.text is not None and tag.text.strip() and \
+               tag.text.strip() not in tags:
+                tags.append(tag.text.strip())
+
+        metadata = AircraftMetadata(
+            description=self._text(self._select(simChildren, "description")),
+            author=self._text(self._select(simChildren, "author")),
+            status=self._text(self._select(simChildren, "status")),
+            rating=self._mergeRating(rating), tags=tags)
+
+        deps.discard(setFile)
+        return (metadata, [setFile] + sorted(deps))
+
+    @classmethod
+    def _mergeRating(cls, rating):
+        # Later values override earlier ones, but keep the first position
+        values = {}
+        order = []
+        for name, value in rating:
+            if name not in values:
+                order.append(name)
+            values[name] = value
+
+        return [ (name, values[name]) for name in order ]
+
+
+class AircraftMetadataIndex:
+    """On-disk index of AircraftMetadata, keyed by -set.xml file path.
+
+    Each entry is a tuple (deps, metadata) where 'deps' is a tuple of
+    (path, mtime) tuples for the -set.xml file and all files it
+    includes (mtime in nanoseconds, None for a missing file) and
+    'metadata' an AircraftMetadata instance, or None if the -set.xml
+    file couldn't be parsed. An entry is valid as long as none of these
+    modification times changed.
+
+    """
+
+    FMT_VERSION = 1
+
+    def __init__(self, path=None, entries=None):
+        self.path = path
+        self.entries = entries if entries is not None else {}
+
+    @classmethod
+    def load(cls, path):
+        """Load an index saved with save().
+
+        Return an empty index associated with 'path' if the file
+        doesn't exist or can't be read.
+
+        """
+        try:
+            with open(path, "rb") as f:
+                fmtVersion, entries = pickle.load(f)
+        except FileNotFoundError:
+            return cls(path)
+        except Exception as e:
+            # Unreadable or incompatible data
+            logger.debug("Can't load the aircraft metadata index from '{}': "
+                         "{!r}".format(path, e))
+            return cls(path)
+
+        if fmtVersion != cls.FMT_VERSION:
+            return cls(path)
+
+        return cls(path, entries)
+
+    def save(self):
+        """Write the index to self.path (atomically)."""
+        tmpPath = self.path + ".new"
+        with open(tmpPath, "wb") as f:
+            pickle.dump((self.FMT_VERSION, self.entries), f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(tmpPath, self.path)
+
+    def get(self, setFile):
+        """Return the AircraftMetadata for 'setFile', or None.
+
+        The entry is not checked for validity (cf.
+        AircraftMetadataIndexer).
+
+        """
+        entry = self.entries.get(setFile)
+        return None if entry is None else entry[1]
+
+
+class AircraftMetadataIndexer:
+    """Update an AircraftMetadataIndex in a background thread.
+
+    start() submits a list of -set.xml files; the worker thread checks
+    the corresponding index entries (one stat() per file involved,
+    memoized) and parses the files whose entries are missing or
+    outdated. The worker never modifies the index: when a job is
+    finished, 'notify' is called from the worker thread without
+    arguments, and the owner of the index is expected to call results()
+    and apply them, as with AirportPrefetcher.
+
+    """
+
+    def __init__(self, notify=None):
+        self.notify = notify
+        self._cond = threading.Condition()
+        self._job = None           # (generation, entries, setFiles, fgRoot)
+        self._results = None       # (generation, entries, nbParsed)
+        self._generation = 0
+        self._thread = None
+
+    def start(self, index, setFiles, fgRoot=""):
+        """Start (re)indexing 'setFiles', replacing any unfinished job.
+
+        Return the generation number of the job, which is also returned
+        by results().
+
+        """
+        with self._cond:
+            self._generation += 1
+            # Copy: the index may be modified while the job runs
+            self._job = (self._generation, dict(index.entries),
+                         list(setFiles), fgRoot)
+
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    name="Aircraft_metadata_indexer",
+                    target=self._threadFunc, daemon=True)
+                self._thread.start()
+
+            self._cond.notify()
+            return self._generation
+
+    def results(self):
+        """Return the results of the last finished job, or None.
+
+        The result is a tuple (generation, entries, nbParsed) where
+        'entries' is a dictionary of up-to-date entries for all -set.xml
+        files of the job (suitable as AircraftMetadataIndex.entries) and
+        'nbParsed' the number of -set.xml files that had to be parsed.
+        Results of jobs that were replaced by start() are never
+        returned.
+
+        """
+        with self._cond:
+            res, self._results = self._results, None
+            if res is not None and res[0] != self._generation:
+                res = None
+
+        return res
+
+    def _isCurrent(self, generation):
+        with self._cond:
+            return generation == self._generation
+
+    def _threadFunc(self):
+        while True:
+            with self._cond:
+                while self._job is None:
+                    self._cond.wait()
+
+                job, self._job = self._job, None
+
+            try:
+                res = self._runJob(*job)
+            except Exception as e:
+                logger.warning("Error while indexing aircraft metadata: {!r}"
+                               .format(e))
+                continue
+
+            if res is not None:
+                with self._cond:
+                    self._results = res
+                if self.notify is not None:
+                    self.notify()
+
+    def _runJob(self, generation, oldEntries, setFiles, fgRoot):
+        parser = SetFileParser(fgRoot)
+        mtimes = {}
+
+        def mtime(path):
+            try:
+                return mtimes[path]
+            except KeyError:
+                try:
+                    res = os.stat(path).st_mtime_ns
+                except OSError:
+                    res = None
+                mtimes[path] = res
+                return res
+
+        entries = {}
+        nbParsed = 0
+
+        for i, setFile in enumerate(setFiles):
+            # Give up early if the job has been replaced
+            if not i % 100 and not self._isCurrent(generation):
+                return None
+
+            entry = oldEntries.get(setFile)
+            if entry is not None and all(mtime(path) == t
+                                         for path, t in entry[0]):
+                entries[setFile] = entry
+                continue
+
+            # Unreadable files are recorded too (with None as metadata), so
+            # that they aren't parsed again until they are modified.
+            metadata, deps = parser.parse(setFile)
+            nbParsed += 1
+            entries[setFile] = (tuple((path, mtime(path)) for path in deps),
+                                metadata)
+
+        return (generation, entries, nbParsed)
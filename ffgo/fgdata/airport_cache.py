@@ -0,0 +1,277 @@
+# airport_cache.py --- Cache for airport data read from apt.dat files
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016  Florent Rougon
+#
+# This file is distributed under the terms of the DO WHAT THE FUCK YOU WANT TO
+# PUBLIC LICENSE version 2, dated December 2004, by Sam Hocevar. You should
+# have received a copy of this license along with this file. You can also find
+# it at <http://www.wtfpl.net/>.
+
+import os
+import pickle
+import urllib.parse
+
+from ..lru_cache import LRUCache
+from ..constants import PROGVERSION
+from ..logging import logger
+
+
+class AirportDataCache:
+    """Two-tier cache for Airport instances, keyed by airport identifier.
+
+    The first tier is an in-memory LRUCache holding at most
+    'maxSize' airports. The optional second tier is a directory
+    containing one pickled Airport instance per file, which allows
+    subsequent FFGo sessions to skip parsing apt.dat files for airports
+    that have already been looked up. It holds at most 'maxDiskSize'
+    airports: when there are more, the least recently used ones are
+    removed, based on the modification times of the files (which get()
+    updates).
+
+    Cached data is only valid for a given apt digest file: setStamp()
+    must be called with data identifying it (typically, the result of
+    AirportSpatialIndex.computeDigestStamp()) each time it is (re)read.
+    The on-disk tier is emptied when the stamp changes.
+
+    The 'generation' attribute is incremented each time the cached data
+    is invalidated; this allows code reading airport data in another
+    thread to detect that its results are outdated.
+
+    """
+
+    STAMP_FILE = "stamp"
+    SUFFIX = ".pickle"
+    # When the on-disk tier is too large, it is pruned down to this fraction
+    # of 'maxDiskSize' (so that pruning doesn't happen on every put()).
+    DISK_PRUNE_RATIO = 0.8
+
+    def __init__(self, maxSize, diskCacheDir=None, maxDiskSize=1000):
+        self.memCache = LRUCache(maxSize)
+        self.diskCacheDir = diskCacheDir
+        self.maxDiskSize = maxDiskSize
+        # Number of entries in the on-disk tier (None if not known yet)
+        self._diskSize = None
+        # Identifiers of airports stored with put(..., persist=False) that
+        # haven't been written to the on-disk tier yet
+        self._notOnDisk = set()
+        self.stamp = None
+        self.diskHits = self.diskMisses = 0
+        self.generation = 0
+
+    @property
+    def hits(self):
+        return self.memCache.hits
+
+    @property
+    def misses(self):
+        return self.memCache.misses
+
+    def resize(self, maxSize):
+        self.memCache.resize(maxSize)
+
+    def resizeDisk(self, maxDiskSize):
+        """Change the maximum number of entries of the on-disk tier."""
+        self.maxDiskSize = maxDiskSize
+        if self.diskCacheDir is not None and self.stamp is not None:
+            self._pruneDiskCache()
+
+    def setDiskCacheDir(self, diskCacheDir):
+        """Change the directory used for the on-disk tier (None: disable)."""
+        self.diskCacheDir = diskCacheDir
+        self._diskSize = None
+        if diskCacheDir is not None and self.stamp is not None:
+            self._prepareDiskCacheDir()
+
+    def setStamp(self, stamp):
+        """Declare the apt digest file the cached data must correspond to."""
+        if stamp != self.stamp:
+            self.memCache.clear()
+            self._notOnDisk.clear()
+            self.generation += 1
+            self.stamp = stamp
+
+            if self.diskCacheDir is not None:
+                self._prepareDiskCacheDir()
+
+    def clear(self):
+        """Clear the in-memory tier.
+
+        The on-disk tier is automatically emptied by setStamp() when
+        the apt digest file changes.
+
+        """
+        self.memCache.clear()
+        self._notOnDisk.clear()
+        self.generation += 1
+
+    def _stampString(self):
+        return repr((PROGVERSION, self.stamp))
+
+    def _prepareDiskCacheDir(self):
+        """Make sure the on-disk tier corresponds to self.stamp."""
+        stampPath = os.path.join(self.diskCacheDir, self.STAMP_FILE)
+
+        try:
+            os.makedirs(self.diskCacheDir, exist_ok=True)
+            try:
+                with open(stampPath, "r", encoding="utf-8") as f:
+                    upToDate = (f.read() == self._stampString())
+            except FileNotFoundError:
+                upToDate = False
+
+            if not upToDate:
+                logger.info("Clearing outdated airport data cache in '{}'"
+                            .format(self.diskCacheDir))
+                for name in os.listdir(self.diskCacheDir):
+                    if name.endswith(self.SUFFIX):
+                        os.unlink(os.path.join(self.diskCacheDir, name))
+
+                with open(stampPath, "w", encoding="utf-8") as f:
+                    f.write(self._stampString())
+        except OSError as e:
+            logger.warning("Disabling the on-disk airport data cache: {}"
+                           .format(e))
+            self.diskCacheDir = None
+
+        self._diskSize = None
+
+    def _pruneDiskCache(self):
+        """Enforce the size limit of the on-disk tier.
+
+        If it has more than self.maxDiskSize entries, remove the least
+        recently used ones (according to the modification times of the
+        files) so that DISK_PRUNE_RATIO*self.maxDiskSize entries remain.
+
+        """
+        entries = []
+        try:
+            for name in os.listdir(self.diskCacheDir):
+                if name.endswith(self.SUFFIX):
+                    path = os.path.join(self.diskCacheDir, name)
+                    try:
+                        entries.append((os.stat(path).st_mtime_ns, path))
+                    except FileNotFoundError:
+                        pass
+        except OSError as e:
+            logger.warning("Unable to read directory '{}': {}".format(
+                self.diskCacheDir, e))
+            return
+
+        self._diskSize = len(entries)
+        if self._diskSize <= self.maxDiskSize:
+            return
+
+        entries.sort()
+        nbToRemove = self._diskSize - int(self.maxDiskSize *
+                                          self.DISK_PRUNE_RATIO)
+        logger.info("Removing {} airports from the airport data cache in '{}'"
+                    .format(nbToRemove, self.diskCacheDir))
+
+        for mtime, path in entries[:nbToRemove]:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning("Unable to remove '{}': {}".format(path, e))
+                continue
+
+            self._diskSize -= 1
+
+    def _diskPath(self, icao):
+        return os.path.join(self.diskCacheDir,
+                            urllib.parse.quote(icao, safe="") + self.SUFFIX)
+
+    def __contains__(self, icao):
+        """Tell whether data for 'icao' is cached (in memory or on disk).
+
+        Contrary to get(), this doesn't affect the cache statistics nor
+        the order of the in-memory entries.
+
+        """
+        return (icao in self.memCache or
+                (self.diskCacheDir is not None and
+                 os.path.isfile(self._diskPath(icao))))
+
+    def get(self, icao):
+        """Return the cached Airport instance for 'icao', or None.
+
+        If the airport was stored with put(..., persist=False), it is
+        written to the on-disk tier now.
+
+        """
+        airport = self.memCache.get(icao)
+        if airport is not None:
+            if icao in self._notOnDisk:
+                self._notOnDisk.discard(icao)
+                self._writeToDisk(icao, airport)
+            return airport
+
+        self._notOnDisk.discard(icao)
+        if self.diskCacheDir is None:
+            return None
+
+        try:
+            with open(self._diskPath(icao), "rb") as f:
+                airport = pickle.load(f)
+        except FileNotFoundError:
+            self.diskMisses += 1
+            return None
+        except Exception as e:
+            # Unreadable or incompatible data: treat as a miss.
+            logger.debug("Can't load cached airport data for {}: {!r}"
+                         .format(icao, e))
+            self.diskMisses += 1
+            return None
+
+        self.diskHits += 1
+        self.memCache.put(icao, airport)
+
+        try:
+            # Mark the entry as recently used (cf. _pruneDiskCache())
+            os.utime(self._diskPath(icao))
+        except OSError:
+            pass
+
+        return airport
+
+    def put(self, icao, airport, persist=True):
+        """Add an Airport instance to the cache.
+
+        If 'persist' is false, the airport is only stored in the
+        in-memory tier, until it is looked up with get(). This is meant
+        for prefetched data, which may never be used: writing it to disk
+        would be costly and fill the on-disk tier for nothing.
+
+        """
+        self.memCache.put(icao, airport)
+
+        if persist:
+            self._notOnDisk.discard(icao)
+            self._writeToDisk(icao, airport)
+        else:
+            self._notOnDisk.add(icao)
+            if len(self._notOnDisk) > 2*len(self.memCache):
+                # Forget airports that have been evicted from memory
+                self._notOnDisk = { i for i in self._notOnDisk
+                                    if i in self.memCache }
+
+    def _writeToDisk(self, icao, airport):
+        if self.diskCacheDir is not None and self.stamp is not None:
+            path = self._diskPath(icao)
+            try:
+                isNew = not os.path.isfile(path)
+                with open(path + ".new", "wb") as f:
+                    pickle.dump(airport, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(path + ".new", path)
+            except OSError as e:
+                logger.warning("Unable to write '{}': {}".format(path, e))
+                return
+
+            if self._diskSize is None:
+                self._pruneDiskCache()  # also counts the entries
+            elif isNew:
+                self._diskSize += 1
+                if self._diskSize > self.maxDiskSize:
+                    self._pruneDiskCache()
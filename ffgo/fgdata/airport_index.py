@@ -0,0 +1,351 @@
+# airport_index.py --- Spatial index for the airports of the apt digest file
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016  Florent Rougon
+#
+# This file is distributed under the terms of the DO WHAT THE FUCK YOU WANT TO
+# PUBLIC LICENSE version 2, dated December 2004, by Sam Hocevar. You should
+# have received a copy of this license along with this file. You can also find
+# it at <http://www.wtfpl.net/>.
+
+import os
+import array
+import math
+from math import floor, degrees, asin, sin, cos, radians
+
+from ..logging import logger
+from ..geo import geodesy
+
+
+class AirportSpatialIndex:
+    """Grid of 1°×1° cells over the airports of an AirportTable.
+
+    Each cell corresponds to a FlightGear terrain tile: cell (i, j)
+    contains the airports whose latitude is in [i - 90, i - 89) and
+    whose longitude is in [j - 180, j - 179) (the poles and the 180°
+    meridian are put in the last row and column, respectively). The
+    index is stored in “compressed sparse row” form, using two arrays:
+    the rows of the airports in cell number k = i*NB_LON_CELLS + j are
+
+      cellRows[cellStart[k]:cellStart[k+1]]
+
+    in increasing order. Building the index is a simple counting sort.
+
+    Queries return rows of the AirportTable the index was built from.
+    Apart from tileRows(), the cell-based queries return supersets,
+    suitable for use with GeodCalc.ringCandidates() or
+    GeodCalc.inverseInRing().
+
+    """
+
+    NB_LAT_CELLS = 180
+    NB_LON_CELLS = 360
+    NB_CELLS = NB_LAT_CELLS*NB_LON_CELLS
+
+    # Identifies the file format of save()
+    MAGIC = b"FFGo airport spatial index\n"
+    FMT_VERSION = 1
+    # Same as in AptDatDigest, to detect byte order changes
+    BOM = 0x0102030405060708
+
+    def __init__(self, cellStart, cellRows, digestStamp=None):
+        """Initialize an AirportSpatialIndex instance.
+
+        'cellStart' and 'cellRows' should be array.array instances with
+        typecode 'I' (see the class docstring). 'digestStamp' identifies
+        the apt digest file the index was built from (see
+        computeDigestStamp()).
+
+        """
+        self.cellStart = cellStart
+        self.cellRows = cellRows
+        self.digestStamp = digestStamp
+        self.geodCalc = geodesy.GeodCalc()
+
+    @classmethod
+    def cellCoords(cls, lat, lon):
+        """Return the (i, j) coordinates of the cell containing a point."""
+        i = min(max(floor(lat) + 90, 0), cls.NB_LAT_CELLS - 1)
+        j = (floor(lon) + 180) % cls.NB_LON_CELLS
+        return (i, j)
+
+    @classmethod
+    def build(cls, table, rows=None, digestStamp=None):
+        """Build the index for an AirportTable instance.
+
+        If 'rows' is not None, it must be a sorted sequence of rows of
+        'table': only the corresponding airports are indexed.
+
+        """
+        nbLonCells = cls.NB_LON_CELLS
+        lastLatCell = cls.NB_LAT_CELLS - 1
+        lat, lon = table.lat, table.lon
+        if rows is None:
+            rows = range(len(table))
+        n = len(rows)
+
+        cells = array.array("I", bytes(4*n))
+        counts = array.array("I", bytes(4*(cls.NB_CELLS + 1)))
+
+        for pos, row in enumerate(rows):
+            i = min(max(floor(lat[row]) + 90, 0), lastLatCell)
+            j = (floor(lon[row]) + 180) % nbLonCells
+            k = i*nbLonCells + j
+            cells[pos] = k
+            counts[k+1] += 1
+
+        # Prefix sums -> start of each cell in cellRows
+        for k in range(cls.NB_CELLS):
+            counts[k+1] += counts[k]
+
+        cellStart = counts
+        nextPos = array.array("I", cellStart)
+        cellRows = array.array("I", bytes(4*n))
+        for pos, row in enumerate(rows):
+            k = cells[pos]
+            cellRows[nextPos[k]] = row
+            nextPos[k] += 1
+
+        return cls(cellStart, cellRows, digestStamp=digestStamp)
+
+    @classmethod
+    def computeDigestStamp(cls, digestPath, table):
+        """Return data identifying a given apt digest file.
+
+        The result changes whenever the apt digest file is rewritten.
+
+        """
+        st = os.stat(digestPath)
+        return (st.st_size, st.st_mtime_ns, len(table))
+
+    # Format of the file written by save(): MAGIC, then a header made of
+    # the following unsigned 64-bit integers in native byte order: BOM,
+    # format version, apt digest size, apt digest mtime in nanoseconds,
+    # number of airports, length of cellStart; then the cellStart and
+    # cellRows arrays.
+    def save(self, path):
+        """Write the index to 'path' (atomically)."""
+        header = array.array(
+            "Q", (self.BOM, self.FMT_VERSION) + tuple(self.digestStamp) +
+            (len(self.cellStart),))
+
+        tmpPath = path + ".new"
+        with open(tmpPath, "wb") as f:
+            f.write(self.MAGIC)
+            header.tofile(f)
+            self.cellStart.tofile(f)
+            self.cellRows.tofile(f)
+
+        os.replace(tmpPath, path)
+
+    @classmethod
+    def load(cls, path, digestStamp):
+        """Read an index written by save().
+
+        Return None if the file doesn't exist, can't be parsed, or was
+        built from an apt digest file whose stamp differs from
+        'digestStamp'.
+
+        """
+        try:
+            with open(path, "rb") as f:
+                if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                    return None
+
+                header = array.array("Q")
+                header.fromfile(f, 6)
+                bom, fmtVersion, size, mtime, nbAirports, nbCellStart = \
+                                                                    header
+                if (bom != cls.BOM or fmtVersion != cls.FMT_VERSION or
+                    (size, mtime, nbAirports) != tuple(digestStamp) or
+                    nbCellStart != cls.NB_CELLS + 1):
+                    return None
+
+                cellStart = array.array("I")
+                cellStart.fromfile(f, nbCellStart)
+                cellRows = array.array("I")
+                cellRows.fromfile(f, nbAirports)
+        except (OSError, EOFError) as e:
+            logger.debug("Can't read airport index from '{}': {}".format(
+                path, e))
+            return None
+
+        return cls(cellStart, cellRows, digestStamp=tuple(digestStamp))
+
+    @classmethod
+    def loadOrBuild(cls, path, digestPath, table):
+        """Return an up-to-date index for the apt digest file 'digestPath'.
+
+        'table' must be the AirportTable read from 'digestPath'. The
+        index stored in 'path' is used if it was built from the same
+        apt digest file; otherwise, a new index is built and saved to
+        'path'.
+
+        """
+        stamp = cls.computeDigestStamp(digestPath, table)
+        index = cls.load(path, stamp)
+
+        if index is None:
+            logger.info("Building the airport spatial index")
+            index = cls.build(table, digestStamp=stamp)
+            try:
+                index.save(path)
+            except OSError as e:
+                logger.warning("Unable to write '{}': {}".format(path, e))
+
+        return index
+
+    def _cellRange(self, k):
+        return self.cellRows[self.cellStart[k]:self.cellStart[k+1]]
+
+    def tileRows(self, lat0, lon0, latSpan=1, lonSpan=1):
+        """Return the sorted list of rows for airports in a tile.
+
+        The tile is [lat0, lat0 + latSpan) × [lon0, lon0 + lonSpan),
+        where all parameters are integers (in degrees).
+
+        """
+        nbLonCells = self.NB_LON_CELLS
+        res = []
+
+        for i in range(max(lat0 + 90, 0),
+                       min(lat0 + latSpan + 90, self.NB_LAT_CELLS)):
+            for dj in range(min(lonSpan, nbLonCells)):
+                j = (lon0 + dj + 180) % nbLonCells
+                res.extend(self._cellRange(i*nbLonCells + j))
+
+        if latSpan > 1 or lonSpan > 1:
+            res.sort()
+
+        return res
+
+    def _capCells(self, lat, lon, angle):
+        """Yield the numbers of the cells intersecting a spherical cap.
+
+        The cap is made of all points whose n-vector makes an angle not
+        larger than 'angle' (in radians) with the n-vector of
+        (lat, lon).
+
+        """
+        nbLonCells = self.NB_LON_CELLS
+        eps = 1e-9               # degrees, for rounding errors
+
+        if angle >= math.pi:
+            yield from range(self.NB_CELLS)
+            return
+
+        angleDeg = degrees(angle)
+        latMin = lat - angleDeg - eps
+        latMax = lat + angleDeg + eps
+
+        if latMin <= -90.0 or latMax >= 90.0:
+            halfWidth = 180.0   # the cap contains a pole
+        else:
+            # Largest longitude difference between (lat, lon) and a point of
+            # the cap.
+            sinHalfWidth = sin(angle) / cos(radians(lat))
+            if sinHalfWidth >= 1.0:
+                halfWidth = 180.0
+            else:
+                halfWidth = degrees(asin(sinHalfWidth)) + eps
+
+        iMin = max(floor(latMin) + 90, 0)
+        iMax = min(floor(latMax) + 90, self.NB_LAT_CELLS - 1)
+
+        if halfWidth >= 180.0:
+            lonCells = range(nbLonCells)
+        else:
+            jMin = floor(lon - halfWidth) + 180
+            jMax = floor(lon + halfWidth) + 180
+            if jMax - jMin + 1 >= nbLonCells:
+                lonCells = range(nbLonCells)
+            else:
+                lonCells = [ j % nbLonCells for j in range(jMin, jMax + 1) ]
+
+        for i in range(iMin, iMax + 1):
+            for j in lonCells:
+                yield i*nbLonCells + j
+
+    def capRows(self, lat, lon, angle):
+        """Return the sorted rows of airports in cells intersecting a cap.
+
+        See _capCells() for the meaning of the parameters. The result
+        is a superset of the airports located in the cap.
+
+        """
+        cellStart, cellRows = self.cellStart, self.cellRows
+        res = []
+        for k in self._capCells(lat, lon, angle):
+            start, end = cellStart[k], cellStart[k+1]
+            if start != end:
+                res.extend(cellRows[start:end])
+
+        res.sort()
+        return res
+
+    @classmethod
+    def _maxAngleForDistance(cls, dist):
+        """Upper bound for the n-vector angle between points at 'dist' meters.
+
+        cf. GeodCalc.ringCandidates()
+
+        """
+        em = geodesy.EarthModel
+        margin = geodesy.GeodCalc.RING_PREFILTER_MARGIN
+        return dist / (em.minRadiusOfCurvature*(1 - margin))
+
+    def radiusCandidates(self, lat, lon, radius):
+        """Return the sorted rows of airports that may be within 'radius'.
+
+        'radius' is a distance in meters; the result is a superset of
+        the airports whose distance to (lat, lon) does not exceed it.
+
+        """
+        return self.capRows(lat, lon, self._maxAngleForDistance(radius))
+
+    def nearest(self, table, lat, lon, k=1, accept=None,
+                initialRadius=100000.0):
+        """Find the k airports of 'table' closest to (lat, lon).
+
+        Return a list of (row, distance) tuples sorted by increasing
+        distance (in meters), containing at most k elements. If 'accept'
+        is not None, only rows for which accept(row) is true are
+        considered. Distances are computed with GeodCalc.batchInverse()
+        using the "inverse" method; airports for which this fails
+        (nearly antipodal points without GeographicLib) are ignored.
+
+        The search radius starts at 'initialRadius' and is doubled until
+        k airports are found within it. This is exact: any airport
+        outside the cells examined for a given radius is farther than
+        that radius.
+
+        """
+        lat2, lon2 = table.lat, table.lon
+        dists = {}              # row -> distance (None if not eligible)
+        radius = initialRadius
+
+        while True:
+            angle = self._maxAngleForDistance(radius)
+            newRows = []
+            for row in self.capRows(lat, lon, angle):
+                if row in dists:
+                    continue
+                elif accept is not None and not accept(row):
+                    dists[row] = None
+                else:
+                    newRows.append(row)
+
+            g = self.geodCalc.batchInverse(
+                lat, lon, [ lat2[row] for row in newRows ],
+                [ lon2[row] for row in newRows ])
+            for row, ok, s12 in zip(newRows, g.ok, g.s12):
+                dists[row] = s12 if ok else None
+
+            found = sorted((d, row) for row, d in dists.items()
+                           if d is not None)
+            nbWithinRadius = sum(1 for d, row in found if d <= radius)
+
+            if nbWithinRadius >= k or angle >= math.pi:
+                return [ (row, d) for d, row in found[:k] ]
+
+            radius *= 2
@@ -0,0 +1,119 @@
+# airport_prefetch.py --- Read detailed airport data in a background thread
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016  Florent Rougon
+#
+# This file is distributed under the terms of the DO WHAT THE FUCK YOU WANT TO
+# PUBLIC LICENSE version 2, dated December 2004, by Sam Hocevar. You should
+# have received a copy of this license along with this file. You can also find
+# it at <http://www.wtfpl.net/>.
+
+import collections
+import threading
+
+from ..logging import logger
+
+
+class AirportPrefetcher:
+    """Read detailed airport data in a background thread.
+
+    Reading an airport from an apt.dat file (seeking in a possibly
+    gzip-compressed file, then parsing the data to build an Airport
+    instance) can take a noticeable amount of time. This class allows
+    one to do it in advance for airports that are likely to be needed
+    soon, without blocking the GUI thread.
+
+    Requests are submitted with request(); each call replaces the
+    requests that haven't been processed yet. Results are retrieved
+    with results(). The worker thread never touches any cache: it is
+    the caller's responsibility to store the results where appropriate,
+    from the thread that owns the cache.
+
+    'notify' is called from the worker thread, without arguments, each
+    time a new result is available (it may, for instance, call
+    event_generate(..., when="tail") on a Tk widget).
+
+    """
+
+    def __init__(self, notify=None):
+        self.notify = notify
+        self._cond = threading.Condition()
+        # Elements: (icao, airportIndex, aptDatSetManager, tag)
+        self._pending = collections.deque()
+        # Elements: (icao, airport, tag)
+        self._results = collections.deque()
+        self._thread = None
+
+    def request(self, aptDatSetManager, items, tag=None):
+        """Ask for airport data to be read in the background.
+
+        'items' should be an iterable of (icao, airportIndex) tuples in
+        decreasing priority order, where 'airportIndex' is a 3-tuple as
+        in AirportStub.airportIndex. Data for each airport is read using
+        aptDatSetManager.readAirportDataUsingIndex(). 'tag' is returned
+        unchanged with the corresponding results; it can be used to
+        detect outdated results.
+
+        Pending requests from previous calls are discarded.
+
+        """
+        with self._cond:
+            self._pending.clear()
+            seen = set()
+            for icao, airportIndex in items:
+                if icao not in seen:
+                    seen.add(icao)
+                    self._pending.append(
+                        (icao, airportIndex, aptDatSetManager, tag))
+
+            if self._pending and self._thread is None:
+                self._thread = threading.Thread(
+                    name="Airport_prefetcher", target=self._threadFunc,
+                    daemon=True)
+                self._thread.start()
+
+            self._cond.notify()
+
+    def cancel(self):
+        """Discard all pending requests."""
+        with self._cond:
+            self._pending.clear()
+
+    def results(self):
+        """Return the list of (icao, airport, tag) tuples read so far.
+
+        The returned results are removed from the instance.
+
+        """
+        res = []
+        while True:
+            try:
+                res.append(self._results.popleft())
+            except IndexError:
+                break
+
+        return res
+
+    def _threadFunc(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+
+                icao, airportIndex, aptDatSetManager, tag = \
+                                                    self._pending.popleft()
+
+            try:
+                found, airport = aptDatSetManager.readAirportDataUsingIndex(
+                    icao, airportIndex)
+            except Exception as e:
+                # The same lookup will be done again in the GUI thread if the
+                # data is actually needed, with proper error reporting.
+                logger.debug("Unable to prefetch data for airport {}: {!r}"
+                             .format(icao, e))
+                continue
+
+            if found:
+                self._results.append((icao, airport, tag))
+                if self.notify is not None:
+                    self.notify()
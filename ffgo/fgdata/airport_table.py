@@ -0,0 +1,398 @@
+# airport_table.py --- Column-oriented storage for the airports of the apt
+#                      digest file
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016  Florent Rougon
+#
+# This file is distributed under the terms of the DO WHAT THE FUCK YOU WANT TO
+# PUBLIC LICENSE version 2, dated December 2004, by Sam Hocevar. You should
+# have received a copy of this license along with this file. You can also find
+# it at <http://www.wtfpl.net/>.
+
+import array
+import bisect
+import collections.abc
+import mmap
+from math import isnan
+
+from .. import misc
+from .airport import AirportStub, AirportType
+
+
+class AirportTable(collections.abc.Mapping):
+    """Column-oriented table of airports.
+
+    Each field is stored in its own typed column (array.array instance
+    or memoryview cast to the appropriate format): one value per
+    airport, the airports being sorted by identifier. A given airport is
+    thus designated by its “row” in the table. The columns listed in
+    COLUMNS are available as attributes of the table (e.g., 'table.lat'
+    is the column of latitudes); since they support the buffer protocol,
+    they can also be wrapped without copying by NumPy, for instance.
+
+    This class implements the Mapping interface with airport identifiers
+    as keys and AirportStub instances as values, which allows it to be
+    used as Config.airports. These AirportStub instances are only
+    created when looked up, then cached: the same instance is returned
+    every time a given airport is looked up, which matters because the
+    stats manager stores data in these instances. Bulk queries should
+    rather use the columns and the row-based methods (filterRows(),
+    latLon(), etc.), which don't create any AirportStub instance.
+
+    """
+
+    # (name, typecode) pairs; the typecodes are valid for the array and
+    # struct modules. NaN is used for minRwyLength and maxRwyLength when the
+    # airport has no runway. The last three columns form the “airport
+    # index” (cf. AirportStub).
+    COLUMNS = (("type", "B"),
+               ("lat", "d"),
+               ("lon", "d"),
+               ("nbLandRunways", "H"),
+               ("nbWaterRunways", "H"),
+               ("nbHelipads", "H"),
+               ("minRwyLength", "d"),
+               ("maxRwyLength", "d"),
+               ("aptDatIndex", "I"),
+               ("byteOffset", "Q"),
+               ("lineNb", "I"))
+
+    def __init__(self, columns, stringOffsets, stringData):
+        """Initialize an AirportTable instance.
+
+        'columns' is a mapping from the column names listed in COLUMNS
+        to sequences of the appropriate type, all having the same
+        length. Airport identifiers and names are stored in 'stringData'
+        (UTF-8 encoded): the identifier of the airport at row i is
+        stringData[stringOffsets[2*i]:stringOffsets[2*i+1]] and its
+        name is stringData[stringOffsets[2*i+1]:stringOffsets[2*i+2]].
+
+        """
+        self._buffer = None     # set by fromBuffer()
+        self._layout = None     # ditto
+        self._setColumns(columns, stringOffsets, stringData)
+        self._stubs = [None] * self._nbAirports
+
+    def _setColumns(self, columns, stringOffsets, stringData):
+        self._columns = columns
+        for name, typecode in self.COLUMNS:
+            setattr(self, name, columns[name])
+
+        self.stringOffsets = stringOffsets
+        self.stringData = stringData
+        self._nbAirports = len(stringOffsets) - 1 >> 1
+
+    @classmethod
+    def fromDigestEntries(cls, entries):
+        """Create an AirportTable instance from apt digest entries.
+
+        'entries' should be a sequence of tuples of the form
+        (airportID, type, name, elevation, lat, lon, nbLandRunways,
+        nbWaterRunways, nbHelipads, minRwyLength, maxRwyLength,
+        airportIndex) sorted by airport identifier, where 'type' is the
+        value of an AirportType member and 'airportIndex' a 3-tuple
+        (aptDatIndex, byteOffset, lineNb).
+
+        """
+        columns = { name: array.array(typecode)
+                    for name, typecode in cls.COLUMNS }
+        stringOffsets = array.array("I", [0])
+        stringData = bytearray()
+
+        for (airportID, type_, name, elev, lat, lon, nbLandRunways,
+             nbWaterRunways, nbHelipads, minRwyLength, maxRwyLength,
+             airportIndex) in entries:
+            if minRwyLength is None:
+                minRwyLength = maxRwyLength = float("nan")
+
+            aptDatIndex, byteOffset, lineNb = airportIndex
+
+            for column, value in (("type", type_), ("lat", lat),
+                                  ("lon", lon),
+                                  ("nbLandRunways", nbLandRunways),
+                                  ("nbWaterRunways", nbWaterRunways),
+                                  ("nbHelipads", nbHelipads),
+                                  ("minRwyLength", minRwyLength),
+                                  ("maxRwyLength", maxRwyLength),
+                                  ("aptDatIndex", aptDatIndex),
+                                  ("byteOffset", byteOffset),
+                                  ("lineNb", lineNb)):
+                columns[column].append(value)
+
+            for string in (airportID, name):
+                stringData.extend(string.encode("utf-8"))
+                stringOffsets.append(len(stringData))
+
+        return cls(columns, stringOffsets, bytes(stringData))
+
+    @classmethod
+    def fromBuffer(cls, buffer, layout):
+        """Create an AirportTable instance backed by 'buffer'.
+
+        'buffer' must support the buffer protocol (typically, it is an
+        mmap.mmap instance). 'layout' is a tuple (nbAirports,
+        columnOffsets, stringOffsetsOffset, stringDataOffset,
+        stringDataSize) where 'columnOffsets' maps each column name to
+        its offset in 'buffer' (cf. AptDatDigest.bodyLayout()).
+
+        The data is not copied: the columns are memoryview objects
+        pointing into 'buffer'.
+
+        """
+        table = cls.__new__(cls)
+        table._layout = layout
+        table._setBuffer(buffer)
+        table._stubs = [None] * table._nbAirports
+
+        return table
+
+    def _setBuffer(self, buffer):
+        nbAirports, columnOffsets, stringOffsetsOffset, stringDataOffset, \
+            stringDataSize = self._layout
+        view = memoryview(buffer)
+
+        def column(offset, typecode, nbItems):
+            itemSize = array.array(typecode).itemsize
+            return view[offset:offset + nbItems*itemSize].cast(typecode)
+
+        columns = { name: column(columnOffsets[name], typecode, nbAirports)
+                    for name, typecode in self.COLUMNS }
+        self._buffer = buffer
+        self._setColumns(
+            columns, column(stringOffsetsOffset, "I", 2*nbAirports + 1),
+            view[stringDataOffset:stringDataOffset + stringDataSize])
+
+    def detach(self):
+        """Copy the data into memory and release the underlying mmap.
+
+        This allows one to overwrite or remove the file backing this
+        table without disturbing it (necessary on Windows, where a
+        memory-mapped file can't be replaced).
+
+        """
+        if not isinstance(self._buffer, mmap.mmap):
+            return
+
+        oldBuffer = self._buffer
+        oldViews = list(self._columns.values()) + [self.stringOffsets,
+                                                   self.stringData]
+        self._setBuffer(oldBuffer[:])
+
+        for view in oldViews:
+            view.release()
+
+        try:
+            oldBuffer.close()
+        except BufferError:
+            # Someone still holds a view of the old buffer; it will be
+            # closed when garbage-collected.
+            pass
+
+    # *************************************************************************
+    # *                          Row-based methods                            *
+    # *************************************************************************
+    def column(self, name):
+        """Return the column whose name is 'name'."""
+        return self._columns[name]
+
+    def _string(self, j):
+        offsets = self.stringOffsets
+        return str(self.stringData[offsets[j]:offsets[j+1]], "utf-8")
+
+    def icao(self, row):
+        """Return the identifier of the airport at 'row'."""
+        return self._string(2*row)
+
+    def name(self, row):
+        """Return the name of the airport at 'row'."""
+        return self._string(2*row + 1)
+
+    def icaos(self, rows=None):
+        """Return the list of identifiers for 'rows' (default: all)."""
+        if rows is None:
+            rows = range(self._nbAirports)
+
+        return [ self._string(2*row) for row in rows ]
+
+    def row(self, icao):
+        """Return the row of the airport whose identifier is 'icao'.
+
+        Return None if there is no such airport.
+
+        """
+        # Binary search in the sorted identifiers
+        i = bisect.bisect_left(_IcaoSequence(self), icao)
+        if i < self._nbAirports and self.icao(i) == icao:
+            return i
+        else:
+            return None
+
+    def rows(self, icaos):
+        """Return the list of rows for the airports in 'icaos'.
+
+        Identifiers that aren't in the table are skipped.
+
+        """
+        res = []
+        for icao in icaos:
+            row = self.row(icao)
+            if row is not None:
+                res.append(row)
+
+        return res
+
+    def latLon(self, rows=None):
+        """Return the latitudes and longitudes of the airports at 'rows'.
+
+        Return a tuple of two lists of floats (all airports if 'rows'
+        is None).
+
+        """
+        if rows is None:
+            return (self.lat.tolist(), self.lon.tolist())
+        else:
+            lat, lon = self.lat, self.lon
+            return ([ lat[i] for i in rows ], [ lon[i] for i in rows ])
+
+    def filterRows(self, rows=None, nbLandRunways=None, nbWaterRunways=None,
+                   nbHelipads=None, minRwyLengthAtMost=None,
+                   maxRwyLengthAtLeast=None):
+        """Return the list of rows satisfying all specified conditions.
+
+        'rows' is an iterable of rows to filter (default: all rows).
+        'nbLandRunways', 'nbWaterRunways' and 'nbHelipads' may be
+        (min, max) pairs of inclusive bounds. If 'minRwyLengthAtMost'
+        is not None, only airports whose shortest runway is at most
+        that long are kept; similarly, 'maxRwyLengthAtLeast' is a lower
+        bound for the length of the longest runway. Airports without any
+        runway never satisfy the last two conditions.
+
+        Each condition is evaluated on one column at a time for the
+        remaining rows.
+
+        """
+        res = list(range(self._nbAirports)) if rows is None else list(rows)
+
+        for column, bounds in (("nbLandRunways", nbLandRunways),
+                               ("nbWaterRunways", nbWaterRunways),
+                               ("nbHelipads", nbHelipads)):
+            if bounds is not None:
+                col = self._columns[column]
+                low, high = bounds
+                res = [ i for i in res if low <= col[i] <= high ]
+
+        # NaN (no runway) compares false with everything
+        if minRwyLengthAtMost is not None:
+            col = self.minRwyLength
+            res = [ i for i in res if col[i] <= minRwyLengthAtMost ]
+
+        if maxRwyLengthAtLeast is not None:
+            col = self.maxRwyLength
+            res = [ i for i in res if col[i] >= maxRwyLengthAtLeast ]
+
+        return res
+
+    def rwyLengths(self, row):
+        """Return the shortest and longest runway lengths at 'row'.
+
+        Return a tuple (minRwyLength, maxRwyLength) where both elements
+        are None if the airport has no runway (only helipads).
+
+        """
+        minRwyLength = self.minRwyLength[row]
+        if isnan(minRwyLength):
+            # The “airport” has no real runway (one can hope it has
+            # helipads!)
+            return (None, None)
+        else:
+            return (minRwyLength, self.maxRwyLength[row])
+
+    def stub(self, row):
+        """Return the AirportStub instance for the airport at 'row'."""
+        stub = self._stubs[row]
+        if stub is not None:
+            return stub
+
+        minRwyLength, maxRwyLength = self.rwyLengths(row)
+        stub = self._stubs[row] = AirportStub(
+            self.icao(row), self.name(row), AirportType(self.type[row]),
+            misc.DecimalCoord(self.lat[row]), misc.DecimalCoord(self.lon[row]),
+            self.nbLandRunways[row], self.nbWaterRunways[row],
+            self.nbHelipads[row], minRwyLength, maxRwyLength,
+            self.airportIndex(row))
+
+        return stub
+
+    def airportIndex(self, row):
+        """Return the location of the airport at 'row' in the apt.dat files.
+
+        The result is a 3-tuple (aptDatIndex, byteOffset, lineNb), as in
+        AirportStub.airportIndex.
+
+        """
+        return (self.aptDatIndex[row], self.byteOffset[row], self.lineNb[row])
+
+    def useCountForShow(self, row):
+        """Return the use count of the airport at 'row'.
+
+        Contrary to self.stub(row).useCountForShow, this doesn't create
+        an AirportStub instance when there is none yet (in which case,
+        the airport can't have been used).
+
+        """
+        stub = self._stubs[row]
+        return 0 if stub is None else stub.useCountForShow
+
+    def loadedItems(self):
+        """Iterate over the (icao, stub) pairs for already created stubs.
+
+        This is a cheap way of finding all AirportStub instances that
+        may have been modified since the table was created.
+
+        """
+        return ( (stub.icao, stub) for stub in self._stubs
+                 if stub is not None )
+
+    # *************************************************************************
+    # *                         The Mapping interface                         *
+    # *************************************************************************
+    def __getitem__(self, icao):
+        row = self.row(icao)
+        if row is None:
+            raise KeyError(icao)
+
+        return self.stub(row)
+
+    def __contains__(self, icao):
+        return self.row(icao) is not None
+
+    def __iter__(self):
+        return map(self.icao, range(self._nbAirports))
+
+    def __len__(self):
+        return self._nbAirports
+
+    def keys(self):
+        return self.icaos()
+
+    def values(self):
+        return map(self.stub, range(self._nbAirports))
+
+    def items(self):
+        return ( (stub.icao, stub) for stub in self.values() )
+
+
+class _IcaoSequence:
+    """Sequence of airport identifiers of an AirportTable instance.
+
+    Only meant to be used with the bisect module.
+
+    """
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, row):
+        return self.table.icao(row)
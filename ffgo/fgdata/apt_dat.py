@@ -10,12 +10,19 @@
 # it at <http://www.wtfpl.net/>.
 
 import os
+import io
+import array
 import gzip
 import re
 import textwrap
-import bisect
 import collections
 import itertools
+import heapq
+import multiprocessing
+import mmap
+import struct
+import hashlib
+import pickle
 from math import degrees, radians, cos, sin
 
 try:
@@ -27,10 +34,13 @@ except ImportError:
 from .. import constants
 from ..constants import PROGNAME
 from .. import misc
+from .. import workers
 from ..logging import logger
-from .airport import Airport, AirportStub, AirportType, LandRunway, \
+from .airport import Airport, AirportType, LandRunway, \
     WaterRunway, Helipad, RunwayType, SurfaceType, V810SurfaceType, \
     ShoulderSurfaceType, RunwayMarkings, PerimeterBuoys, HelipadEdgeLighting
+from .airport_table import AirportTable
+from . import seekable_gzip
 from . import parking
 from .parking import ParkingSource
 from ..geo import geodesy
@@ -131,14 +141,15 @@ class RawAirportInfo:
                        apt.dat spec)
         firstLineRest: list of strings representing the contents of line
                        'firstLineNum' after its row code
-        otherLines:    list of tuples of the form (lineNb, rowCode,
-                       payload), one for each line after the first line
-                       of the airport definition, where 'payload' is a
-                       string representing the line contents following
-                       its row code. These are all non-blank,
-                       non-comment, inside-one-airport-definition lines,
-                       therefore the various 'lineNb' are not
-                       necessarily consecutive.
+        otherLines:    PackedLines instance equivalent to a sequence
+                       of tuples of the form (lineNb, rowCode, payload),
+                       one for each line after the first line of the
+                       airport definition, where 'payload' is a string
+                       representing the line contents following its row
+                       code. These are all non-blank, non-comment,
+                       inside-one-airport-definition lines, therefore
+                       the various 'lineNb' are not necessarily
+                       consecutive.
 
         """
         for attr in self.__slots__:
@@ -151,6 +162,72 @@ class RawAirportInfo:
         return "{}.{}({})".format(__name__, type(self).__name__, argString)
 
 
+class PackedLines:
+    """Compact storage for the lines of an airport definition.
+
+    Big airports are defined by tens of thousands of lines in apt.dat
+    files. Instead of one (lineNb, rowCode, payload) tuple per line,
+    this class stores the line numbers and row codes in arrays, and all
+    payloads in a single string where they are separated by newline
+    characters (payloads never contain any). 'offsets[i]' is the offset
+    of payload number i in this string.
+
+    Lines are added with append(); pack() must be called once all lines
+    have been added. Afterwards, the instance behaves like a sequence of
+    (lineNb, rowCode, payload) tuples, and records() allows one to
+    iterate over the (rowCode, payload) pairs efficiently.
+
+    """
+
+    __slots__ = ("lineNbs", "rowCodes", "offsets", "payloads")
+
+    def __init__(self):
+        self.lineNbs = array.array("I")
+        self.rowCodes = array.array("I")
+        self.offsets = None
+        self.payloads = []      # list of strings until pack() is called
+
+    def append(self, lineNb, rowCode, payload):
+        self.lineNbs.append(lineNb)
+        self.rowCodes.append(rowCode)
+        self.payloads.append(payload)
+
+    def pack(self):
+        payloads = self.payloads
+        self.offsets = offsets = array.array("I", [0])
+        offsets.extend(itertools.accumulate(len(p) + 1 for p in payloads))
+        self.payloads = "\n".join(payloads)
+
+    def __len__(self):
+        return len(self.lineNbs)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self.lineNbs)
+
+        return (self.lineNbs[i], self.rowCodes[i],
+                self.payloads[self.offsets[i]:self.offsets[i+1]-1])
+
+    def __iter__(self):
+        return zip(self.lineNbs, self.rowCodes, self._payloadList())
+
+    def _payloadList(self):
+        return self.payloads.split("\n") if self.lineNbs else []
+
+    def records(self):
+        """Iterate over the (rowCode, payload) pairs.
+
+        The tuples are created by zip(), which reuses them when the
+        caller doesn't keep references to them (e.g., when unpacking
+        them in a for loop).
+
+        """
+        return zip(self.rowCodes, self._payloadList())
+
+    def __repr__(self):
+        return "{}.{}({!r})".format(__name__, type(self).__name__, list(self))
+
+
 class AptDatReader:
     """Class for reading an X-Plane/FlightGear's apt.dat file.
 
@@ -159,7 +236,11 @@ class AptDatReader:
 
     """
 
-    def __init__(self, path, index=None, progressFeedbackHandler=None):
+    # Amount of uncompressed data read at once by _iterRecordsFromBlocks()
+    TOKENIZER_BLOCK_SIZE = 1024*1024
+
+    def __init__(self, path, index=None, progressFeedbackHandler=None,
+                 seekableCopy=None, fastTokenizer=True):
         """Constructor for an AptDatReader instance.
 
         'path' may be gzipped (ending in '.gz') or uncompressed.
@@ -167,9 +248,24 @@ class AptDatReader:
         of 'path' in an externally-defined ordered list of apt.dat files
         (cf. AptDatSetManager).
 
+        If 'seekableCopy' is not None, it should be a tuple
+        (copyPath, checkpoints) where 'copyPath' is a gzip file with the
+        same uncompressed contents as 'path', written by
+        seekable_gzip.SeekableGzipWriter, and 'checkpoints' the
+        corresponding seekable_gzip.GzipCheckpoints instance. The data
+        is then read from 'copyPath', which makes seek() fast.
+
+        If 'fastTokenizer' is true, iterRawAirportInfo() and readFile()
+        split the data into records using _iterRecordsFromBlocks();
+        otherwise, they use the slower, line-by-line _readRecord()
+        method. Both ways give the same results.
+
         """
         self.path = os.path.abspath(path)
-        self.isGZipCompressed = self.path.endswith(".gz")
+        self.fastTokenizer = fastTokenizer
+        self.seekableCopy = seekableCopy
+        self.isGZipCompressed = (self.path.endswith(".gz") or
+                                 seekableCopy is not None)
         # Index of this file inside an ordered list of files (used to
         # save memory or space in some situations, as it can replace the
         # apt.dat file path given the proper mapping)
@@ -177,6 +273,10 @@ class AptDatReader:
         self.progressFeedbackHandler = (
             progressFeedbackHandler if progressFeedbackHandler is not None
             else misc.ProgressFeedbackHandler())
+        # Offset in the uncompressed stream of self.path corresponding to the
+        # start of self.file (only non-zero when reading a chunk of the file,
+        # cf. openChunk()).
+        self.baseOffset = 0
 
     def open(self):
         logger.info("Opening '{}' for reading".format(self.path))
@@ -200,7 +300,10 @@ class AptDatReader:
         #       YSSL in apt.dat 'cycle 2013.10', as opposed to 0.8 s with
         #       an index obtained using tell() [the latter in text as well as
         #       binary mode]).
-        self.rawFileObj = open(self.path, mode="rb")
+        if self.seekableCopy is None:
+            self.rawFileObj = open(self.path, mode="rb")
+        else:
+            self.rawFileObj = open(self.seekableCopy[0], mode="rb")
 
         if self.isGZipCompressed:
             # Offers transparent decompression
@@ -210,6 +313,27 @@ class AptDatReader:
 
         return self.file
 
+    def openChunk(self, data, baseOffset, baseLineNb):
+        """Prepare for reading a chunk of self.path from memory.
+
+        'data' must be a bytes object containing uncompressed data from
+        self.path, starting at the beginning of a line. 'baseOffset' is
+        the offset of this data in the uncompressed stream of
+        self.path, and 'baseLineNb' the number of lines preceding it.
+        This way, offsets and line numbers obtained from the chunk are
+        the same as if the whole file had been read.
+
+        This method replaces open(); close() must still be called when
+        done with the chunk.
+
+        """
+        self.rawFileObj = self.file = io.BytesIO(data)
+        self.isGZipCompressed = False
+        self.baseOffset = baseOffset
+        self.lineNb = baseLineNb
+
+        return self.file
+
     def __enter__(self):
         self.open()
 
@@ -234,6 +358,25 @@ class AptDatReader:
         if self.isGZipCompressed:
             self.rawFileObj.close()
 
+    def seek(self, offset):
+        """Move to 'offset' in the uncompressed stream of self.path.
+
+        Without a seekable copy, this is self.file.seek(offset), which
+        decompresses all data preceding 'offset' if self.path is
+        gzipped. With a seekable copy, decompression starts from the
+        gzip member containing 'offset'.
+
+        """
+        if self.seekableCopy is None:
+            self.file.seek(offset - self.baseOffset)
+        else:
+            uncompOffset, compOffset = self.seekableCopy[1].locate(offset)
+            self.file.close()   # doesn't close self.rawFileObj
+            self.rawFileObj.seek(compOffset)
+            self.file = gzip.GzipFile(mode="rb", fileobj=self.rawFileObj)
+            self.baseOffset = uncompOffset
+            self.file.seek(offset - uncompOffset)
+
     def approxOffset(self):
         """
         Return an offset inside self.rawFileObj suitable for progress indicators.
@@ -256,7 +399,7 @@ class AptDatReader:
         """
         while True:
             self.lineNb += 1
-            offsetBeforeStartOfLine = self.file.tell()
+            offsetBeforeStartOfLine = self.baseOffset + self.file.tell()
             # As indicated by the copyright sign at the top, X-Plane's
             # apt.dat seems to use the ISO 8859-1 encoding (it might be
             # a similar one such as ISO 8859-15, but I believe the
@@ -302,6 +445,215 @@ class AptDatReader:
 
         return (int(mo.group("code")), mo.group("rest"))
 
+    # The following regexps work on raw (undecoded) data where each line is
+    # preceded by a newline character (this allows the 're' module to look
+    # for candidate lines much faster than with '^' and re.MULTILINE).
+    #
+    # Lines that can't be records: once stripped, they are neither empty,
+    # nor comments, nor start with a row code (cf. _readline() and
+    # _readRecord()).
+    _invalidLine_cre = re.compile(rb"\n(?![ \t\r\f\v]*(?:\d|##|\n|\Z))")
+
+    @classmethod
+    def _rowCodesRegexp(cls, rowCodes):
+        """Return a compiled regexp matching lines with the given row codes.
+
+        The regexp matches a newline character followed by a line whose
+        row code (possibly written with leading zeros) is in 'rowCodes'.
+
+        """
+        codes = b"|".join(str(code).encode("ascii") for code in rowCodes)
+        return re.compile(rb"\n[ \t\r\f\v]*0*(?:" + codes + rb")(?![0-9])")
+
+    def _iterRecordsWithReadline(self, rowCodes=None):
+        """Iterate over the records of self.file using _readRecord().
+
+        Yield a tuple (lineNb, offset, code, payload, line) for each
+        record until EOF, where 'offset' is the offset of the start of
+        the line in the uncompressed stream of self.path, and 'line' is
+        the line contents as in self.line. If 'rowCodes' is not None,
+        only records whose row code is in this set are yielded; the
+        other lines are skipped based on their raw bytes, without being
+        decoded.
+
+        """
+        if rowCodes is not None:
+            yield from self._iterSelectedRecordsWithReadline(rowCodes)
+            return
+
+        while True:
+            code, payload = self._readRecord()
+            if code is None:
+                return          # EOF
+
+            yield (self.lineNb, self.offsetBeforeStartOfLine, code, payload,
+                   self.line)
+
+    def _iterSelectedRecordsWithReadline(self, rowCodes):
+        """Line-by-line counterpart of _iterSelectedRecordsFromBlocks()."""
+        keep = self._rowCodesRegexp(rowCodes).match
+        isInvalid = self._invalidLine_cre.match
+        readline = self.file.readline
+
+        while True:
+            self.lineNb += 1
+            offsetBeforeStartOfLine = self.baseOffset + self.file.tell()
+            rawLine = readline()
+            if not rawLine:
+                self.line = ""
+                return          # EOF
+
+            # The regexps need a newline character before the line
+            buf = b"\n" + rawLine
+            if not keep(buf) and not isInvalid(buf):
+                continue
+
+            # See _readline() about the encoding
+            self.line = rawLine.decode("latin_1", errors="replace").strip()
+            self.offsetBeforeStartOfLine = offsetBeforeStartOfLine
+            mo = self._record_cre.match(self.line)
+            if not mo:
+                raise ErrorParsingAptDatFile(
+                    self.path, self.lineNb,
+                    _("not a valid record: {!r}").format(self.line))
+
+            yield (self.lineNb, offsetBeforeStartOfLine,
+                   int(mo.group("code")), mo.group("rest"), self.line)
+
+    def _iterRecordsFromBlocks(self, rowCodes=None):
+        """Fast equivalent of _iterRecordsWithReadline().
+
+        Read self.file by large blocks instead of line by line. Since
+        the latin_1 codec maps each byte to exactly one character, line
+        offsets can be computed from the lengths of the decoded lines,
+        without calling tell(). The row code is extracted with string
+        methods; the _record_cre regexp is only used for lines where
+        this doesn't work. If 'rowCodes' is not None, see
+        _iterSelectedRecordsFromBlocks().
+
+        """
+        if rowCodes is not None:
+            yield from self._iterSelectedRecordsFromBlocks(rowCodes)
+            return
+
+        read = self.file.read
+        blockSize = self.TOKENIZER_BLOCK_SIZE
+        recordMatch = self._record_cre.match
+        offset = self.baseOffset + self.file.tell()
+        lineNb = self.lineNb
+        pending = ""
+
+        while True:
+            block = read(blockSize)
+            # See _readline() about the encoding
+            data = pending + block.decode("latin_1", errors="replace")
+            lines = data.split("\n")
+            # Unless at EOF, the last element is an incomplete line.
+            pending = lines.pop() if block else ""
+
+            for rawLine in lines:
+                lineNb += 1
+                lineOffset = offset
+                offset += len(rawLine) + 1
+                line = rawLine.strip()
+
+                if not line or line.startswith("##"):
+                    continue
+
+                code, sep, payload = line.partition(" ")
+                if code.isdecimal():
+                    payload = payload.lstrip(" \t")
+                else:
+                    mo = recordMatch(line)
+                    if not mo:
+                        self.lineNb = lineNb
+                        self.line = line
+                        raise ErrorParsingAptDatFile(
+                            self.path, lineNb,
+                            _("not a valid record: {!r}").format(line))
+
+                    code, payload = mo.group("code", "rest")
+
+                yield (lineNb, lineOffset, int(code), payload, line)
+
+            if not block:
+                self.lineNb = lineNb
+                return          # EOF
+
+    def _iterSelectedRecordsFromBlocks(self, rowCodes):
+        """Variant of _iterRecordsFromBlocks() for some row codes only.
+
+        Only the records whose row code is in 'rowCodes' are yielded.
+        They are found with a regexp (cf. _rowCodesRegexp()) applied to
+        the raw bytes of each block, so that the other lines---the vast
+        majority in apt.dat files: taxiways, lights, signs...---are
+        neither decoded nor split in Python code. Line numbers and
+        offsets are computed by counting newline characters between the
+        lines found. Invalid lines are reported as by
+        _iterRecordsFromBlocks().
+
+        """
+        findRecords = self._rowCodesRegexp(rowCodes).finditer
+        findInvalidLine = self._invalidLine_cre.search
+        recordMatch = self._record_cre.match
+        read = self.file.read
+        blockSize = self.TOKENIZER_BLOCK_SIZE
+        # Offset in the uncompressed stream and number of lines before 'data'
+        offset = self.baseOffset + self.file.tell()
+        lineNb = self.lineNb
+        pending = b""
+
+        def decodedLine(data, start):
+            end = data.find(b"\n", start)
+            # See _readline() about the encoding
+            return data[start:(len(data) if end < 0 else end)].decode(
+                "latin_1", errors="replace").strip()
+
+        while True:
+            block = read(blockSize)
+            if block:
+                # Only process complete lines; keep the rest for later.
+                data = pending + block
+                end = data.rfind(b"\n") + 1
+                data, pending = data[:end], data[end:]
+            else:
+                data = pending  # last line, possibly empty
+
+            # The regexps need a newline character before each line. This
+            # way, match positions in 'buf' are line start positions in
+            # 'data'.
+            buf = b"\n" + data
+            invalid = findInvalidLine(buf)
+            stop = len(buf) if invalid is None else invalid.start()
+            # Position in 'data' up to which lines have been counted
+            pos = 0
+
+            for mo in findRecords(buf, 0, stop):
+                start = mo.start()
+                lineNb += data.count(b"\n", pos, start)
+                pos = start
+                line = decodedLine(data, start)
+                # This always matches, since the line starts with digits.
+                code, payload = recordMatch(line).group("code", "rest")
+                yield (lineNb + 1, offset + start, int(code), payload, line)
+
+            if invalid is not None:
+                lineNb += data.count(b"\n", pos, stop) + 1
+                self.lineNb = lineNb
+                self.line = decodedLine(data, stop)
+                raise ErrorParsingAptDatFile(
+                    self.path, lineNb,
+                    _("not a valid record: {!r}").format(self.line))
+
+            lineNb += data.count(b"\n", pos)
+            offset += len(data)
+
+            if not block:
+                # The last line, even if empty, counts as in
+                # _iterRecordsFromBlocks().
+                self.lineNb = lineNb + 1
+                return          # EOF
+
     _formatLine_cre = re.compile(r"""(?P<version>\d+ (\.\d+)* )""", re.VERBOSE)
     def _readHeader(self):
         """Read the apt.dat header."""
@@ -362,52 +714,100 @@ class AptDatReader:
         apt.dat file.
 
         """
-        self._readHeader()
-        # In case the apt.dat file doesn't have a start-of-airport row
-        # code (1, 16 or 17) after its header (which would be invalid,
-        # except maybe if the file has nothing apart from its header)
-        skipAirport = True
+        for airportId, rawAirportInfo in self.iterRawAirportInfo(
+                bytesReadSoFar=bytesReadSoFar):
+            if airportId in airportInfoDict:
+                logger.info(_("{aptDat}:{lineNb}: skipping airport "
+                              "{aptId} (already defined earlier)")
+                            .format(aptDat=self.path,
+                                    lineNb=rawAirportInfo.firstLineNum,
+                                    aptId=airportId))
+            else:
+                airportInfoDict[airportId] = rawAirportInfo
 
-        while True:
-            rowCode, payload = self._readRecord()
-            if rowCode is None:    # EOF
-                break
-            elif not (bytesReadSoFar is None or (self.lineNb % 1000)):
+        # Past-the-end offset in the uncompressed stream
+        return self.tell()
+
+    def tell(self):
+        """Return the current offset in the uncompressed stream of self.path."""
+        return self.baseOffset + self.file.tell()
+
+    def iterRawAirportInfo(self, readHeader=True, bytesReadSoFar=None,
+                           otherRowCodes=None):
+        """Iterate over the airports defined in self.file.
+
+        Yield a tuple (airportId, rawAirportInfo) for each airport in
+        file order, where 'rawAirportInfo' is a RawAirportInfo instance.
+        Shadowing is not handled here: the same 'airportId' may be
+        yielded several times if the file defines the same airport more
+        than once.
+
+        'readHeader' should only be False when reading a chunk of the
+        file that doesn't start with the apt.dat header (cf.
+        openChunk()). 'bytesReadSoFar' has the same meaning as for
+        readFile().
+
+        If 'otherRowCodes' is not None, only the lines whose row code is
+        in this set are stored in the 'otherLines' attribute of the
+        RawAirportInfo instances; the other lines are skipped as early
+        as possible. For instance, RawAirportInfoParser.APT_DIGEST_ROW_CODES
+        is enough for RawAirportInfoParser.readAirportDataForAptDigest().
+
+        """
+        if readHeader:
+            self._readHeader()
+
+        if otherRowCodes is None:
+            rowCodes = None
+        else:
+            # Row codes that delimit airport definitions are always needed
+            rowCodes = frozenset(otherRowCodes).union((1, 16, 17, 99))
+
+        if self.fastTokenizer:
+            records = self._iterRecordsFromBlocks(rowCodes)
+        else:
+            records = self._iterRecordsWithReadline(rowCodes)
+
+        rawAirportInfo = None
+        nextProgressLineNb = 0
+
+        for lineNb, offset, rowCode, payload, line in records:
+            if bytesReadSoFar is not None and lineNb >= nextProgressLineNb:
                 self.progressFeedbackHandler.setValue(
                     bytesReadSoFar + self.approxOffset())
+                nextProgressLineNb = lineNb + 1000
 
             if rowCode in (1, 16, 17):
                 # Land airport, seaplane base or heliport
+                if rawAirportInfo is not None:
+                    rawAirportInfo.otherLines.pack()
+                    yield (currentAirportId, rawAirportInfo)
+
                 l = payload.split(None, maxsplit=4)
                 if len(l) < 5:
                     raise ErrorParsingAptDatFile(
-                        self.path, self.lineNb,
-                        _("not enough fields in record: {!r}")
-                        .format(self.line))
+                        self.path, lineNb,
+                        _("not enough fields in record: {!r}").format(line))
 
                 currentAirportId = l[3].upper() # often an ICAO, but not always
-                if currentAirportId in airportInfoDict:
-                    logger.info(_("{aptDat}:{lineNb}: skipping airport "
-                                  "{aptId} (already defined earlier)")
-                                .format(aptDat=self.path, lineNb=self.lineNb,
-                                        aptId=currentAirportId))
-                    skipAirport = True
-                else:
-                    airportInfoDict[currentAirportId] = rawAirportInfo = \
-                        RawAirportInfo(self.index, self.offsetBeforeStartOfLine,
-                                       self.lineNb, rowCode, l, [])
-                    skipAirport = False
+                rawAirportInfo = RawAirportInfo(
+                    self.index, offset, lineNb, rowCode, l, PackedLines())
             elif rowCode == 99:
                 logger.debug(_("{aptDat}:{lineNb}: row code 99 found "
                                "(normally at end of file)")
-                             .format(aptDat=self.path, lineNb=self.lineNb))
-                skipAirport = True
-            elif not skipAirport:
-                # Line belonging to an already started, and not skipped airport
-                # entry; just append it.
-                rawAirportInfo.otherLines.append((self.lineNb, rowCode,
-                                                  payload))
-        return self.file.tell() # past-the-end offset in the uncompressed stream
+                             .format(aptDat=self.path, lineNb=lineNb))
+                if rawAirportInfo is not None:
+                    rawAirportInfo.otherLines.pack()
+                    yield (currentAirportId, rawAirportInfo)
+                    rawAirportInfo = None
+            elif rawAirportInfo is not None:
+                # Line belonging to an already started airport entry; just
+                # append it.
+                rawAirportInfo.otherLines.append(lineNb, rowCode, payload)
+
+        if rawAirportInfo is not None:
+            rawAirportInfo.otherLines.pack()
+            yield (currentAirportId, rawAirportInfo)
 
     def getRawAirportInfoUsingIndex(self, airportID, localIndex):
         """Get raw airport info from self.file using a local index.
@@ -426,7 +826,7 @@ class AptDatReader:
         """
         logger.debug("{meth}(): entered method".format(
             meth=self.getRawAirportInfoUsingIndex.__qualname__))
-        self.file.seek(localIndex[0])
+        self.seek(localIndex[0])
         logger.debug("{meth}(): after the seek()".format(
             meth=self.getRawAirportInfoUsingIndex.__qualname__))
         # Pretend we've just read the line preceding the start-of-airport
@@ -450,14 +850,16 @@ class AptDatReader:
                 _("expected {aptId1!r}, but found {aptId2!r} instead")
                 .format(aptId1=airportID, aptId2=foundAirportId))
 
-        otherLines = []
+        otherLines = PackedLines()
 
         while True:
             rowCode, payload = self._readRecord()
             if rowCode in (None, 1, 16, 17, 99):
                 break           # EOF, start of next airport or end of data
             else:
-                otherLines.append((self.lineNb, rowCode, payload))
+                otherLines.append(self.lineNb, rowCode, payload)
+
+        otherLines.pack()
 
         rawAirportInfo = RawAirportInfo(self.index, localIndex[0],
                                         localIndex[1], airportRowCode,
@@ -465,6 +867,165 @@ class AptDatReader:
         return (True, rawAirportInfo)
 
 
+class RunwayGeometryBatch:
+    """Runway geometry for the apt digest file, computed for many airports.
+
+    The apt digest file needs, for each airport, the centroid of all
+    runway ends and helipads, and the lengths of the shortest and
+    longest runways. Instead of creating NVector instances and calling
+    GeodCalc methods for each runway as it is parsed, the coordinates
+    are gathered in arrays for a whole batch of airports with
+    addRunway(), addPoint(), etc., then compute() processes all of them
+    in a few tight loops. The results are the same as those computed
+    one runway at a time in the scalar code.
+
+    Each runway record adds one “row” to the batch: a land or water
+    runway (two ends whose length must be computed), a single point
+    such as a helipad (no length) or a precomputed n-vector sum.
+    endAirport() must be called after the rows of each airport have
+    been added.
+
+    """
+
+    ROW_POINT, ROW_RUNWAY, ROW_VECTOR = range(3)
+
+    def __init__(self):
+        self.rowKinds = array.array("b")
+        # Four values per row: lat1, lon1, lat2, lon2 for runways; lat, lon
+        # and two unused values for points; x, y, z and the runway length
+        # (NaN if not applicable) for precomputed n-vector sums.
+        self.rowData = array.array("d")
+        # Airport number i owns rows airportStart[i] to airportStart[i+1]-1
+        self.airportStart = array.array("I", [0])
+
+    def __len__(self):
+        """Return the number of airports in the batch."""
+        return len(self.airportStart) - 1
+
+    def addRunway(self, lat1, lon1, lat2, lon2):
+        """Add a land or water runway given by the coordinates of its ends."""
+        self.rowKinds.append(self.ROW_RUNWAY)
+        self.rowData.extend((lat1, lon1, lat2, lon2))
+
+    def addPoint(self, lat, lon):
+        """Add a point counting as one runway end (e.g., a helipad)."""
+        self.rowKinds.append(self.ROW_POINT)
+        self.rowData.extend((lat, lon, 0.0, 0.0))
+
+    def addVector(self, nvecSum, length):
+        """Add a precomputed sum of n-vectors (NVector instance).
+
+        'length' is the corresponding runway length, or None.
+
+        """
+        self.rowKinds.append(self.ROW_VECTOR)
+        self.rowData.extend((nvecSum.x, nvecSum.y, nvecSum.z,
+                             float("nan") if length is None else length))
+
+    def endAirport(self):
+        """Declare that all rows for the current airport have been added."""
+        self.airportStart.append(len(self.rowKinds))
+
+    def _rowVectorsAndLengths(self):
+        """Compute the n-vector sum and runway length of every row.
+
+        Return a tuple (xs, ys, zs, lengths) of array.array instances
+        indexed by row number. Rows without a length have NaN in
+        'lengths'.
+
+        """
+        nbRows = len(self.rowKinds)
+        xs = array.array("d", bytes(8*nbRows))
+        ys = array.array("d", bytes(8*nbRows))
+        zs = array.array("d", bytes(8*nbRows))
+        lengths = array.array("d", [float("nan")]) * nbRows
+        data = self.rowData
+        rowPoint, rowRunway = self.ROW_POINT, self.ROW_RUNWAY
+        # Same formula as in NVector.fromLatLon()
+        _cos, _sin, _radians = cos, sin, radians
+
+        for i, kind in enumerate(self.rowKinds):
+            j = 4*i
+            if kind == rowRunway:
+                lat1, lon1, lat2, lon2 = data[j:j+4]
+                cosLat1, cosLat2 = _cos(_radians(lat1)), _cos(_radians(lat2))
+                xs[i] = (cosLat1*_cos(_radians(lon1)) +
+                         cosLat2*_cos(_radians(lon2)))
+                ys[i] = (cosLat1*_sin(_radians(lon1)) +
+                         cosLat2*_sin(_radians(lon2)))
+                zs[i] = _sin(_radians(lat1)) + _sin(_radians(lat2))
+            elif kind == rowPoint:
+                lat, lon = data[j], data[j+1]
+                cosLat = _cos(_radians(lat))
+                xs[i] = cosLat*_cos(_radians(lon))
+                ys[i] = cosLat*_sin(_radians(lon))
+                zs[i] = _sin(_radians(lat))
+            else:
+                xs[i], ys[i], zs[i], lengths[i] = data[j:j+4]
+
+        self._computeRunwayLengths(lengths)
+        return (xs, ys, zs, lengths)
+
+    def _computeRunwayLengths(self, lengths):
+        """Fill 'lengths' for the ROW_RUNWAY rows.
+
+        This uses the same methods as
+        RawAirportInfoParser.computeLengthForAptDigest(), except that
+        nothing is logged when Vincenty's method works (which is, by
+        far, the most common case).
+
+        """
+        data = self.rowData
+        rowRunway = self.ROW_RUNWAY
+        vincenty = RawAirportInfoParser.geodCalc._vincentyInverseWithFallback
+        scalarMethod = RawAirportInfoParser.computeLengthForAptDigest
+
+        for i, kind in enumerate(self.rowKinds):
+            if kind == rowRunway:
+                j = 4*i
+                lat1, lon1, lat2, lon2 = data[j:j+4]
+                try:
+                    lengths[i] = vincenty(lat1, lon1, lat2, lon2, 1e-12,
+                                          False)["s12"]
+                except geodesy.error:
+                    lengths[i] = scalarMethod(lat1, lon1, lat2, lon2)
+
+    def compute(self):
+        """Compute the runway geometry for all airports of the batch.
+
+        Return a list containing, for each airport in the order they
+        were added, a tuple (x, y, z, minRwyLength, maxRwyLength) where
+        (x, y, z) is the sum of the n-vectors of all runway ends and
+        helipads, and minRwyLength and maxRwyLength are in meters (None
+        if the airport has no runway with a length).
+
+        """
+        xs, ys, zs, lengths = self._rowVectorsAndLengths()
+        airportStart = self.airportStart
+        res = []
+
+        for a in range(len(airportStart) - 1):
+            sx = sy = sz = 0.0
+            minLength = maxLength = None
+
+            for i in range(airportStart[a], airportStart[a+1]):
+                sx += xs[i]
+                sy += ys[i]
+                sz += zs[i]
+
+                length = lengths[i]
+                if length == length: # not NaN
+                    if minLength is None: # no length encountered yet
+                        minLength = maxLength = length
+                    else:
+                        minLength = min(minLength, length)
+                        maxLength = max(maxLength, length)
+
+            res.append((sx, sy, sz, minLength, maxLength))
+
+        return res
+
+
 class RawAirportInfoParser:
     """Parser for RawAirportInfo instances.
 
@@ -473,6 +1034,9 @@ class RawAirportInfoParser:
 
     """
     geodCalc = geodesy.GeodCalc()
+    # Row codes used by readAirportDataForAptDigest(), apart from those
+    # starting an airport definition (cf. AptDatReader.iterRawAirportInfo())
+    APT_DIGEST_ROW_CODES = frozenset((10, 100, 101, 102))
 
     def __init__(self, rawAirportInfo, indexToAptDatPath):
         self.aptInfo = rawAirportInfo
@@ -490,15 +1054,15 @@ class RawAirportInfoParser:
             return (str(self.aptInfo.rowCode) + ' ' +
                     ' '.join(self.aptInfo.firstLineRest))
         else:
-            lineInfo = self.aptInfo.otherLines[self.lineIdx-1]
-            return str(lineInfo[1]) + ' ' + lineInfo[2]
+            lineNb, rowCode, payload = \
+                self.aptInfo.otherLines[self.lineIdx-1]
+            return str(rowCode) + ' ' + payload
 
     def curLineNum(self):
         if not self.lineIdx:
             return self.aptInfo.firstLineNum
         else:
-            lineInfo = self.aptInfo.otherLines[self.lineIdx-1]
-            return lineInfo[0]
+            return self.aptInfo.otherLines.lineNbs[self.lineIdx-1]
 
     def raiseErrorParsingAptDatFile(self, message, cause=None):
         exc = ErrorParsingAptDatFile(self.aptDatPath(), self.curLineNum(),
@@ -786,7 +1350,7 @@ class RawAirportInfoParser:
         minRwyLength = maxRwyLength = None
         parkings = {}
 
-        for lineNb, code, payload in aptInfo.otherLines:
+        for code, payload in aptInfo.otherLines.records():
             self.lineIdx += 1
             isRwyRecord, nvecSum0, rwyLength = \
                 self._processPotentialRunwayRow(
@@ -829,11 +1393,28 @@ class RawAirportInfoParser:
                           helipads, parkings)
         return airport
 
-    # Not the prettiest method ever written, but trying to be fast!
     def readAirportDataForAptDigest(self):
         """Extract info from self for the apt digest file.
 
-        Similar to airportInstance() above.
+        Similar to airportInstance() above. When many airports are to
+        be processed, using gatherAirportDataForAptDigest() with a
+        RunwayGeometryBatch is faster.
+
+        """
+        batch = RunwayGeometryBatch()
+        partialData = self.gatherAirportDataForAptDigest(batch)
+        return self.completeAirportDataForAptDigest(partialData,
+                                                    batch.compute()[0])
+
+    # Not the prettiest method ever written, but trying to be fast!
+    def gatherAirportDataForAptDigest(self, batch):
+        """First stage of readAirportDataForAptDigest().
+
+        Add the runway geometry of the airport to 'batch' (a
+        RunwayGeometryBatch instance) and return the other data needed
+        for the apt digest file. The result, along with the element of
+        batch.compute() for this airport, should be passed to
+        completeAirportDataForAptDigest().
 
         """
         aptInfo = self.aptInfo
@@ -847,45 +1428,76 @@ class RawAirportInfoParser:
         airportID = firstLineRest[3].upper() # often an ICAO, but not always
         airportName = firstLineRest[4]
 
-        landRunways = []
-        waterRunways = []
-        helipads = []
-        nvecSum = NVector(0.0, 0.0, 0.0)
-        minRwyLength = maxRwyLength = None
+        nbLandRunways = nbWaterRunways = nbHelipads = 0
 
-        for lineNb, code, payload in aptInfo.otherLines:
+        for code, payload in aptInfo.otherLines.records():
             self.lineIdx += 1
-            isRwyRecord, nvecSum0, rwyLength = \
-                self._processPotentialRunwayRow(
-                    code, payload, landRunways, waterRunways, helipads,
-                    readDetails=False)
-            if isRwyRecord:
-                nvecSum += nvecSum0
+            if code == 100:
+                lat1, lon1, lat2, lon2, length, rwys = self.processLandRunway(
+                    payload, readDetails=False, computeLength=False)
+                batch.addRunway(lat1, lon1, lat2, lon2)
+                nbLandRunways += 2
+            elif code == 101:
+                lat1, lon1, lat2, lon2, length, rwys = \
+                    self.processWaterRunway(payload, readDetails=False,
+                                            computeLength=False)
+                batch.addRunway(lat1, lon1, lat2, lon2)
+                nbWaterRunways += 2
+            elif code == 102:
+                lat, lon, rwys = self.processHelipad(payload,
+                                                     readDetails=False)
+                batch.addPoint(lat, lon)
+                nbHelipads += 1
+            elif code == 10:
+                # Old format, rare enough to be handled the slow way
+                landRunways = []
+                waterRunways = []
+                helipads = []
+                isRwyRecord, nvecSum, rwyLength = \
+                    self._processPotentialRunwayRow(
+                        code, payload, landRunways, waterRunways, helipads,
+                        readDetails=False)
+                if isRwyRecord:
+                    batch.addVector(nvecSum, rwyLength)
+                    nbLandRunways += len(landRunways)
+                    nbWaterRunways += len(waterRunways)
+                    nbHelipads += len(helipads)
+
+        batch.endAirport()
 
-                if rwyLength is not None:
-                    if minRwyLength is None: # no length encountered yet
-                        minRwyLength = maxRwyLength = rwyLength
-                    else:
-                        minRwyLength = min(minRwyLength, rwyLength)
-                        maxRwyLength = max(maxRwyLength, rwyLength)
+        # The first element (the 3-tuple) is the “airport index”
+        return ((aptInfo.aptDatIndex, aptInfo.byteOffset, aptInfo.firstLineNum),
+                airportID, airportName, airportType, airportElev,
+                nbLandRunways, nbWaterRunways, nbHelipads)
+
+    @classmethod
+    def completeAirportDataForAptDigest(cls, partialData, geometry):
+        """Second stage of readAirportDataForAptDigest().
+
+        'partialData' is the result of gatherAirportDataForAptDigest()
+        and 'geometry' the corresponding element of
+        RunwayGeometryBatch.compute().
+
+        """
+        airportIndex, airportID, airportName, airportType, airportElev, \
+            nbLandRunways, nbWaterRunways, nbHelipads = partialData
+        x, y, z, minRwyLength, maxRwyLength = geometry
 
         # Each land or water runway is counted twice, once for each runway
         # end.
-        n = 2*len(landRunways) + 2*len(waterRunways) + len(helipads)
+        n = 2*nbLandRunways + 2*nbWaterRunways + nbHelipads
         if n > 0:
             # Will give the coordinates of the centroid of all runway ends +
             # helipads of the airport (each runway has a sort of “double
             # weight” because of its two ends, contrary to a helipad).
             avgLat, avgLon = map(misc.DecimalCoord,
-                                 nvecSum.scalarDiv(n).latLon())
+                                 NVector(x, y, z).scalarDiv(n).latLon())
         else:
             avgLat, avgLon = None, None
 
-        # The first element (the 3-tuple) is the “airport index”
-        return ((aptInfo.aptDatIndex, aptInfo.byteOffset, aptInfo.firstLineNum),
-                airportID, airportName, airportType, airportElev,
-                avgLat, avgLon, len(landRunways), len(waterRunways),
-                len(helipads), minRwyLength, maxRwyLength)
+        return (airportIndex, airportID, airportName, airportType, airportElev,
+                avgLat, avgLon, nbLandRunways, nbWaterRunways, nbHelipads,
+                minRwyLength, maxRwyLength)
 
     def _processPotentialRunwayRow(self, code, payload, landRunways,
                                    waterRunways, helipads, readDetails=True):
@@ -1157,20 +1769,20 @@ class RawAirportInfoParser:
             dist = cls.geodCalc.vincentyInverseWithFallback(lat1, lon1,
                                                             lat2, lon2)["s12"]
         except geodesy.error:
-            if cls.geodCalc.karneyMethodAvailable():
-                # Slower, extremely accurate and should work in all cases, but
-                # may not be installed for all users.
-                dist = cls.geodCalc.karneyInverse(lat1, lon1,
-                                                  lat2, lon2)["s12"]
-            else:
-                # Very fast, not very accurate but still OK for a runway
-                # length (I believe I found a 9 cm difference for a 3600 m
-                # long runway near Paris). Should work in all cases.
-                dist = cls.geodCalc.modifiedFccDistance(lat1, lon1, lat2, lon2)
+            # Slower, extremely accurate and should work in all cases
+            # (GeographicLib if installed, otherwise GeodCalc's built-in
+            # implementation).
+            dist = cls.geodCalc.karneyInverse(lat1, lon1, lat2, lon2)["s12"]
         return dist
 
-    def processLandRunway(self, payload, readDetails=True):
-        """Process a runway record with code 100."""
+    def processLandRunway(self, payload, readDetails=True,
+                           computeLength=True):
+        """Process a runway record with code 100.
+
+        When 'readDetails' and 'computeLength' are both False, the
+        runway length is not computed (None is returned instead).
+
+        """
         e = payload.split()
         if len(e) < 22:
             self.raiseErrorParsingAptDatFile(
@@ -1198,12 +1810,20 @@ class RawAirportInfoParser:
                               surfaceType, shoulderSurfaceType,
                               runwayMarkings2, smoothness)
             return (lat1, lon1, lat2, lon2, length, (rwy1, rwy2))
-        else:
+        elif computeLength:
             length = self.computeLengthForAptDigest(lat1, lon1, lat2, lon2)
             return (lat1, lon1, lat2, lon2, length, (None, None))
+        else:
+            return (lat1, lon1, lat2, lon2, None, (None, None))
+
+    def processWaterRunway(self, payload, readDetails=True,
+                            computeLength=True):
+        """Process a runway record with code 101.
 
-    def processWaterRunway(self, payload, readDetails=True):
-        """Process a runway record with code 101."""
+        When 'readDetails' and 'computeLength' are both False, the
+        runway length is not computed (None is returned instead).
+
+        """
         e = payload.split()
         if len(e) < 8:
             self.raiseErrorParsingAptDatFile(
@@ -1226,9 +1846,11 @@ class RawAirportInfoParser:
             rwy1 = WaterRunway(name1, lat1, lon1, azimuth1, length, width, None)
             rwy2 = WaterRunway(name2, lat2, lon2, azimuth2, length, width, None)
             return (lat1, lon1, lat2, lon2, length, (rwy1, rwy2))
-        else:
+        elif computeLength:
             length = self.computeLengthForAptDigest(lat1, lon1, lat2, lon2)
             return (lat1, lon1, lat2, lon2, length, (None, None))
+        else:
+            return (lat1, lon1, lat2, lon2, None, (None, None))
 
     def processHelipad(self, payload, readDetails=True):
         """Process a “runway” record with code 102 (i.e., a helipad)."""
@@ -1258,6 +1880,220 @@ class RawAirportInfoParser:
         return (lat, lon, (rwy,))
 
 
+def _aptDigestEntryFromAirportData(airportData):
+    airportIndex, airportID, airportName, airportType, airportElev, \
+        avgLat, avgLon, nbLandRunways, nbWaterRunways, nbHelipads, \
+        minRwyLength, maxRwyLength = airportData
+
+    return (airportID, airportType.value, airportName, airportElev,
+            avgLat, avgLon, nbLandRunways, nbWaterRunways, nbHelipads,
+            minRwyLength, maxRwyLength, airportIndex)
+
+
+def _aptDigestEntry(rawAirportInfo, indexToAptDatPath):
+    """Return the data for one airport of the apt digest file.
+
+    The result is a tuple whose first element is the airport
+    identifier, so that a list of such tuples can be sorted in the
+    order used for the apt digest file.
+
+    """
+    return _aptDigestEntryFromAirportData(
+        RawAirportInfoParser(
+            rawAirportInfo, indexToAptDatPath).readAirportDataForAptDigest())
+
+
+def _aptDigestEntries(rawAirportInfos, indexToAptDatPath):
+    """Return the _aptDigestEntry() results for many airports.
+
+    'rawAirportInfos' should be an iterable of RawAirportInfo
+    instances; the result is a list in the same order. The runway
+    geometry of all airports is computed at once with a
+    RunwayGeometryBatch, and each RawAirportInfo instance can be freed
+    as soon as the next one is requested from the iterable.
+
+    """
+    batch = RunwayGeometryBatch()
+    partialData = [
+        RawAirportInfoParser(
+            rawAirportInfo,
+            indexToAptDatPath).gatherAirportDataForAptDigest(batch)
+        for rawAirportInfo in rawAirportInfos ]
+
+    complete = RawAirportInfoParser.completeAirportDataForAptDigest
+    return [ _aptDigestEntryFromAirportData(complete(data, geometry))
+             for data, geometry in zip(partialData, batch.compute()) ]
+
+
+def _aptDigestEntriesForChunk(aptDatList, aptDatIndex, data, baseOffset,
+                              baseLineNb, makeGzipMembers=False,
+                              fastTokenizer=True):
+    """Read and parse a chunk of an apt.dat file.
+
+    This function is run in worker processes (via
+    workers.aptDigestEntriesForChunk()) when the apt digest file is
+    built with several processes. The arguments are those of
+    AptDatReader.openChunk(), plus the list of apt.dat files and the
+    index of the file the chunk comes from. 'fastTokenizer' is passed
+    to the AptDatReader constructor.
+
+    Return a tuple (entries, gzipMembers) where 'entries' is a list of
+    _aptDigestEntry() results in file order, without any shadowing
+    applied (this is done by the caller). If 'makeGzipMembers' is true,
+    'gzipMembers' is the chunk compressed with
+    seekable_gzip.gzipMembers(); otherwise, it is None.
+
+    """
+    reader = AptDatReader(aptDatList[aptDatIndex], aptDatIndex,
+                          fastTokenizer=fastTokenizer)
+    reader.openChunk(data, baseOffset, baseLineNb)
+
+    try:
+        # Only the first chunk of a file starts with the apt.dat header
+        entries = _aptDigestEntries(
+            (rawAirportInfo for airportId, rawAirportInfo in
+             reader.iterRawAirportInfo(
+                 readHeader=(baseOffset == 0),
+                 otherRowCodes=RawAirportInfoParser.APT_DIGEST_ROW_CODES)),
+            aptDatList)
+    finally:
+        reader.close()
+
+    members = seekable_gzip.gzipMembers(data) if makeGzipMembers else None
+    return (entries, members)
+
+
+class AptDigestSegmentStore:
+    """Directory of apt digest data for individual apt.dat files.
+
+    A “segment” holds the _aptDigestEntry() results for all airports
+    of one apt.dat file (sorted, with only the first definition kept
+    for airports defined several times in the file), as well as the
+    uncompressed size of the file. Segments are identified by the SHA-1
+    hash of the apt.dat file contents, so that they remain usable when
+    a file is touched without being modified, or moved to a different
+    position in AptDatSetManager.aptDatList. To avoid hashing unchanged
+    files, a manifest maps each apt.dat path to the size, timestamp and
+    hash it had when its segment was last looked up or saved.
+
+    Segments don't depend on the position of the file in the list: the
+    'aptDatIndex' element of each airport index is set to None.
+
+    """
+
+    # Changing this invalidates all existing segments
+    FMT_VERSION = 1
+    MANIFEST = "manifest"
+    SUFFIX = ".seg"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest = {}      # path -> (size, timestamp, hash)
+
+        try:
+            with open(os.path.join(directory, self.MANIFEST), "rb") as f:
+                manifest = pickle.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.debug("Can't read the apt digest segments manifest in "
+                         "'{}': {!r}".format(directory, e))
+        else:
+            if manifest.get("stamp") == self._stamp():
+                self.manifest = manifest["files"]
+
+    @classmethod
+    def _stamp(cls):
+        # The digest entries depend on the code that computes them
+        return (constants.PROGVERSION, AptDatDigest.CURRENT_FMT_VERSION,
+                cls.FMT_VERSION)
+
+    @classmethod
+    def contentsHash(cls, path):
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024*1024), b""):
+                h.update(block)
+
+        return h.hexdigest()
+
+    def _hash(self, path, size, timestamp):
+        try:
+            cachedSize, cachedTimestamp, contentsHash = self.manifest[path]
+        except KeyError:
+            pass
+        else:
+            if (cachedSize, cachedTimestamp) == (size, timestamp):
+                return contentsHash
+
+        contentsHash = self.contentsHash(path)
+        self.manifest[path] = (size, timestamp, contentsHash)
+        return contentsHash
+
+    def _segmentPath(self, contentsHash):
+        return os.path.join(self.directory, contentsHash + self.SUFFIX)
+
+    def load(self, path, size, timestamp):
+        """Return the segment for an apt.dat file, or None.
+
+        The result is a tuple (entries, uncompSize). None is returned if
+        there is no segment for the current contents of 'path'.
+
+        """
+        try:
+            segmentPath = self._segmentPath(
+                self._hash(path, size, timestamp))
+            with open(segmentPath, "rb") as f:
+                stamp, uncompSize, entries = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.debug("Can't load the apt digest segment for '{}': {!r}"
+                         .format(path, e))
+            return None
+
+        return (entries, uncompSize) if stamp == self._stamp() else None
+
+    def save(self, path, size, timestamp, entries, uncompSize):
+        """Save the segment for an apt.dat file.
+
+        'entries' should be a sorted list of _aptDigestEntry() results
+        for the airports of 'path'.
+
+        """
+        segmentPath = self._segmentPath(self._hash(path, size, timestamp))
+        entries = [ entry[:-1] + ((None,) + entry[-1][1:],)
+                    for entry in entries ]
+
+        with open(segmentPath + ".new", "wb") as f:
+            pickle.dump((self._stamp(), uncompSize, entries), f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(segmentPath + ".new", segmentPath)
+
+    def commit(self, paths):
+        """Write the manifest and remove segments not used by 'paths'.
+
+        'paths' should be the apt.dat files of the last apt digest file
+        built; the segments of other files are removed.
+
+        """
+        self.manifest = { path: info for path, info in self.manifest.items()
+                          if path in paths }
+        usedSegments = frozenset(
+            contentsHash + self.SUFFIX for size, timestamp, contentsHash
+            in self.manifest.values())
+
+        for name in os.listdir(self.directory):
+            if name.endswith(self.SUFFIX) and name not in usedSegments:
+                os.unlink(os.path.join(self.directory, name))
+
+        manifestPath = os.path.join(self.directory, self.MANIFEST)
+        with open(manifestPath + ".new", "wb") as f:
+            pickle.dump({"stamp": self._stamp(), "files": self.manifest}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(manifestPath + ".new", manifestPath)
+
+
 class AptDatSetManager:
     """High-level class for working with apt.dat files.
 
@@ -1269,8 +2105,19 @@ class AptDatSetManager:
     *not* gathered from several files.
 
     """
+    # Approximate size of the chunks of uncompressed apt.dat data handed to
+    # worker processes when building the apt digest file with several
+    # processes. Each chunk ends at an airport boundary.
+    PARALLEL_READ_CHUNK_SIZE = 4*1024*1024
+    # Start of a line beginning a land airport, seaplane base or heliport
+    # definition (row code 1, 16 or 17)
+    _airportStartLine_cre = re.compile(rb"\n[ \t]*1[67]?[ \t]")
+    # Names of the files written in self.seekableCopiesDir
+    _seekableCopyFileName_cre = re.compile(r"^[0-9]+\.gz(\.idx)?(\.new)?$")
+
     def __init__(self, aptDatList, aptDatSizes=None, aptDatTimestamps=None,
-                 progressFeedbackHandler=None):
+                 progressFeedbackHandler=None, seekableCopiesDir=None,
+                 fastTokenizer=True, segmentsDir=None):
         """Initialize an AptDatSetManager instance.
 
         If 'aptDatSizes' and 'aptDatTimestamps' are None, the
@@ -1280,7 +2127,28 @@ class AptDatSetManager:
         If 'progressFeedbackHandler' is None, a do-nothing
         misc.ProgressFeedbackHandler instance is created.
 
+        'seekableCopiesDir' is the directory where seekable copies of
+        the gzipped apt.dat files are written along with the apt digest
+        file (cf. seekable_gzip); it defaults to
+        constants.APT_DAT_SEEKABLE_DIR.
+
+        'fastTokenizer' selects the method used to split apt.dat files
+        into records when building the apt digest file (cf.
+        AptDatReader); this is mainly useful for comparisons.
+
+        'segmentsDir' is the directory where the data obtained from each
+        apt.dat file is saved when building the apt digest file (cf.
+        AptDigestSegmentStore); it defaults to
+        constants.APT_DIGEST_SEGMENTS_DIR.
+
         """
+        self.fastTokenizer = fastTokenizer
+        self.segmentsDir = (
+            constants.APT_DIGEST_SEGMENTS_DIR if segmentsDir is None
+            else segmentsDir)
+        self.seekableCopiesDir = (
+            constants.APT_DAT_SEEKABLE_DIR if seekableCopiesDir is None
+            else seekableCopiesDir)
         self.updateListsAndTotalSize(aptDatList, aptDatSizes, aptDatTimestamps)
         # Allows this class to give progress feedback during time-consuming
         # operations
@@ -1297,6 +2165,100 @@ class AptDatSetManager:
                                  if aptDatTimestamps is None
                                  else aptDatTimestamps)
         self.totalSize = sum(self.aptDatSizes)
+        # Cache for seekableCopy()
+        self._seekableCopies = {}
+
+    def seekableCopyPath(self, aptDatIndex):
+        """Path to the seekable copy of an apt.dat file."""
+        return os.path.join(self.seekableCopiesDir,
+                            "{}.gz".format(aptDatIndex))
+
+    def seekableCopy(self, aptDatIndex):
+        """Return the seekable copy of an apt.dat file, if usable.
+
+        Return a (copyPath, checkpoints) tuple suitable for the
+        'seekableCopy' parameter of AptDatReader, or None if there is no
+        up-to-date seekable copy of the specified file.
+
+        """
+        try:
+            return self._seekableCopies[aptDatIndex]
+        except KeyError:
+            pass
+
+        res = None
+        path = self.seekableCopyPath(aptDatIndex)
+        checkpoints = seekable_gzip.GzipCheckpoints.load(
+            seekable_gzip.SeekableGzipWriter.checkpointsPath(path))
+
+        if (checkpoints is not None and os.path.isfile(path) and
+            checkpoints.sourceSize == self.aptDatSizes[aptDatIndex] and
+            checkpoints.sourceTimestamp ==
+            self.aptDatTimestamps[aptDatIndex]):
+            res = (path, checkpoints)
+
+        self._seekableCopies[aptDatIndex] = res
+        return res
+
+    def _needsSeekableCopy(self, aptDatIndex):
+        # Uncompressed files can already be seeked quickly
+        return self.aptDatList[aptDatIndex].endswith(".gz")
+
+    def _seekableCopyWriter(self, aptDatIndex):
+        return seekable_gzip.SeekableGzipWriter(
+            self.seekableCopyPath(aptDatIndex),
+            self.aptDatSizes[aptDatIndex],
+            self.aptDatTimestamps[aptDatIndex])
+
+    def _prepareSeekableCopiesDir(self, keep=()):
+        """Create the directory for seekable copies and clean it up.
+
+        The seekable copies of the apt.dat files whose indices are in
+        'keep' are preserved.
+
+        """
+        os.makedirs(self.seekableCopiesDir, exist_ok=True)
+        self._seekableCopies.clear()
+        keptFiles = set()
+        for i in keep:
+            path = self.seekableCopyPath(i)
+            keptFiles.update(
+                (os.path.basename(path), os.path.basename(
+                    seekable_gzip.SeekableGzipWriter.checkpointsPath(path))))
+
+        for name in os.listdir(self.seekableCopiesDir):
+            if (self._seekableCopyFileName_cre.match(name) and
+                name not in keptFiles):
+                os.unlink(os.path.join(self.seekableCopiesDir, name))
+
+    def _writeSeekableCopiesSerially(self, indices):
+        """Write the seekable copies of some gzipped apt.dat files.
+
+        'indices' is an iterable of indices into self.aptDatList.
+
+        """
+        indices = [ i for i in indices if self._needsSeekableCopy(i) ]
+        if not indices:
+            return
+
+        bytesReadSoFar = 0
+        self.progressFeedbackHandler.startPhase(
+            _("Writing seekable copies of apt.dat files..."),
+            0, sum(self.aptDatSizes[i] for i in indices))
+
+        for i in indices:
+            with AptDatReader(self.aptDatList[i], i) as reader, \
+                 self._seekableCopyWriter(i) as writer:
+                while True:
+                    data = reader.file.read(seekable_gzip.CHECKPOINT_INTERVAL)
+                    if not data:
+                        break
+
+                    writer.write(data)
+                    self.progressFeedbackHandler.setValue(
+                        bytesReadSoFar + reader.approxOffset())
+
+            bytesReadSoFar += self.aptDatSizes[i]
 
     def findAptDatTimestamps(self):
         return [ os.path.getmtime(path) for path in self.aptDatList ]
@@ -1326,7 +2288,257 @@ class AptDatSetManager:
         else:
             return True
 
-    def writeAptDigestFile(self, outputFile=None):
+    def _aptDatChunks(self, reader):
+        """Split the uncompressed contents of an apt.dat file into chunks.
+
+        'reader' must be an open AptDatReader instance. Each chunk ends
+        right before a line starting a new airport (or at EOF), so that
+        no airport definition is split between two chunks.
+
+        Yield tuples of the form (data, baseOffset, baseLineNb,
+        approxOffset) where the first three elements are suitable for
+        AptDatReader.openChunk() and 'approxOffset' is the value of
+        reader.approxOffset() after the chunk was read (for progress
+        feedback).
+
+        """
+        baseOffset = baseLineNb = 0
+        pending = b""
+
+        while True:
+            block = reader.file.read(self.PARALLEL_READ_CHUNK_SIZE)
+            if not block:       # EOF
+                break
+
+            buf = pending + block
+            # Look for the last start-of-airport line in the new data (also
+            # considering the newline char that may end 'pending').
+            cutPos = None
+            for mo in self._airportStartLine_cre.finditer(
+                    buf, max(0, len(pending) - 1)):
+                cutPos = mo.start() + 1
+
+            if cutPos is None:
+                # Huge airport definition, or no airport at all: accumulate
+                pending = buf
+                continue
+
+            chunk, pending = buf[:cutPos], buf[cutPos:]
+            yield (chunk, baseOffset, baseLineNb, reader.approxOffset())
+            baseOffset += len(chunk)
+            baseLineNb += chunk.count(b"\n")
+
+        if pending:
+            yield (pending, baseOffset, baseLineNb, reader.approxOffset())
+
+    def _skippedAirportMsg(self, airportID, airportIndex):
+        aptDatIndex, byteOffset, lineNb = airportIndex
+        logger.info(_("{aptDat}:{lineNb}: skipping airport "
+                      "{aptId} (already defined earlier)")
+                    .format(aptDat=self.aptDatList[aptDatIndex],
+                            lineNb=lineNb, aptId=airportID))
+
+    def _firstDefinitions(self, aptDatIndex, rawAirportInfoIterator):
+        """Yield the RawAirportInfo instances not shadowed in the same file.
+
+        'rawAirportInfoIterator' should be the result of
+        AptDatReader.iterRawAirportInfo() for self.aptDatList[aptDatIndex].
+
+        """
+        seenAirports = set()
+
+        for airportID, rawAirportInfo in rawAirportInfoIterator:
+            if airportID in seenAirports:
+                self._skippedAirportMsg(
+                    airportID, (aptDatIndex, rawAirportInfo.byteOffset,
+                                rawAirportInfo.firstLineNum))
+            else:
+                seenAirports.add(airportID)
+                yield rawAirportInfo
+
+    def _readAptDatFilesSerially(self, indices):
+        """Read and parse some apt.dat files in the current process.
+
+        'indices' is a sequence of indices into self.aptDatList. Return
+        a dictionary mapping each of these indices to a tuple
+        (entries, uncompSize) where 'entries' is a sorted list of
+        _aptDigestEntry() results for the corresponding file (cf.
+        AptDigestSegmentStore).
+
+        Each airport is parsed as soon as it has been read, so that
+        only one RawAirportInfo instance is alive at any given time.
+        The runway geometry is computed once per file (cf.
+        _aptDigestEntries()).
+
+        """
+        res = {}
+        bytesReadSoFar = 0
+
+        self.progressFeedbackHandler.startPhase(
+            _("Reading apt.dat files..."),
+            0, sum(self.aptDatSizes[i] for i in indices))
+
+        for i in indices:
+            with \
+             AptDatReader(
+               self.aptDatList[i], i,
+               progressFeedbackHandler=self.progressFeedbackHandler,
+               fastTokenizer=self.fastTokenizer) as reader:
+                entries = _aptDigestEntries(
+                    self._firstDefinitions(
+                        i, reader.iterRawAirportInfo(
+                            bytesReadSoFar=bytesReadSoFar,
+                            otherRowCodes=
+                            RawAirportInfoParser.APT_DIGEST_ROW_CODES)),
+                    self.aptDatList)
+                uncompSize = reader.tell()
+
+            entries.sort()
+            res[i] = (entries, uncompSize)
+            bytesReadSoFar += self.aptDatSizes[i]
+
+        return res
+
+    def _readAptDatFilesInParallel(self, indices, nbProcesses):
+        """Read and parse some apt.dat files using a pool of processes.
+
+        The apt.dat files are decompressed in the current process and
+        split into chunks at airport boundaries (cf. _aptDatChunks()).
+        The chunks are read and parsed by 'nbProcesses' worker
+        processes, then the results are merged in chunk order, so that
+        the shadowing rule is the same as when reading serially: the
+        first definition of a given airport wins.
+
+        Return a dictionary with the same format as
+        _readAptDatFilesSerially().
+
+        """
+        # Index of an apt.dat file -> list of entries for this file
+        airports = {}
+        # Identifiers of the airports found so far in the file being merged
+        seenAirports = set()
+        bytesReadSoFar = 0
+        aptDatUncompressedSizes = {}
+        # Deque of (AsyncResult, bytesRead, aptDatIndex, writer) tuples, in
+        # file and chunk order. 'writer' is the SeekableGzipWriter for the
+        # seekable copy of the file the chunk comes from, or None. An
+        # AsyncResult set to None marks the end of a file; 'writer', if not
+        # None, is then closed.
+        pendingChunks = collections.deque()
+        # Limit the number of chunks in memory at any given time
+        maxPendingChunks = 2*nbProcesses
+
+        self.progressFeedbackHandler.startPhase(
+            _("Reading apt.dat files..."),
+            0, sum(self.aptDatSizes[i] for i in indices))
+
+        def mergeOldestChunk():
+            asyncResult, bytesRead, aptDatIndex, writer = \
+                                                    pendingChunks.popleft()
+            if asyncResult is None:
+                if writer is not None:
+                    writer.close()
+                airports[aptDatIndex].sort()
+                seenAirports.clear()
+                return
+
+            entries, gzipMembers = asyncResult.get()
+            if writer is not None:
+                for uncompSize, member in gzipMembers:
+                    writer.writeMember(uncompSize, member)
+
+            fileEntries = airports.setdefault(aptDatIndex, [])
+            for entry in entries:
+                airportID = entry[0]
+                if airportID in seenAirports:
+                    self._skippedAirportMsg(airportID, entry[-1])
+                else:
+                    seenAirports.add(airportID)
+                    fileEntries.append(entry)
+
+            self.progressFeedbackHandler.setValue(bytesRead)
+
+        logger.info("Reading apt.dat files with {} processes".format(
+            nbProcesses))
+
+        # Worker processes are never forked: FFGo may have other threads
+        # running at this point (airport data prefetcher, MagneticField
+        # reader, etc.), and a forked child could inherit locks held by them.
+        # The worker entry points are in the lightweight 'workers' module,
+        # which spawned processes can import without dragging in the GUI.
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(
+                nbProcesses, initializer=workers.initWorkerProcess) as pool:
+            for i in indices:
+                uncompSize = 0
+                writer = (self._seekableCopyWriter(i)
+                          if self._needsSeekableCopy(i) else None)
+
+                with AptDatReader(self.aptDatList[i], i) as reader:
+                    for data, baseOffset, baseLineNb, approxOffset in \
+                        self._aptDatChunks(reader):
+                        pendingChunks.append(
+                            (pool.apply_async(
+                                workers.aptDigestEntriesForChunk,
+                                (self.aptDatList, i, data, baseOffset,
+                                 baseLineNb, writer is not None,
+                                 self.fastTokenizer)),
+                             bytesReadSoFar + approxOffset, i, writer))
+                        uncompSize = baseOffset + len(data)
+
+                        if len(pendingChunks) > maxPendingChunks:
+                            mergeOldestChunk()
+
+                airports.setdefault(i, [])
+                pendingChunks.append((None, None, i, writer))
+                aptDatUncompressedSizes[i] = uncompSize
+                bytesReadSoFar += self.aptDatSizes[i]
+
+            while pendingChunks:
+                mergeOldestChunk()
+
+        return { i: (airports[i], aptDatUncompressedSizes[i])
+                 for i in indices }
+
+    @classmethod
+    def _segmentRun(cls, aptDatIndex, entries):
+        for entry in entries:
+            yield (entry[0], aptDatIndex, entry)
+
+    def _mergeSegments(self, segments):
+        """Merge per-file apt digest data.
+
+        'segments' is a list containing, for each file of
+        self.aptDatList in order, a tuple (entries, uncompSize) where
+        'entries' is a sorted list of _aptDigestEntry() results for this
+        file. The 'aptDatIndex' element of the airport index in these
+        entries is ignored.
+
+        Return a sorted list of _aptDigestEntry() results in which
+        airports defined in several files are taken from the first one.
+        Since the per-file lists are already sorted, they are simply
+        merged (no sorting is necessary).
+
+        """
+        runs = [ self._segmentRun(i, entries)
+                 for i, (entries, uncompSize) in enumerate(segments) ]
+        airports = []
+        prevAirportID = None
+
+        # For a given airport, the entry from the earliest file comes first.
+        for airportID, aptDatIndex, entry in heapq.merge(*runs):
+            airportIndex = (aptDatIndex,) + entry[-1][1:]
+
+            if airportID == prevAirportID:
+                self._skippedAirportMsg(airportID, airportIndex)
+            else:
+                prevAirportID = airportID
+                airports.append(entry[:-1] + (airportIndex,))
+
+        return airports
+
+    def writeAptDigestFile(self, outputFile=None, nbProcesses=1,
+                           incremental=True):
         """Write the apt digest file.
 
         The resulting file is read on each startup of FFGo, therefore
@@ -1340,105 +2552,94 @@ class AptDatSetManager:
             apt.dat line number in case an error is encountered;
           - perform the searches offered by the Airport Finder.
 
+        'nbProcesses' is the number of processes used to read and parse
+        the apt.dat files: 1 means everything is done in the current
+        process, 0 means one worker process per CPU.
+
+        The data obtained from each apt.dat file is saved in
+        self.segmentsDir (cf. AptDigestSegmentStore). If 'incremental'
+        is true, only the apt.dat files for which this directory has no
+        up-to-date data are read.
+
         """
         if outputFile is None:
             outputFile = constants.APT
 
-        airportInfoDict = {}
-        airports = []
-        bytesReadSoFar = 0
-        aptDatUncompressedSizes = []
-
-        self.progressFeedbackHandler.startPhase(_("Reading apt.dat files..."),
-                                                0, self.totalSize)
-
-        for i, f in enumerate(self.aptDatList):
-            with \
-             AptDatReader(
-               f, i,
-               progressFeedbackHandler=self.progressFeedbackHandler) as reader:
-                aptDatUncompressedSizes.append(
-                    reader.readFile(airportInfoDict,
-                                    bytesReadSoFar=bytesReadSoFar))
-
-            bytesReadSoFar += self.aptDatSizes[i]
-
-        nbAirports = len(airportInfoDict)
-        self.progressFeedbackHandler.startPhase(
-            _("Loading data for {nbAirports} airports...")
-            .format(nbAirports=nbAirports),
-            0, nbAirports)
-
-        for i, rawAirportInfo in enumerate(airportInfoDict.values()):
-            airportIndex, airportID, airportName, airportType, airportElev, \
-                avgLat, avgLon, nbLandRunways, nbWaterRunways, nbHelipads, \
-                minRwyLength, maxRwyLength = \
-                    RawAirportInfoParser(
-                        rawAirportInfo,
-                        self.aptDatList).readAirportDataForAptDigest()
-
-            if not (i % 300):
-                self.progressFeedbackHandler.setValue(i+1)
-
-            # This should be better than sorting the list once complete
-            # from an algorithmic point of view, however the difference is
-            # hardly measurable with apt.dat 2013.10, build 20131335,
-            # containing 34074 airports (the sort() taking about 0.04 s).
-            bisect.insort_right(
-                airports,
-                (airportID, airportType.value, airportName, airportElev,
-                 avgLat, avgLon, nbLandRunways, nbWaterRunways,
-                 nbHelipads, minRwyLength, maxRwyLength, airportIndex))
+        if not nbProcesses:
+            nbProcesses = os.cpu_count() or 1
 
-        logger.info("Opening {prg}'s apt digest file ('{aptDigest}') for "
-                    "writing".format(prg=PROGNAME, aptDigest=outputFile))
-
-        self.progressFeedbackHandler.startPhase(
-            _("Writing {prg}'s apt digest file...").format(prg=PROGNAME),
-            0, nbAirports)
-
-        with open(outputFile, "w", encoding="utf-8") as f:
-            # The uncompressed file sizes will be used later for a basic safety
-            # check when using an index, because the seek() method of
-            # gzip.GzipFile behaves pretty badly in some cases (seemingly never
-            # returning), and I think this happens when using an invalid index.
-            f.write(AptDatDigest.header(
-                # Create an iterable of AptDatFileInfo instances
-                map(AptDatFileInfo._make,
-                    zip(self.aptDatList, self.aptDatSizes,
-                        aptDatUncompressedSizes, self.aptDatTimestamps))))
-
-            # Optimizing this with writelines() doesn't seem to be worth it
-            # (measured with with older code, but this certainly still applies:
-            # 0.11 seconds with writelines() instead of 0.12, while the whole
-            # method took about 28 seconds for 34074 airprts).
-            for i, (airportID, type_, name, elev, avgLat, avgLon,
-                    nbLandRunways, nbWaterRunways, nbHelipads, minRwyLength,
-                    maxRwyLength, airportIndex) in enumerate(airports):
-                nbRunways = ';'.join(( str(s) for s in
-                                       (nbLandRunways, nbWaterRunways,
-                                        nbHelipads) ))
-                if minRwyLength is None:
-                    minMaxRwyLengths = ""
-                else:
-                    minMaxRwyLengths = "{:.04f};{:.04f}".format(minRwyLength,
-                                                                maxRwyLength)
-
-                # Encode the airport index:
-                #   - aptDatIndex (index of an apt.dat file inside the ordered
-                #     list of apt.dat files used by FlightGear) followed by;
-                #   - byte offset inside said file, followed by;
-                #   - line number (where the airport definition starts).
-                indexRepr = ';'.join(( str(i) for i in airportIndex ))
-
-                f.write(
-                    '\0'.join([airportID, name, str(type_),
-                               avgLat.precisionRepr(), avgLon.precisionRepr(),
-                               nbRunways, minMaxRwyLengths, indexRepr])
-                    + '\n')
+        try:
+            os.makedirs(self.segmentsDir, exist_ok=True)
+            segmentStore = AptDigestSegmentStore(self.segmentsDir)
+        except OSError as e:
+            logger.warning("Unable to use '{}': {}".format(
+                self.segmentsDir, e))
+            segmentStore = None
+
+        segments = [None]*len(self.aptDatList)
+        if incremental and segmentStore is not None:
+            for i, path in enumerate(self.aptDatList):
+                segments[i] = segmentStore.load(
+                    path, self.aptDatSizes[i], self.aptDatTimestamps[i])
+
+        toRead = [ i for i, segment in enumerate(segments) if segment is None ]
+        logger.info("Reading {} of {} apt.dat files (data for the others is "
+                    "up-to-date in '{}')".format(
+                        len(toRead), len(segments), self.segmentsDir))
+
+        # The seekable copies of the gzipped apt.dat files make later lookups
+        # with readAirportDataUsingIndex() fast. They are written during the
+        # parallel read, or in a separate pass when reading serially. Those of
+        # the files that are not read again are kept if still valid.
+        self._prepareSeekableCopiesDir(
+            keep=[ i for i, segment in enumerate(segments)
+                   if segment is not None and
+                   self.seekableCopy(i) is not None ])
+
+        if not toRead:
+            newSegments = {}
+        elif nbProcesses > 1:
+            newSegments = self._readAptDatFilesInParallel(toRead, nbProcesses)
+        else:
+            newSegments = self._readAptDatFilesSerially(toRead)
 
-                if not (i % 300):
-                    self.progressFeedbackHandler.setValue(i+1)
+        for i, segment in newSegments.items():
+            segments[i] = segment
+            if segmentStore is not None:
+                try:
+                    segmentStore.save(self.aptDatList[i], self.aptDatSizes[i],
+                                      self.aptDatTimestamps[i], *segment)
+                except OSError as e:
+                    logger.warning("Unable to save apt digest data for '{}' "
+                                   "in '{}': {}".format(self.aptDatList[i],
+                                                        self.segmentsDir, e))
+
+        self._seekableCopies.clear()
+        self._writeSeekableCopiesSerially(
+            [ i for i in range(len(self.aptDatList))
+              if self.seekableCopy(i) is None ])
+        self._seekableCopies.clear()
+
+        airports = self._mergeSegments(segments)
+        # The uncompressed file sizes will be used later for a basic safety
+        # check when using an index, because the seek() method of
+        # gzip.GzipFile behaves pretty badly in some cases (seemingly never
+        # returning), and I think this happens when using an invalid index.
+        aptDatFilesInfo = [
+            AptDatFileInfo(path, size, uncompSize, timestamp)
+            for path, size, (entries, uncompSize), timestamp in
+            zip(self.aptDatList, self.aptDatSizes, segments,
+                self.aptDatTimestamps) ]
+
+        AptDatDigest.write(outputFile, aptDatFilesInfo, airports,
+                           progressFeedbackHandler=self.progressFeedbackHandler)
+
+        if segmentStore is not None:
+            try:
+                segmentStore.commit(self.aptDatList)
+            except OSError as e:
+                logger.warning("Unable to update '{}': {}".format(
+                    self.segmentsDir, e))
 
     def readAirportDataUsingIndex(self, airportID, index):
         """Read detailed airport data from an apt.dat file using an index.
@@ -1457,7 +2658,9 @@ class AptDatSetManager:
             otherwise None.
 
         """
-        with AptDatReader(self.aptDatList[index[0]], index[0]) as aptDat:
+        with AptDatReader(
+                self.aptDatList[index[0]], index[0],
+                seekableCopy=self.seekableCopy(index[0])) as aptDat:
             found, rawAirportInfo = aptDat.getRawAirportInfoUsingIndex(
                 airportID, index[1:])
 
@@ -1475,7 +2678,26 @@ class AptDatDigest:
     # Magic number for reliable identification of FFGo's apt file format
     FORMAT_MAGIC_NB = 7856251374982125
     # Current version of the apt digest file format
-    CURRENT_FMT_VERSION = 4
+    CURRENT_FMT_VERSION = 5
+
+    # Since format version 5, the apt digest file consists of a text header
+    # followed by a binary part. The binary part starts at the first offset
+    # that is a multiple of BODY_ALIGNMENT after the header, with a prefix
+    # made of a byte order mark, the number of airports and the size of the
+    # string data. Then come the columns listed below, in this order, each
+    # column containing one value per airport and starting at an aligned
+    # offset. Airports are sorted by identifier. All numbers use the native
+    # byte order and sizes (the byte order mark allows one to detect apt
+    # digest files copied from incompatible machines).
+    BODY_ALIGNMENT = 8
+    BODY_PREFIX_FMT = "QQQ"
+    BYTE_ORDER_MARK = 0x0102030405060708
+    # After the columns, an array of 2*nbAirports + 1 offsets (typecode
+    # "I") into the string data gives the start and end of the identifier
+    # (offsets 2*i and 2*i + 1) and of the name (offsets 2*i + 1 and
+    # 2*i + 2) of the airport at row i. The string data follows, UTF-8
+    # encoded. This is exactly the in-memory layout used by AirportTable.
+    BODY_COLUMNS = AirportTable.COLUMNS
 
     @classmethod
     def header(cls, aptDatFilesInfo, formatVersion=CURRENT_FMT_VERSION):
@@ -1493,6 +2715,116 @@ class AptDatDigest:
        prg=PROGNAME, magicNumber=cls.FORMAT_MAGIC_NB, fmtVer=formatVersion,
        aptDatFilesInfo='\n'.join(l))
 
+    @classmethod
+    def _alignedOffset(cls, offset):
+        return -(-offset // cls.BODY_ALIGNMENT) * cls.BODY_ALIGNMENT
+
+    @classmethod
+    def bodyLayout(cls, bodyOffset, nbAirports, stringDataSize):
+        """Compute the layout of the binary part of an apt digest file.
+
+        Return a tuple (columnOffsets, stringOffsetsOffset,
+        stringDataOffset, end) where 'columnOffsets' is a dictionary
+        mapping each column name to its offset, and 'end' is the size of
+        the whole file.
+
+        """
+        offset = bodyOffset + struct.calcsize(cls.BODY_PREFIX_FMT)
+        columnOffsets = {}
+
+        for name, typecode in cls.BODY_COLUMNS:
+            offset = cls._alignedOffset(offset)
+            columnOffsets[name] = offset
+            offset += nbAirports*struct.calcsize(typecode)
+
+        stringOffsetsOffset = cls._alignedOffset(offset)
+        stringDataOffset = (stringOffsetsOffset +
+                            (2*nbAirports + 1)*struct.calcsize("I"))
+
+        return (columnOffsets, stringOffsetsOffset, stringDataOffset,
+                stringDataOffset + stringDataSize)
+
+    @classmethod
+    def write(cls, path, aptDatFilesInfo, airports,
+              progressFeedbackHandler=None):
+        """Write an apt digest file.
+
+        'aptDatFilesInfo' is a sequence of AptDatFileInfo instances and
+        'airports' a sorted sequence of tuples of the form (airportID,
+        type, name, elevation, lat, lon, nbLandRunways, nbWaterRunways,
+        nbHelipads, minRwyLength, maxRwyLength, airportIndex) where
+        'type' is the value of an AirportType member and 'airportIndex'
+        a 3-tuple (aptDatIndex, byteOffset, lineNb).
+
+        The file is written under a temporary name, then renamed to
+        'path', so that existing memory mappings of a previous version
+        of the file are not disturbed (cf. AirportTable).
+
+        """
+        if progressFeedbackHandler is None:
+            progressFeedbackHandler = misc.ProgressFeedbackHandler()
+
+        progressFeedbackHandler.startPhase(
+            _("Writing {prg}'s apt digest file...").format(prg=PROGNAME),
+            0, len(airports))
+        # In-memory version of the binary part of the apt digest file
+        table = AirportTable.fromDigestEntries(airports)
+        nbAirports = len(table)
+        stringDataSize = len(table.stringData)
+
+        header = cls.header(aptDatFilesInfo).encode("utf-8")
+        bodyOffset = cls._alignedOffset(len(header))
+        columnOffsets, stringOffsetsOffset, stringDataOffset, end = \
+                    cls.bodyLayout(bodyOffset, nbAirports, stringDataSize)
+
+        tmpPath = path + ".new"
+        logger.info("Opening {prg}'s apt digest file ('{aptDigest}') for "
+                    "writing".format(prg=PROGNAME, aptDigest=tmpPath))
+
+        with open(tmpPath, "wb") as f:
+            f.write(header)
+
+            def pad(offset):
+                f.write(bytes(offset - f.tell()))
+
+            pad(bodyOffset)
+            f.write(struct.pack(cls.BODY_PREFIX_FMT, cls.BYTE_ORDER_MARK,
+                                nbAirports, stringDataSize))
+
+            for name, typecode in cls.BODY_COLUMNS:
+                pad(columnOffsets[name])
+                table.column(name).tofile(f)
+
+            pad(stringOffsetsOffset)
+            table.stringOffsets.tofile(f)
+            f.write(table.stringData)
+            assert f.tell() == end, (f.tell(), end)
+
+        os.replace(tmpPath, path)
+        progressFeedbackHandler.setValue(nbAirports)
+
+    @classmethod
+    def _readHeaderLines(cls, fileObj):
+        """Read the header of an apt digest file opened in binary mode.
+
+        Return an io.StringIO instance containing the header, including
+        the empty line that ends it. Afterwards, the file position is
+        right after the header.
+
+        """
+        lines = []
+
+        for line in iter(fileObj.readline, b""):
+            lines.append(line)
+            if line == b"\n":
+                break
+
+        try:
+            return io.StringIO(b"".join(lines).decode("utf-8"))
+        except UnicodeDecodeError as e:
+            raise UnrecognizedFormatForAptDigest(
+                _("unable to decode the header")) from e
+
     _magicNb_cre = re.compile(r"^Magic number: (?P<number>\d+)$")
     _fmtVersion_cre = re.compile(r"^Format version: (?P<version>\d+)$")
     _aptDatFile_cre = re.compile(r"^apt\.dat file: (?P<path>.*)$")
@@ -1582,17 +2914,22 @@ class AptDatDigest:
           - 'aptDatFilesInfo' is a sequence of AptDatFileInfo instances
             giving precise information about all apt.dat files from
             which the apt digest file given by 'path' was built;
-          - 'airports' is a dictionary whose keys are ICAO codes and
-            values AirportStub instances for the corresponding airports.
+          - 'airports' is a mapping whose keys are ICAO codes and
+            values AirportStub instances for the corresponding airports
+            (more precisely, an AirportTable instance backed by a memory
+            mapping of the file).
+
+        If 'onlyReadHeader' is True, return a tuple of the form
+        (formatVersion, aptDatFilesInfo) instead.
 
         """
-        airports = {}
         logger.info("Opening {prg}'s apt digest file ('{aptDigest}') for "
                     "reading{cmpl}".format(prg=PROGNAME, aptDigest=path,
                     cmpl=" (header only)" if onlyReadHeader else ""))
 
-        with open(path, "r", encoding="utf-8") as f:
-            formatVersion, aptDatFilesInfo = cls._checkHeader(f)
+        with open(path, "rb") as f:
+            formatVersion, aptDatFilesInfo = cls._checkHeader(
+                cls._readHeaderLines(f))
 
             if formatVersion != cls.CURRENT_FMT_VERSION:
                 raise UnrecognizedFormatForAptDigest(
@@ -1603,36 +2940,33 @@ class AptDatDigest:
             if onlyReadHeader:
                 return (formatVersion, aptDatFilesInfo)
 
-            while True:
-                line = f.readline()
-                if not line:
-                    break
+            bodyOffset = cls._alignedOffset(f.tell())
+            # The mapping remains valid after the file is closed.
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
-                try:
-                    l = line[:-1].split('\0')
-                    airportID = l[0]
-                    name = l[1]
-                    type_ = AirportType(int(l[2]))
-                    lat, lon = map(misc.DecimalCoord, l[3:5])
-                    nbLandRunways, nbWaterRunways, nbHelipads = map(
-                        int, l[5].split(';'))
-
-                    if l[6]:
-                        minRwyLength, maxRwyLength = map(
-                            float, l[6].split(';'))
-                    else:
-                        # The “airport” has no real runway (one can hope it has
-                        # helipads!)
-                        minRwyLength, maxRwyLength = None, None
-
-                    # aptDatIndex, byte offset and line number (3-tuple)
-                    airportIndex = tuple(map(int, l[7].split(';')))
-                except Exception as e: # could be refined a little bit...
-                    raise UnableToParseAptDigest() from e
-
-                airports[airportID] = AirportStub(
-                    airportID, name, type_, lat, lon, nbLandRunways,
-                    nbWaterRunways, nbHelipads, minRwyLength, maxRwyLength,
-                    airportIndex)
+        try:
+            byteOrderMark, nbAirports, stringDataSize = \
+                struct.unpack_from(cls.BODY_PREFIX_FMT, buffer, bodyOffset)
+        except struct.error as e:
+            raise UnableToParseAptDigest(
+                _("truncated apt digest file")) from e
+
+        if byteOrderMark != cls.BYTE_ORDER_MARK:
+            raise UnrecognizedFormatForAptDigest(
+                _("the apt digest file was written on a machine with a "
+                  "different byte order"))
+
+        columnOffsets, stringOffsetsOffset, stringDataOffset, end = \
+            cls.bodyLayout(bodyOffset, nbAirports, stringDataSize)
+
+        if len(buffer) != end:
+            raise UnableToParseAptDigest(
+                _("unexpected size for the apt digest file: {size} bytes "
+                  "(expected {expected})").format(size=len(buffer),
+                                                  expected=end))
+
+        airports = AirportTable.fromBuffer(
+            buffer, (nbAirports, columnOffsets, stringOffsetsOffset,
+                     stringDataOffset, stringDataSize))
 
         return (aptDatFilesInfo, airports)
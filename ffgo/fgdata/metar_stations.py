@@ -0,0 +1,183 @@
+# metar_stations.py --- Nearest METAR station lookup
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016  Florent Rougon
+#
+# This file is distributed under the terms of the DO WHAT THE FUCK YOU WANT TO
+# PUBLIC LICENSE version 2, dated December 2004, by Sam Hocevar. You should
+# have received a copy of this license along with this file. You can also find
+# it at <http://www.wtfpl.net/>.
+
+import os
+import array
+
+from .. import misc
+from ..logging import logger
+from .airport_index import AirportSpatialIndex
+
+
+class MetarStationIndex:
+    """Spatial index of the METAR stations listed in metar.dat.gz.
+
+    Only the stations that are present in the AirportTable given to the
+    constructor (normally, Config.airports) can be found by the nearest
+    station queries, since their coordinates are taken from there.
+
+    Optionally, a table giving the nearest station for every airport of
+    the AirportTable can be computed (this takes a while, so it is only
+    done when building the apt digest file) and saved next to the apt
+    digest file; then, queries for the nearest station of an airport
+    are simple lookups.
+
+    """
+
+    # Identifies the file format of saveNearestTable()
+    MAGIC = b"FFGo nearest METAR station table\n"
+    FMT_VERSION = 1
+    BOM = AirportSpatialIndex.BOM
+    # Value used in the nearest station table for “no station”
+    NO_STATION = 0xFFFFFFFF
+
+    def __init__(self, airports, stations, stamp=None):
+        """Initialize a MetarStationIndex instance.
+
+        'airports' is an AirportTable instance and 'stations' an
+        iterable of METAR station identifiers. 'stamp' identifies the
+        apt digest and metar.dat.gz files the data comes from (see
+        computeStamp()); it is required for saveNearestTable() and
+        loadNearestTable().
+
+        """
+        self.airports = airports
+        self.stations = frozenset(stations)
+        self.stationRows = sorted(airports.rows(self.stations))
+        self.stamp = stamp
+        self.index = AirportSpatialIndex.build(airports,
+                                               rows=self.stationRows)
+        # array.array instance giving, for each row of self.airports, the
+        # row of the nearest METAR station (or NO_STATION).
+        self.nearestTable = None
+
+    @classmethod
+    def computeStamp(cls, digestPath, metarDatPath, airports):
+        """Return data identifying the apt digest and metar.dat.gz files."""
+        st = os.stat(metarDatPath)
+        digestStamp = AirportSpatialIndex.computeDigestStamp(digestPath,
+                                                             airports)
+        return digestStamp + (st.st_size, st.st_mtime_ns)
+
+    def isStation(self, icao):
+        """Tell whether 'icao' is in the list of METAR stations."""
+        return icao in self.stations
+
+    def nearestToPoint(self, lat, lon, k=1):
+        """Find the k METAR stations closest to (lat, lon).
+
+        Return a list of (icao, distance) tuples sorted by increasing
+        distance in meters. The search is exact (cf.
+        AirportSpatialIndex.nearest()).
+
+        """
+        airports = self.airports
+        return [ (airports.icao(row), dist) for row, dist in
+                 self.index.nearest(airports, lat, lon, k=k) ]
+
+    def nearest(self, icao, k=1):
+        """Find the k METAR stations closest to the airport 'icao'.
+
+        Return a list of (icao, distance) tuples as nearestToPoint(),
+        or an empty list if 'icao' isn't in self.airports. When k is 1
+        and the nearest station table is available, the distance is
+        None.
+
+        """
+        airports = self.airports
+        row = airports.row(icao)
+        if row is None:
+            return []
+
+        if k == 1 and self.nearestTable is not None:
+            stationRow = self.nearestTable[row]
+            if stationRow == self.NO_STATION:
+                return []
+            else:
+                return [(airports.icao(stationRow), None)]
+
+        return self.nearestToPoint(airports.lat[row], airports.lon[row], k=k)
+
+    def computeNearestTable(self, progressFeedbackHandler=None):
+        """Compute the nearest station for every airport of self.airports.
+
+        This takes a while. If 'progressFeedbackHandler' is not None, it
+        should be a misc.ProgressFeedbackHandler instance.
+
+        """
+        if progressFeedbackHandler is None:
+            progressFeedbackHandler = misc.ProgressFeedbackHandler()
+
+        airports = self.airports
+        nbAirports = len(airports)
+        lat, lon = airports.lat, airports.lon
+        nearest = self.index.nearest
+        table = array.array("I", [self.NO_STATION]) * nbAirports
+
+        progressFeedbackHandler.startPhase(
+            _("Finding the nearest METAR stations..."), 0, max(nbAirports, 1))
+
+        if self.stationRows:
+            for row in range(nbAirports):
+                res = nearest(airports, lat[row], lon[row])
+                if res:
+                    table[row] = res[0][0]
+
+                if not (row % 1000):
+                    progressFeedbackHandler.setValue(row)
+
+        progressFeedbackHandler.setValue(max(nbAirports, 1))
+        self.nearestTable = table
+
+    # Format of the file written by saveNearestTable(): MAGIC, then a header
+    # made of the following unsigned 64-bit integers in native byte order:
+    # BOM, format version, the 5 elements of the stamp (see computeStamp());
+    # then the table itself (one 32-bit unsigned integer per airport).
+    def saveNearestTable(self, path):
+        """Write the nearest station table to 'path' (atomically)."""
+        header = array.array("Q", (self.BOM, self.FMT_VERSION) +
+                             tuple(self.stamp))
+
+        tmpPath = path + ".new"
+        with open(tmpPath, "wb") as f:
+            f.write(self.MAGIC)
+            header.tofile(f)
+            self.nearestTable.tofile(f)
+
+        os.replace(tmpPath, path)
+
+    def loadNearestTable(self, path):
+        """Read the nearest station table written by saveNearestTable().
+
+        Return True if the table could be loaded, False if the file
+        doesn't exist, can't be parsed or is outdated.
+
+        """
+        try:
+            with open(path, "rb") as f:
+                if f.read(len(self.MAGIC)) != self.MAGIC:
+                    return False
+
+                header = array.array("Q")
+                header.fromfile(f, 7)
+                if (header[0] != self.BOM or
+                    header[1] != self.FMT_VERSION or
+                    tuple(header[2:]) != tuple(self.stamp)):
+                    return False
+
+                table = array.array("I")
+                table.fromfile(f, len(self.airports))
+        except (OSError, EOFError) as e:
+            logger.debug("Can't read the nearest METAR station table from "
+                         "'{}': {}".format(path, e))
+            return False
+
+        self.nearestTable = table
+        return True
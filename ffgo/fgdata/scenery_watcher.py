@@ -0,0 +1,301 @@
+# scenery_watcher.py --- Keep track of the installed scenery tiles
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016  Florent Rougon
+#
+# This file is distributed under the terms of the DO WHAT THE FUCK YOU WANT TO
+# PUBLIC LICENSE version 2, dated December 2004, by Sam Hocevar. You should
+# have received a copy of this license along with this file. You can also find
+# it at <http://www.wtfpl.net/>.
+
+import os
+import re
+import collections
+import concurrent.futures
+import threading
+
+from .. import misc
+from ..logging import logger
+
+
+# Regexp for directory names such as w040n20
+_tileDirCre = re.compile(r"([we])(\d{3})([ns])(\d{2})$")
+
+# Number of threads used to explore the Terrain directories
+SCAN_THREADS = 8
+
+
+def tileForDirName(name):
+    """Return the tile corresponding to a directory name such as w123n37.
+
+    The result is a (lat, lon) tuple of integers giving the south-west
+    corner of the tile in degrees, or None if 'name' doesn't have the
+    expected form.
+
+    """
+    mo = _tileDirCre.match(name)
+    if not mo:
+        return None
+
+    lon = int(mo.group(2))
+    lat = int(mo.group(4))
+
+    return (-lat if mo.group(3) == 's' else lat,
+            -lon if mo.group(1) == 'w' else lon)
+
+
+def _mtime(path):
+    """Return the modification time of 'path' in ns, or None if missing."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _scanBigTileDir(path):
+    """Explore a 10°×10° directory such as Terrain/w130n30.
+
+    Return a tuple (mtime, tiles, ignored) where 'mtime' is the
+    modification time of the directory before it was read (None if it
+    doesn't exist), 'tiles' a frozenset of tiles as returned by
+    tileForDirName() and 'ignored' a list of paths of subdirectories
+    with an unexpected name.
+
+    """
+    mtime = _mtime(path)
+    tiles = set()
+    ignored = []
+
+    if mtime is not None:
+        try:
+            for name, p in misc.subdirectories(path):
+                tile = tileForDirName(name)
+                if tile is not None:
+                    tiles.add(tile)
+                else:
+                    ignored.append(p)
+        except OSError as e:
+            logger.warning(_("Unable to read directory '{}': {}")
+                           .format(path, e))
+
+    return (mtime, frozenset(tiles), ignored)
+
+
+class SceneryWatcher:
+    """Keep track of the 1°×1° tiles installed in a set of scenery paths.
+
+    A tile is installed if at least one of the scenery paths contains a
+    Terrain/<10°×10° dir>/<1°×1° dir> directory for it, e.g.
+    Terrain/w130n30/w123n37. The constructor explores all these
+    directories; then, poll() finds the tiles that were added or
+    removed since the previous call (e.g., by TerraSync).
+
+    Detection relies on directory modification times: adding or
+    removing a 1°×1° directory updates the modification time of its
+    parent. Thus, poll() only needs to stat() the Terrain and 10°×10°
+    directories, and only explores those that changed. The 10°×10°
+    directories to explore are processed in parallel, using
+    misc.subdirectories().
+
+    """
+
+    def __init__(self, sceneryPaths):
+        self.sceneryPaths = list(sceneryPaths)
+        # Terrain directory -> [mtime, list of 10°×10° directories]
+        self._terrainDirs = {}
+        # 10°×10° directory -> (mtime, frozenset of tiles)
+        self._bigTileDirs = {}
+        # Tile -> number of 10°×10° directories containing it (only tiles
+        # that are installed are present)
+        self._tileCounts = collections.Counter()
+        self.poll()
+
+    @property
+    def tiles(self):
+        """Set of installed tiles, as (lat, lon) tuples."""
+        return self._tileCounts.keys()
+
+    def poll(self):
+        """Look for added and removed tiles.
+
+        Return a tuple (added, removed) of sets of tiles, relative to
+        the previous call (or to an empty scenery, for the call made by
+        the constructor).
+
+        """
+        toScan = []
+        bigTileDirs = set()
+
+        for scenery in self.sceneryPaths:
+            path = os.path.join(scenery, 'Terrain')
+            mtime = _mtime(path)
+            entry = self._terrainDirs.get(path)
+
+            if entry is None or entry[0] != mtime:
+                subdirs = []
+                if mtime is not None:
+                    try:
+                        subdirs = [ p for name, p in
+                                    misc.subdirectories(path) ]
+                    except OSError as e:
+                        logger.warning(
+                            _("Unable to read directory '{}': {}")
+                            .format(path, e))
+                entry = self._terrainDirs[path] = [mtime, subdirs]
+
+            bigTileDirs.update(entry[1])
+            for p in entry[1]:
+                known = self._bigTileDirs.get(p)
+                if known is None or known[0] != _mtime(p):
+                    toScan.append(p)
+
+        changes = {}            # tile -> whether it was installed before
+        for p in [ p for p in self._bigTileDirs if p not in bigTileDirs ]:
+            self._setTiles(p, None, changes)
+
+        if toScan:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=SCAN_THREADS) as executor:
+                results = list(executor.map(_scanBigTileDir, toScan))
+
+            for p, (mtime, tiles, ignored) in zip(toScan, results):
+                self._setTiles(p, (mtime, tiles), changes)
+                for d in ignored:
+                    logger.notice(
+                        _("Ignoring directory '{}' (unexpected name)")
+                        .format(d))
+
+        added = set()
+        removed = set()
+        for tile, wasInstalled in changes.items():
+            isInstalled = tile in self._tileCounts
+            if isInstalled and not wasInstalled:
+                added.add(tile)
+            elif wasInstalled and not isInstalled:
+                removed.add(tile)
+
+        return (added, removed)
+
+    def _setTiles(self, bigTileDir, entry, changes):
+        counts = self._tileCounts
+        old = self._bigTileDirs.pop(bigTileDir, None)
+
+        if old is not None:
+            for tile in old[1]:
+                changes.setdefault(tile, True)
+                counts[tile] -= 1
+                if not counts[tile]:
+                    del counts[tile]
+
+        if entry is not None:
+            self._bigTileDirs[bigTileDir] = entry
+            for tile in entry[1]:
+                changes.setdefault(tile, tile in counts)
+                counts[tile] += 1
+
+
+class SceneryMonitor:
+    """Poll a SceneryWatcher periodically in a background thread.
+
+    start() submits a job for a set of scenery paths. The worker thread
+    builds the SceneryWatcher instance unless one is given (this
+    explores all Terrain directories), then calls its poll() method
+    every 'interval' seconds. Each time tiles are added or removed,
+    the changes are queued and 'notify' is called from the worker
+    thread without arguments; the caller is expected to retrieve them
+    with results() and apply them, as with AirportPrefetcher.
+
+    """
+
+    def __init__(self, interval, notify=None):
+        self.interval = interval
+        self.notify = notify
+        self._cond = threading.Condition()
+        self._job = None           # (generation, sceneryPaths, watcher)
+        # Elements: (generation, addedTiles, removedTiles)
+        self._results = collections.deque()
+        self._generation = 0
+        self._thread = None
+
+    def start(self, sceneryPaths, watcher=None):
+        """Start watching 'sceneryPaths', replacing any previous job.
+
+        If 'watcher' is not None, it must be an up-to-date
+        SceneryWatcher instance for 'sceneryPaths'; it is then owned by
+        the worker thread. Otherwise, only changes made after the
+        worker thread has explored the scenery paths are reported.
+
+        Return the generation number of the job.
+
+        """
+        with self._cond:
+            self._generation += 1
+            self._job = (self._generation, list(sceneryPaths), watcher)
+            self._results.clear()
+
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    name="Scenery_monitor", target=self._threadFunc,
+                    daemon=True)
+                self._thread.start()
+
+            self._cond.notify()
+            return self._generation
+
+    def stop(self):
+        """Stop watching, discarding the changes not retrieved yet."""
+        with self._cond:
+            self._generation += 1
+            self._job = None
+            self._results.clear()
+            self._cond.notify()
+
+    def results(self):
+        """Return the list of (addedTiles, removedTiles) found so far.
+
+        Each element corresponds to one call of SceneryWatcher.poll()
+        that found changes, in chronological order. Changes found by
+        jobs that were replaced or stopped are never returned.
+
+        """
+        with self._cond:
+            res = [ (added, removed)
+                    for generation, added, removed in self._results
+                    if generation == self._generation ]
+            self._results.clear()
+
+        return res
+
+    def _threadFunc(self):
+        generation = watcher = None
+
+        while True:
+            with self._cond:
+                if self._job is None and generation == self._generation:
+                    # Wait until the next poll (start() and stop() wake us
+                    # up earlier).
+                    self._cond.wait(self.interval)
+
+                while self._job is None and generation != self._generation:
+                    self._cond.wait() # stopped
+
+                if self._job is not None:
+                    (generation, sceneryPaths, watcher), self._job = \
+                                                            self._job, None
+
+            try:
+                if watcher is None:
+                    watcher = SceneryWatcher(sceneryPaths)
+                    continue
+
+                added, removed = watcher.poll()
+            except Exception as e:
+                logger.warning("Error while watching the scenery: {!r}"
+                               .format(e))
+                continue
+
+            if added or removed:
+                with self._cond:
+                    self._results.append((generation, added, removed))
+                if self.notify is not None:
+                    self.notify()
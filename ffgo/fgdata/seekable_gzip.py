@@ -0,0 +1,193 @@
+# seekable_gzip.py --- Gzip files allowing fast random access
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016  Florent Rougon
+#
+# This file is distributed under the terms of the DO WHAT THE FUCK YOU WANT TO
+# PUBLIC LICENSE version 2, dated December 2004, by Sam Hocevar. You should
+# have received a copy of this license along with this file. You can also find
+# it at <http://www.wtfpl.net/>.
+
+"""Gzip files allowing fast random access.
+
+Seeking forward in a gzip.GzipFile object requires decompressing all
+data up to the target offset, which is slow for large files. The
+classical way around this (zran.c in the zlib distribution) is to save
+the decompressor state at regular intervals; however, this needs
+inflatePrime(), which is not available from Python.
+
+The files written by SeekableGzipWriter are therefore made of many
+independent gzip members, each one holding at most CHECKPOINT_INTERVAL
+bytes of uncompressed data. Such a file is still a valid gzip file.
+The offsets of the members, in both the compressed and uncompressed
+streams, are saved in a separate file (GzipCheckpoints), so that
+decompression can start at the member containing any given offset.
+
+"""
+
+import os
+import array
+import bisect
+import gzip
+
+
+# Maximum amount of uncompressed data in each gzip member
+CHECKPOINT_INTERVAL = 1024*1024
+# Compression level used for the members
+COMPRESS_LEVEL = 6
+
+
+def gzipMembers(data, interval=CHECKPOINT_INTERVAL):
+    """Compress 'data' into a list of gzip members.
+
+    Return a list of (uncompressedSize, member) tuples, where each
+    'member' is a bytes object containing a complete gzip member for at
+    most 'interval' bytes of 'data'.
+
+    """
+    res = []
+    for i in range(0, len(data), interval):
+        piece = data[i:i+interval]
+        res.append((len(piece), gzip.compress(piece, COMPRESS_LEVEL)))
+
+    return res
+
+
+class GzipCheckpoints:
+    """Offsets of the gzip members of a file written by SeekableGzipWriter.
+
+    Member number i starts at offset compOffsets[i] in the file and at
+    offset uncompOffsets[i] in the uncompressed stream. 'sourceSize' and
+    'sourceTimestamp' identify the file whose uncompressed contents was
+    written (they allow one to detect outdated copies).
+
+    """
+
+    MAGIC = b"FFGo gzip checkpoints\n"
+    FMT_VERSION = 1
+    BOM = 0x0102030405060708
+
+    def __init__(self, uncompOffsets, compOffsets, sourceSize,
+                 sourceTimestamp):
+        self.uncompOffsets = uncompOffsets
+        self.compOffsets = compOffsets
+        self.sourceSize = sourceSize
+        self.sourceTimestamp = sourceTimestamp
+
+    def locate(self, offset):
+        """Find the gzip member containing an uncompressed offset.
+
+        Return a tuple (uncompOffset, compOffset) giving the start of
+        the member in the uncompressed and compressed streams.
+
+        """
+        i = max(bisect.bisect_right(self.uncompOffsets, offset) - 1, 0)
+        return (self.uncompOffsets[i], self.compOffsets[i])
+
+    # Format of the file: MAGIC, then the following unsigned 64-bit
+    # integers in native byte order: BOM, format version, source size,
+    # number of members; then the source timestamp as a double; then the
+    # uncompOffsets and compOffsets arrays (unsigned 64-bit integers).
+    def save(self, path):
+        """Write the checkpoints to 'path' (atomically)."""
+        tmpPath = path + ".new"
+        with open(tmpPath, "wb") as f:
+            f.write(self.MAGIC)
+            array.array("Q", (self.BOM, self.FMT_VERSION, self.sourceSize,
+                              len(self.uncompOffsets))).tofile(f)
+            array.array("d", (self.sourceTimestamp,)).tofile(f)
+            array.array("Q", self.uncompOffsets).tofile(f)
+            array.array("Q", self.compOffsets).tofile(f)
+
+        os.replace(tmpPath, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read checkpoints written by save().
+
+        Return None if the file doesn't exist or can't be parsed.
+
+        """
+        try:
+            with open(path, "rb") as f:
+                if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                    return None
+
+                header = array.array("Q")
+                header.fromfile(f, 4)
+                bom, fmtVersion, sourceSize, nbMembers = header
+                if bom != cls.BOM or fmtVersion != cls.FMT_VERSION:
+                    return None
+
+                timestamp = array.array("d")
+                timestamp.fromfile(f, 1)
+                uncompOffsets = array.array("Q")
+                uncompOffsets.fromfile(f, nbMembers)
+                compOffsets = array.array("Q")
+                compOffsets.fromfile(f, nbMembers)
+        except (OSError, EOFError):
+            return None
+
+        return cls(uncompOffsets, compOffsets, sourceSize, timestamp[0])
+
+
+class SeekableGzipWriter:
+    """Write a multi-member gzip file and the corresponding checkpoints.
+
+    The data is written to 'path' and the checkpoints to
+    checkpointsPath(path). Both files are only put in place by close(),
+    which is called automatically when the instance is used as a
+    context manager and no exception is raised.
+
+    """
+
+    def __init__(self, path, sourceSize, sourceTimestamp):
+        self.path = path
+        self.sourceSize = sourceSize
+        self.sourceTimestamp = sourceTimestamp
+        self.uncompOffsets = array.array("Q")
+        self.compOffsets = array.array("Q")
+        self.uncompSize = self.compSize = 0
+        self.file = open(path + ".new", "wb")
+
+    @classmethod
+    def checkpointsPath(cls, path):
+        return path + ".idx"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excVal, excTb):
+        if excType is None:
+            self.close()
+        else:
+            self.file.close()
+            os.unlink(self.path + ".new")
+
+        return False
+
+    def writeMember(self, uncompSize, member):
+        """Append a gzip member (cf. gzipMembers())."""
+        self.uncompOffsets.append(self.uncompSize)
+        self.compOffsets.append(self.compSize)
+        self.file.write(member)
+        self.uncompSize += uncompSize
+        self.compSize += len(member)
+
+    def write(self, data):
+        """Append uncompressed data, starting a new member."""
+        for uncompSize, member in gzipMembers(data):
+            self.writeMember(uncompSize, member)
+
+    def close(self):
+        self.file.close()
+        # Never leave checkpoints that don't match the data file
+        try:
+            os.unlink(self.checkpointsPath(self.path))
+        except FileNotFoundError:
+            pass
+
+        os.replace(self.path + ".new", self.path)
+        GzipCheckpoints(self.uncompOffsets, self.compOffsets,
+                        self.sourceSize, self.sourceTimestamp).save(
+                            self.checkpointsPath(self.path))
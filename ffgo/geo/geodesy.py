@@ -8,7 +8,8 @@
 # have received a copy of this license along with this file. You can also find
 # it at <http://www.wtfpl.net/>.
 
-import sys
+import array
+import numbers
 import itertools
 import collections
 import textwrap
@@ -16,7 +17,10 @@ import math
 from math import degrees, radians, cos, sin, tan, atan, atan2, hypot, sqrt, \
     fmod
 
-from ..constants import PROGNAME
+# 'constants' must be imported before 'logging', which imports 'misc':
+# importing 'misc' first is circular.
+from .. import constants
+from ..lru_cache import LRUCache
 from ..logging import logger
 from ..exceptions import FFGoException
 
@@ -197,6 +201,10 @@ class EarthModel:
     ab2 = a2*b2
     e2 = 1 - b2/a2              # squared eccentricity
     aSqrt1me2 = a*sqrt(1-e2)    # useful for the Gaussian radius of curvature
+    # Extreme values of the principal radii of curvature of the ellipsoid:
+    # meridional radius at the equator, and radius at the poles.
+    minRadiusOfCurvature = a*(1 - e2)
+    maxRadiusOfCurvature = a2/b
 
     @classmethod
     def meridionalRadius(cls, lat):
@@ -231,11 +239,53 @@ class EarthModel:
         return cls.aSqrt1me2 / (1-cls.e2*sinPhi*sinPhi)
 
 
+class BatchInverseResult:
+    """Results of GeodCalc.batchInverse().
+
+    Attributes 's12', 'azi1' and 'azi2' are array.array instances of
+    doubles (one element per pair of points) with the same meaning as
+    the corresponding keys in the dictionaries returned by
+    GeodCalc.vincentyInverse(). 'ok' is an array.array of bytes: ok[i]
+    is 1 if the calculation succeeded for pair i and 0 otherwise, in
+    which case s12[i], azi1[i] and azi2[i] are NaN. Azimuths are also
+    NaN for the methods that only compute distances.
+
+    """
+
+    __slots__ = ("s12", "azi1", "azi2", "ok")
+
+    def __init__(self, n):
+        nan = array.array("d", [float("nan")])
+        self.s12 = nan * n
+        self.azi1 = nan * n
+        self.azi2 = nan * n
+        self.ok = array.array("b", bytes(n))
+
+    def __len__(self):
+        return len(self.ok)
+
+    def failures(self):
+        """Return the list of indices for which the calculation failed."""
+        return [ i for i, ok in enumerate(self.ok) if not ok ]
+
+
 class GeodCalc:
-    """Class for performing basic geodesic calculations."""
+    """Class for performing basic geodesic calculations.
 
-    def __init__(self):
+    If 'memoSize' is positive, batchInverse() stores its results in
+    'self.memo', an LRUCache instance holding at most 'memoSize'
+    entries keyed by (method, lat1, lon1, lat2, lon2, precision), so
+    that repeated calculations for the same pairs of points cost
+    nothing. Batches with more than 'memoSize' pairs bypass the memo:
+    they would evict their own results before any could be reused. The
+    cache statistics are available as self.memo.hits and
+    self.memo.misses.
+
+    """
+
+    def __init__(self, memoSize=0):
         self.earthModel = EarthModel()
+        self.memo = LRUCache(memoSize) if memoSize > 0 else None
 
     @classmethod
     def greatCircleAzimuths(cls, lat1, lon1, lat2, lon2):
@@ -335,7 +385,6 @@ class GeodCalc:
                 "azi1": normAzimuth(azi1),
                 "azi2": normAzimuth(azi2)}
 
-    # If this method is renamed, 'fName' below must be changed too.
     def vincentyInverseWithFallback(self, lat1, lon1, lat2, lon2,
                                     precision=1e-12):
         """Vincenty's algorithm for the geodetic inverse problem + fallbacks.
@@ -347,34 +396,48 @@ class GeodCalc:
           - equatorial lines between points that are not antipodal nor
             nearly so.
 
-        In the case of antipodal or nearly antipodal end points,
-        VincentyInverseError is raised. Because of the Earth's flatness,
-        finding the correct azimuths in such cases is very difficult
-        (spherical approximation can't be used). This is solved by
-        Karney's algorithm implemented in GeographicLib, but not here.
+        In the case of antipodal or nearly antipodal end points, finding
+        the correct azimuths is very difficult because of the Earth's
+        flatness (spherical approximation can't be used): the
+        calculation is then done with builtinInverse().
 
         Note: the 'precision' optional argument is only used with
               Vincenty's algorithm.
 
+        """
+        return self._vincentyInverseWithFallback(lat1, lon1, lat2, lon2,
+                                                 precision, True)
+
+    # If vincentyInverseWithFallback() is renamed, 'fName' below must be
+    # changed too.
+    def _vincentyInverseWithFallback(self, lat1, lon1, lat2, lon2, precision,
+                                     log):
+        """Implementation of vincentyInverseWithFallback().
+
+        If 'log' is False, nothing is logged (this is for batch
+        computations).
+
         """
         fName = "vincentyInverseWithFallback"
         textWidth = 78          # for wrapping of log messages
 
         if (lat1 == lat2 == 90.0 or lat1 == lat2 == -90.0 or
             lat1 == lat2 and normLon(lon1) == normLon(lon2)):
-            logger.debugNP("{f}: identical start and end points, "
-                           "short-circuiting the whole process".format(
-                               f=fName))
+            if log:
+                logger.debugNP("{f}: identical start and end points, "
+                               "short-circuiting the whole process".format(
+                                   f=fName))
             # Make sure the distance returned in this case is exactly zero.
             return {"s12": 0.0, "azi1": 0.0, "azi2": 0.0}
 
         try:
             res = self.vincentyInverse(lat1, lon1, lat2, lon2,
                                        precision=precision)
-            logger.debugNP("{f}: Vincenty method worked".format(
-                f=fName))
+            if log:
+                logger.debugNP("{f}: Vincenty method worked".format(
+                    f=fName))
             return res
-        except (ZeroDivisionError, VincentyInverseError) as exc:
+        except (ZeroDivisionError, VincentyInverseError):
             n1 = NVector.fromLatLon(lat1, lon1)
             n2 = NVector.fromLatLon(lat2, lon2)
             angle = n1.angle(n2)    # radians
@@ -388,48 +451,53 @@ class GeodCalc:
                     # than if using fccDistance().
                     phi_m = 0.5*(lat1 + lat2)
                     dist = self.earthModel.gaussRadius(phi_m)*angle
-                    logger.debugNP(textwrap.fill(textwrap.dedent("""\
-                      {f}: Vincenty method didn't work; points not very far
-                      away from each other and close to one of the poles
-                      (angle = {ang!r}°, lat1 = {lat1!r}, lat2 = {lat2!r}),
-                      dist = {d!r} m obtained using the Gaussian radius of
-                      curvature""").format(f=fName, ang=degrees(angle),
-                                           lat1=lat1, lat2=lat2, d=dist),
-                                                 width=textWidth))
+                    if log:
+                        logger.debugNP(textwrap.fill(textwrap.dedent("""\
+                          {f}: Vincenty method didn't work; points not very far
+                          away from each other and close to one of the poles
+                          (angle = {ang!r}°, lat1 = {lat1!r}, lat2 = {lat2!r}),
+                          dist = {d!r} m obtained using the Gaussian radius of
+                          curvature""").format(f=fName, ang=degrees(angle),
+                                               lat1=lat1, lat2=lat2, d=dist),
+                                                     width=textWidth))
                 else:
                     dist = self.fccDistance(lat1, lon1, lat2, lon2)
-                    logger.debugNP(textwrap.fill(textwrap.dedent("""\
-                      {f}: Vincenty method didn't work; points not very far
-                      away from each other (angle = {ang!r}°), dist = {d!r} m
-                      obtained with fccDistance()""").format(
-                            f=fName, ang=degrees(angle), d=dist),
-                                                 width=textWidth))
+                    if log:
+                        logger.debugNP(textwrap.fill(textwrap.dedent("""\
+                          {f}: Vincenty method didn't work; points not very far
+                          away from each other (angle = {ang!r}°), dist = {d!r} m
+                          obtained with fccDistance()""").format(
+                                f=fName, ang=degrees(angle), d=dist),
+                                                     width=textWidth))
 
                 try:
                     azi1, azi2 = self.greatCircleAzimuths(
                         lat1, lon1, lat2, lon2)
                 except ValueError:
                     assert dist < 1e-6, dist # should be zero, actually
-                    logger.debugNP(textwrap.fill(textwrap.dedent("""\
-                      {f}: could not compute azimuths; barring rounding errors,
-                      the points should be equal""").format(f=fName, d=dist),
-                                                 width=textWidth))
+                    if log:
+                        logger.debugNP(textwrap.fill(textwrap.dedent("""\
+                          {f}: could not compute azimuths; barring rounding errors,
+                          the points should be equal""").format(f=fName, d=dist),
+                                                     width=textWidth))
                     return {"s12": 0.0, "azi1": 0.0, "azi2": 0.0}
                 else:
-                    logger.debugNP("{f}: using spherical approximation to "
-                                   "compute the azimuths".format(f=fName))
+                    if log:
+                        logger.debugNP("{f}: using spherical approximation to "
+                                       "compute the azimuths".format(f=fName))
                     return {"s12": dist, "azi1": azi1, "azi2": azi2}
             # As above, math.pi - angle should already be non-negative. Use
             # abs() just in case.
             elif abs(math.pi - angle) < 0.1: # nearly antipodal points
-                logger.debugNP("{f}: nearly antipodal points "
-                               "(angle = {ang!r}°)"
-                               .format(f=fName, ang=degrees(angle)))
+                if log:
+                    logger.debugNP("{f}: nearly antipodal points "
+                                   "(angle = {ang!r}°), using builtinInverse()"
+                                   .format(f=fName, ang=degrees(angle)))
                 # Because of the Earth's flatness, the shortest path is not
                 # easy to guess. It should pass close to one of the poles;
                 # spherical approximation would give completely wrong
                 # azimuths!
-                self._vincentyRaiseExcForAntipodalPoints(exc)
+                return self.builtinInverse(lat1, lon1, lat2, lon2)
             else:
                 # The following fallback method is particularly useful for
                 # equatorial lines whose central angle is not too close to 180°
@@ -441,13 +509,14 @@ class GeodCalc:
                 except ValueError:
                     assert False, "should not get there"
                 else:
-                    logger.debugNP(textwrap.fill(textwrap.dedent("""\
-                      {f}: using spherical approximation to compute the
-                      azimuths, and Gaussian radius of curvature to
-                      estimate the distance based on the central angle
-                      (angle = {ang!r}°)""")
-                        .format(f=fName, ang=degrees(angle)),
-                                                 width=textWidth))
+                    if log:
+                        logger.debugNP(textwrap.fill(textwrap.dedent("""\
+                          {f}: using spherical approximation to compute the
+                          azimuths, and Gaussian radius of curvature to
+                          estimate the distance based on the central angle
+                          (angle = {ang!r}°)""")
+                            .format(f=fName, ang=degrees(angle)),
+                                                     width=textWidth))
                     # This “mean latitude” would be a pretty bad guess
                     # if the start and end points were located on either
                     # side of a pole, but this code path should not be
@@ -456,45 +525,233 @@ class GeodCalc:
                     dist = self.earthModel.gaussRadius(phi_m)*angle
                     return {"s12": dist, "azi1": azi1, "azi2": azi2}
 
-    def _vincentyRaiseExcForAntipodalPoints(self, origExc):
-        msg = (textwrap.fill(textwrap.dedent(_("""\
-          your latest interactions with {prg} required to perform a geodetic
-          calculation. {prg} tried to do it with Vincenty's “formula” (rather,
-          algorithm) and a few others, but this is not possible because the two
-          points are antipodal or nearly so, which is the main difficult case
-          where this algorithm is known not to work. Easier cases can be worked
-          around using a spherical approximation of the Earth, but in this
-          precise case, that would give completely wrong azimuths, and I prefer
-          stopping like this rather than giving you an erroneous result.""")),
-                             width=sys.maxsize)
-               + "\n\n" +
-               textwrap.fill(textwrap.dedent(_("""\
-          {prg} can do the same calculation with GeographicLib, a library
-          containing fairly recent, sophisticated algorithms by Charles
-          F. F. Karney, that are supposed to handle all cases of the geodetic
-          inverse problem. If you want {prg} to do that, you have to install
-          GeographicLib for the Python interpreter used to run {prg}. You just
-          have to restart {prg} after the installation; GeographicLib will be
-          automatically found and used for such calculations.""")),
-                             width=sys.maxsize)).format(prg=PROGNAME)
-
-        raise VincentyInverseError(msg) from origExc
-
     def karneyInverse(self, lat1, lon1, lat2, lon2):
-        """Use Karney's algorithm for the geodetic inverse problem."""
-        return Geodesic.WGS84.Inverse(lat1, lon1, lat2, lon2)
+        """Use Karney's algorithm for the geodetic inverse problem.
+
+        GeographicLib is used if available; otherwise, the calculation
+        is done with builtinInverse().
+
+        """
+        if HAS_GEOGRAPHICLIB:
+            return Geodesic.WGS84.Inverse(lat1, lon1, lat2, lon2)
+        else:
+            return self.builtinInverse(lat1, lon1, lat2, lon2)
 
     @classmethod
     def karneyMethodAvailable(cls):
-        return HAS_GEOGRAPHICLIB
+        # Always true since builtinInverse() was written, but kept for the
+        # callers that offer a choice between calculation methods.
+        return True
+
+    def _builtinLambda12(self, salp1, calp1, sbet1, cbet1, sbet2, cbet2):
+        """Longitude difference along a geodesic, used by builtinInverse().
+
+        The geodesic starts at reduced latitude beta1 with azimuth
+        alpha1 (given by their sines and cosines) and is followed until
+        it reaches reduced latitude beta2 (first crossing, in the
+        canonical configuration of builtinInverse()).
+
+        Return a tuple (lambda12, sigma1, sigma2, salp0, calp0sq, calp2)
+        where lambda12 is the longitude difference in radians, sigma1
+        and sigma2 the arc lengths on the auxiliary sphere measured from
+        the node (northward equator crossing), salp0 and calp0sq the
+        sine and squared cosine of the azimuth at the node, and calp2
+        the cosine of the azimuth at the end point.
+
+        """
+        f = self.earthModel.f
+        salp0 = salp1*cbet1                 # Clairaut's relation
+        calp0sq = calp1*calp1 + (salp1*sbet1)**2
+
+        if cbet2 != cbet1 or abs(sbet2) != -sbet1:
+            calp2 = sqrt((calp1*cbet1)**2 +
+                         (cbet2 - cbet1)*(cbet2 + cbet1)) / cbet2
+        else:
+            calp2 = abs(calp1)
+
+        sig1 = atan2(sbet1, calp1*cbet1)
+        sig2 = atan2(sbet2, calp2*cbet2)
+        omg1 = atan2(salp0*sbet1, calp1*cbet1)
+        omg2 = atan2(salp0*sbet2, calp2*cbet2)
+        sig12 = sig2 - sig1
+        cos2sigmaM = cos(sig1 + sig2)
+
+        # Same series as in vincentyInverse()
+        C = f/16 * calp0sq*(4 + f*(4 - 3*calp0sq))
+        lam12 = (omg2 - omg1) - (1-C)*f*salp0*(
+            sig12 + C*sin(sig12)*(cos2sigmaM +
+                                  C*cos(sig12)*(-1+2*cos2sigmaM**2)))
+
+        return (lam12, sig1, sig2, salp0, calp0sq, calp2)
+
+    def _builtinDistance(self, sig1, sig2, calp0sq):
+        """Length of a geodesic arc on the ellipsoid, for builtinInverse().
+
+        'sig1' and 'sig2' are as returned by _builtinLambda12(). This
+        uses the same series as vincentyInverse().
+
+        """
+        em = self.earthModel
+        sig12 = sig2 - sig1
+        sinSigma, cosSigma = sin(sig12), cos(sig12)
+        cos2sigmaM = cos(sig1 + sig2)
+
+        u2 = calp0sq*(em.a2 - em.b2)/em.b2
+        A = 1 + u2/16384 * (4096 + u2*(-768 + u2*(320 - 175*u2)))
+        B = u2/1024 * (256 + u2*(-128 + u2*(74 - 47*u2)))
+        deltaSigma = B*sinSigma*(
+            cos2sigmaM + 0.25*B*(
+                cosSigma*(-1+2*cos2sigmaM**2) -
+                B/6*cos2sigmaM*(-3+4*sinSigma**2)*(-3+4*cos2sigmaM**2)))
+
+        return em.b*A*(sig12 - deltaSigma)
+
+    def builtinInverse(self, lat1, lon1, lat2, lon2, tolerance=1e-15):
+        """Solve the geodetic inverse problem for any pair of points.
+
+        This method doesn't need GeographicLib and, contrary to
+        vincentyInverse(), works for all pairs of points, including
+        antipodal or nearly antipodal ones. It follows the approach of
+        Karney's algorithm: the problem is first reduced to a canonical
+        configuration (|lat1| >= |lat2|, lat1 <= 0 and
+        0 <= lon2 - lon1 <= 180), in which the longitude difference
+        reached on the second latitude is an increasing function of the
+        initial azimuth alpha1 in [0°, 180°]. The equation is then
+        solved for alpha1 by bracketed root finding (modified regula
+        falsi, falling back to bisection), which always converges.
+        Lengths and longitude differences are computed with the same
+        series as in Vincenty's method, which gives the same sub-
+        millimeter accuracy.
+
+        'tolerance' is the accepted error on the longitude difference,
+        in radians. The return value is a dictionary as for
+        vincentyInverse().
+
+        """
+        f = self.earthModel.f
+
+        # Reduce the problem to the canonical configuration
+        swapped = abs(lat1) < abs(lat2)
+        if swapped:
+            lat1, lon1, lat2, lon2 = lat2, lon2, lat1, lon1
+
+        # When both points are on the equator, this makes the geodesic go
+        # through the northern hemisphere in case two geodesics are
+        # equally short, as with GeographicLib.
+        latFlipped = lat1 >= 0
+        if latFlipped:
+            lat1, lat2 = -lat1, -lat2
+
+        lam12 = deltaLon(lon2, lon1)
+        lonFlipped = lam12 < 0
+        lam12 = radians(abs(lam12))
+
+        def reducedLatitude(lat):
+            if lat == -90.0:
+                return (-1.0, 0.0)
+            elif lat == 90.0:
+                return (1.0, 0.0)
+            phi = radians(lat)
+            s, c = (1-f)*sin(phi), cos(phi)
+            h = hypot(s, c)
+            return (s/h, c/h)
+
+        sbet1, cbet1 = reducedLatitude(lat1)
+        sbet2, cbet2 = reducedLatitude(lat2)
+        # Signed zeros matter for the atan2() calls in _builtinLambda12():
+        # the start point is considered south of the equator and the end
+        # point north of it when they are on the equator.
+        if sbet1 == 0.0:
+            sbet1 = -0.0
+        sbet2 += 0.0
+
+        if cbet1 == 0.0:
+            # Start point at the South pole: the geodesic follows the
+            # meridian of the end point (the initial azimuth is the limit
+            # obtained when approaching the pole along the meridian of the
+            # start point).
+            sig1, sig2 = -0.5*math.pi, atan2(sbet2, cbet2)
+            s12 = self._builtinDistance(sig1, sig2, 1.0)
+            salp1, calp1 = sin(lam12), cos(lam12)
+            salp2, calp2 = 0.0, 1.0
+        elif sbet1 == 0.0 and lam12 <= (1-f)*math.pi:
+            # Both points on the equator and not too far away from each
+            # other: the geodesic follows the equator.
+            s12 = self.earthModel.a*lam12
+            salp1 = salp2 = 1.0
+            calp1 = calp2 = 0.0
+        else:
+            def F(alpha1):
+                return self._builtinLambda12(
+                    sin(alpha1), cos(alpha1), sbet1, cbet1, sbet2,
+                    cbet2)[0] - lam12
+
+            a, Fa = 0.0, -lam12
+            b, Fb = math.pi, F(math.pi)
+
+            if Fa >= 0.0:
+                alpha1 = a
+            elif Fb <= 0.0:
+                alpha1 = b
+            else:
+                # Modified regula falsi (Illinois algorithm); after
+                # 'maxFalsiIterations', plain bisection is used to
+                # guarantee convergence.
+                maxFalsiIterations = 30
+                side = 0
+                for count in itertools.count():
+                    if count < maxFalsiIterations:
+                        x = (a*Fb - b*Fa) / (Fb - Fa)
+                        if not a < x < b:
+                            x = 0.5*(a + b)
+                    else:
+                        x = 0.5*(a + b)
+
+                    if not a < x < b:
+                        break       # bracket as small as it can be
+
+                    Fx = F(x)
+                    if Fx < 0.0:
+                        a, Fa = x, Fx
+                        if side == -1:
+                            Fb *= 0.5
+                        side = -1
+                    else:
+                        b, Fb = x, Fx
+                        if side == 1:
+                            Fa *= 0.5
+                        side = 1
+
+                    if abs(Fx) <= tolerance:
+                        break
+
+                alpha1 = x
+
+            salp1, calp1 = sin(alpha1), cos(alpha1)
+            lam12, sig1, sig2, salp0, calp0sq, calp2 = self._builtinLambda12(
+                salp1, calp1, sbet1, cbet1, sbet2, cbet2)
+            s12 = self._builtinDistance(sig1, sig2, calp0sq)
+            salp2 = salp0 / cbet2
+
+        # Undo the transformations, in reverse order
+        if lonFlipped:
+            salp1, salp2 = -salp1, -salp2
+        if latFlipped:
+            calp1, calp2 = -calp1, -calp2
+        if swapped:
+            # Forward azimuths of the reverse geodesic, reversed
+            salp1, calp1, salp2, calp2 = -salp2, -calp2, -salp1, -calp1
+
+        return {"s12": s12,
+                "azi1": normAzimuth(degrees(atan2(salp1, calp1))),
+                "azi2": normAzimuth(degrees(atan2(salp2, calp2)))}
 
     def inverse(self, lat1, lon1, lat2, lon2, precision=1e-12):
         """Solve the geodetic inverse problem.
 
-        Use Karney's algorithm if available, otherwise Vincenty's method
-        with a few simpler fallbacks when it doesn't work (except for
-        the difficult case of antipodal or nearly antipodal end points,
-        which is only handled by Karney's algorithm).
+        Use Karney's algorithm if GeographicLib is available, otherwise
+        Vincenty's method with a few fallbacks when it doesn't work (see
+        vincentyInverseWithFallback()).
 
         See vincentyInverse() for information on the return value.
 
@@ -508,6 +765,212 @@ class GeodCalc:
             return self.vincentyInverseWithFallback(lat1, lon1, lat2, lon2,
                                                     precision=precision)
 
+    # Methods accepted by batchInverse(). Those with a False value only
+    # compute distances (azimuths are set to NaN).
+    BATCH_INVERSE_METHODS = collections.OrderedDict(
+        (("inverse", True),
+         ("vincentyInverse", True),
+         ("vincentyInverseWithFallback", True),
+         ("karneyInverse", True),
+         ("builtinInverse", True),
+         ("fccDistance", False),
+         ("modifiedFccDistance", False)))
+
+    def batchInverse(self, lats1, lons1, lats2, lons2, method="inverse",
+                     precision=1e-12):
+        """Solve the geodetic inverse problem for many pairs of points.
+
+        Each of 'lats1', 'lons1', 'lats2' and 'lons2' may be a sequence
+        of coordinates in degrees, or a single number which is then used
+        for all pairs (e.g., lats2 and lons2 can be the coordinates of a
+        single reference point). All sequences must have the same
+        length.
+
+        'method' is the name of the GeodCalc method used for each pair
+        (see BATCH_INVERSE_METHODS). Nothing is logged for individual
+        pairs.
+
+        Return a BatchInverseResult instance. Instead of raising an
+        exception, failures (e.g., VincentyInverseError for nearly
+        antipodal points) are reported in its 'ok' mask.
+
+        """
+        try:
+            withAzimuths = self.BATCH_INVERSE_METHODS[method]
+        except KeyError:
+            raise ValueError("unsupported method: {!r}".format(method))
+
+        n = None
+        for seq in (lats1, lons1, lats2, lons2):
+            if not isinstance(seq, numbers.Real):
+                if n is None:
+                    n = len(seq)
+                elif len(seq) != n:
+                    raise ValueError("batchInverse(): all coordinate "
+                                     "sequences must have the same length")
+        if n is None:
+            n = 1
+
+        lats1, lons1, lats2, lons2 = [
+            itertools.repeat(seq, n) if isinstance(seq, numbers.Real) else seq
+            for seq in (lats1, lons1, lats2, lons2) ]
+
+        if method == "inverse":
+            method = ("karneyInverse" if HAS_GEOGRAPHICLIB else
+                      "vincentyInverseWithFallback")
+
+        if method == "vincentyInverseWithFallback":
+            solve = lambda lat1, lon1, lat2, lon2: \
+                self._vincentyInverseWithFallback(lat1, lon1, lat2, lon2,
+                                                  precision, False)
+        elif method == "vincentyInverse":
+            solve = lambda lat1, lon1, lat2, lon2: \
+                self.vincentyInverse(lat1, lon1, lat2, lon2,
+                                     precision=precision)
+        elif method == "karneyInverse" and HAS_GEOGRAPHICLIB:
+            solve = Geodesic.WGS84.Inverse
+        else:
+            solve = getattr(self, method)
+
+        res = BatchInverseResult(n)
+        s12, azi1, azi2, ok = res.s12, res.azi1, res.azi2, res.ok
+        memo = self.memo
+        if memo is not None and n > memo.maxSize:
+            # The memo can't hold the whole batch: each lookup would be a
+            # miss the next time the same batch is computed.
+            memo = None
+        nan = float("nan")
+
+        for i, lat1, lon1, lat2, lon2 in zip(itertools.count(), lats1, lons1,
+                                             lats2, lons2):
+            if memo is not None:
+                key = (method, lat1, lon1, lat2, lon2, precision)
+                cached = memo.get(key)
+                if cached is not None:
+                    ok[i], s12[i], azi1[i], azi2[i] = cached
+                    continue
+
+            try:
+                g = solve(lat1, lon1, lat2, lon2)
+            except (ZeroDivisionError, error):
+                if memo is not None:
+                    memo.put(key, (0, nan, nan, nan))
+                continue
+
+            ok[i] = 1
+            if withAzimuths:
+                s12[i], azi1[i], azi2[i] = g["s12"], g["azi1"], g["azi2"]
+            else:
+                s12[i] = g
+
+            if memo is not None:
+                memo.put(key, (1, s12[i], azi1[i], azi2[i]))
+
+        return res
+
+    # Relative safety margin applied to the bounds used in ringCandidates().
+    # The bounds are rigorous for true geodesic distances, but the fallbacks
+    # of vincentyInverseWithFallback() only compute approximations (FCC,
+    # Gaussian radius of curvature...). This margin, together with the
+    # tolerance on the dot product, makes sure we never discard a point that
+    # the exact computation would have kept.
+    RING_PREFILTER_MARGIN = 0.005
+
+    def ringCandidates(self, lats1, lons1, lat2, lon2, minDist, maxDist,
+                       indices=None):
+        """Cheap test for points that may be in a ring around (lat2, lon2).
+
+        Return a list of the indices i such that the distance between
+        (lats1[i], lons1[i]) and (lat2, lon2) may be in the closed
+        interval [minDist, maxDist]. If 'indices' is not None, only
+        these indices are considered (in the same order).
+
+        This relies on the fact that, if theta is the angle between the
+        n-vectors (normals to the ellipsoid) of two points, the length s
+        of the geodesic joining them satisfies
+
+          a*(1 - e2)*theta <= s <= (a**2/b)*theta
+
+        because a*(1 - e2) and a**2/b are the minimum and maximum radii
+        of curvature of the ellipsoid. Thus, only one dot product per
+        point is needed.
+
+        """
+        em = self.earthModel
+        margin = self.RING_PREFILTER_MARGIN
+        rMin = em.minRadiusOfCurvature*(1 - margin)
+        rMax = em.maxRadiusOfCurvature*(1 + margin)
+        eps = 1e-12               # tolerance for rounding errors
+
+        # theta > maxDist/rMin  <=>  dot < cos(maxDist/rMin)
+        thetaMax = maxDist / rMin
+        cosThetaMax = cos(thetaMax) - eps if thetaMax < math.pi else -2.0
+        # theta < minDist/rMax  <=>  dot > cos(minDist/rMax)
+        thetaMin = minDist / rMax
+        cosThetaMin = cos(thetaMin) + eps if thetaMin > 0.0 else 2.0
+
+        x2, y2, z2 = NVector.fromLatLon(lat2, lon2)
+        if indices is None:
+            indices = range(len(lats1))
+
+        res = []
+        for i in indices:
+            phi = radians(lats1[i])
+            lam = radians(lons1[i])
+            cosPhi = cos(phi)
+            dot = cosPhi*(cos(lam)*x2 + sin(lam)*y2) + sin(phi)*z2
+
+            if cosThetaMax <= dot <= cosThetaMin:
+                res.append(i)
+
+        return res
+
+    def inverseInRing(self, lats1, lons1, lat2, lon2, minDist, maxDist,
+                      method="vincentyInverseWithFallback", indices=None,
+                      precision=1e-12):
+        """Solve the geodetic inverse problem for many points at once.
+
+        The start points are given by the 'lats1' and 'lons1' sequences
+        (in degrees); the end point is (lat2, lon2) for all of them. If
+        'indices' is not None, only these indices are considered.
+
+        'method' may be "vincentyInverseWithFallback" or
+        "karneyInverse". Points that can't be at a distance in
+        [minDist, maxDist] from the end point are eliminated beforehand
+        with ringCandidates(), so that the exact method only runs on the
+        remaining ones.
+
+        Return a tuple (results, failures) where:
+          - 'results' is a list of (i, s12, azi1, azi2) tuples, in the
+            order of the considered indices, for each start point whose
+            distance to the end point is in [minDist, maxDist] (the
+            values are the same as those returned by 'method');
+          - 'failures' is a list of the indices for which the
+            calculation failed (cf. batchInverse()).
+
+        Nothing is logged for individual points.
+
+        """
+        if method not in ("vincentyInverseWithFallback", "karneyInverse"):
+            raise ValueError("unsupported method: {!r}".format(method))
+
+        candidates = self.ringCandidates(lats1, lons1, lat2, lon2,
+                                         minDist, maxDist, indices=indices)
+        g = self.batchInverse([ lats1[i] for i in candidates ],
+                              [ lons1[i] for i in candidates ],
+                              lat2, lon2, method=method, precision=precision)
+        results = []
+        failures = []
+
+        for i, ok, s12, azi1, azi2 in zip(candidates, g.ok, g.s12, g.azi1,
+                                          g.azi2):
+            if not ok:
+                failures.append(i)
+            elif minDist <= s12 <= maxDist:
+                results.append((i, s12, azi1, azi2))
+
+        return (results, failures)
+
     def _fccK1(self, phi_m):
         """Approx. number of kilometers per degree of latitude.
 
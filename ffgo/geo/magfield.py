@@ -8,8 +8,17 @@
 # have received a copy of this license along with this file. You can also find
 # it at <http://www.wtfpl.net/>.
 
+import os
 import subprocess
+import threading
+import queue
+import collections
 import datetime
+import array
+from math import floor
+
+from ..constants import MAG_DECL_GRID
+from ..logging import logger
 
 
 class error(Exception):
@@ -20,14 +29,379 @@ class MagVarUnavailable(error):
         self.message = message
 
 
+class CoprocessUnavailable(error):
+    """Exception raised when MagneticFieldCoprocess can't be used."""
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class MagneticFieldCoprocess:
+    """Long-lived MagneticField process answering declination queries.
+
+    Request lines are written to the process' stdin by a dedicated
+    thread and the answers are read from its stdout by another one, as
+    they arrive. Several threads may call query() concurrently: their
+    requests are pipelined (i.e., written without waiting for the
+    answers to previous requests), and each answer line is dispatched
+    to the request it belongs to, in FIFO order.
+
+    If the process dies, pending requests fail and a new process is
+    started by the next query(). If no answer arrives within the
+    allowed time (this happens with MagneticField builds that don't
+    flush their output after each line), CoprocessUnavailable is raised
+    and the instance should not be used anymore. In order not to make
+    callers wait for this, startProbe() can be used to check the
+    process in a background thread before any real query.
+
+    """
+
+    # Maximum time to wait for the answers to a request, in seconds:
+    # TIMEOUT + TIMEOUT_PER_LINE*(number of lines in the request)
+    TIMEOUT = 5.0
+    TIMEOUT_PER_LINE = 1e-3
+
+    class _Request:
+        __slots__ = ("nbLines", "answers", "done", "failed")
+
+        def __init__(self, nbLines):
+            self.nbLines = nbLines
+            self.answers = []
+            self.done = threading.Event()
+            self.failed = False
+
+    def __init__(self, executable):
+        self.executable = executable
+        self._lock = threading.Lock()
+        self._proc = None
+        # Requests sent to self._proc whose answers are not complete yet
+        self._pending = collections.deque()
+        # Queue of text to write to the stdin of self._proc (None tells the
+        # writer thread to stop)
+        self._toWrite = None
+        # Set when the check started by startProbe() has succeeded
+        self._ready = threading.Event()
+        # String describing why the check failed, None otherwise
+        self.problem = None
+
+    def startProbe(self, line):
+        """Check in a background thread that the process answers promptly.
+
+        'line' should be a valid request line (without newline). Until
+        the check succeeds, isReady() returns False; if it fails,
+        self.problem is set to a string explaining why.
+
+        """
+        threading.Thread(name="MagneticField_probe", target=self._probe,
+                         args=(line,), daemon=True).start()
+
+    def _probe(self, line):
+        try:
+            self.query([line])
+        except CoprocessUnavailable as e:
+            self.problem = e.message
+        else:
+            self._ready.set()
+
+    def isReady(self):
+        """Tell whether the check started by startProbe() has succeeded."""
+        return self._ready.is_set()
+
+    def _start(self):
+        """Start a new process (self._lock must be held)."""
+        try:
+            proc = subprocess.Popen(
+                [self.executable], stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                universal_newlines=True, bufsize=1)
+        except OSError as e:
+            raise CoprocessUnavailable(
+                _("unable to find or execute '{exec}' ({errMsg})").format(
+                    exec=self.executable, errMsg=e)) from e
+
+        pending = collections.deque()
+        toWrite = queue.Queue()
+        threading.Thread(name="MagneticField_reader",
+                         target=self._readerThreadFunc, args=(proc, pending),
+                         daemon=True).start()
+        threading.Thread(name="MagneticField_writer",
+                         target=self._writerThreadFunc, args=(proc, toWrite),
+                         daemon=True).start()
+        self._proc, self._pending, self._toWrite = proc, pending, toWrite
+
+    @classmethod
+    def _writerThreadFunc(cls, proc, toWrite):
+        # Requests are written from this thread, without holding self._lock,
+        # so that the reader thread can always drain proc.stdout. Otherwise,
+        # for large requests, MagneticField would block on a full stdout pipe
+        # and stop reading its stdin, while we would block writing to it.
+        while True:
+            text = toWrite.get()
+            if text is None:
+                break
+
+            try:
+                proc.stdin.write(text)
+                proc.stdin.flush()
+            except (OSError, ValueError):
+                # The reader thread will mark the pending requests as failed.
+                break
+
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+
+    def _readerThreadFunc(self, proc, pending):
+        # 'pending' is the deque used for 'proc' only: after a restart,
+        # self._pending is a different object.
+        for line in proc.stdout:
+            with self._lock:
+                if not pending:
+                    continue    # unexpected output: ignore it
+                request = pending[0]
+                request.answers.append(line)
+                if len(request.answers) == request.nbLines:
+                    pending.popleft()
+                    request.done.set()
+
+        # End of file: the process died or was closed
+        proc.wait()
+        with self._lock:
+            if self._proc is proc:
+                self._proc = None
+            while pending:
+                request = pending.popleft()
+                request.failed = True
+                request.done.set()
+
+    def _submit(self, lines):
+        with self._lock:
+            if self._proc is None:
+                self._start()
+
+            request = self._Request(len(lines))
+            # Requests are written in the same order as they are queued here
+            self._pending.append(request)
+            self._toWrite.put(''.join(line + '\n' for line in lines))
+
+        return request
+
+    def query(self, lines):
+        """Send request lines to MagneticField and return the answer lines.
+
+        'lines' should be a sequence of strings without any newline
+        character. If the process dies before answering, it is
+        restarted and the request is submitted again, once.
+
+        """
+        if not lines:
+            return []
+
+        timeout = self.TIMEOUT + self.TIMEOUT_PER_LINE*len(lines)
+
+        for attempt in range(2):
+            request = self._submit(lines)
+            if not request.done.wait(timeout):
+                self.close()
+                raise CoprocessUnavailable(
+                    _("no answer from '{exec}' after {timeout:.0f} seconds")
+                    .format(exec=self.executable, timeout=timeout))
+            elif not request.failed:
+                return request.answers
+
+        raise CoprocessUnavailable(
+            _("'{exec}' died while processing a request").format(
+                exec=self.executable))
+
+    def close(self):
+        """Terminate the process, if any. This never raises."""
+        with self._lock:
+            proc, self._proc = self._proc, None
+            toWrite = self._toWrite
+
+        if proc is not None:
+            toWrite.put(None)   # the writer thread closes proc.stdin
+
+            try:
+                proc.terminate()
+            except OSError:
+                pass            # the process has already exited
+
+
+class DeclinationGrid:
+    """Magnetic declinations sampled on a regular latitude/longitude grid.
+
+    The grid has a node every STEP degrees, from -90° to 90° in latitude
+    and from -180° to 180° in longitude (both included). 'values' is an
+    array.array of doubles giving the declination at each node, row by
+    row (i.e., latitude by latitude). 'key' identifies the date and the
+    backend used to compute them (cf. EarthMagneticField._gridKey()).
+
+    """
+
+    MAGIC = b"FFGo magnetic declination grid\n"
+    FMT_VERSION = 1
+    BOM = 0x0102030405060708
+    STEP = 1
+    NB_LAT = 180 // STEP + 1
+    NB_LON = 360 // STEP + 1
+    # If the declinations at the four corners of a cell differ by more than
+    # this (in degrees), the cell is considered too close to a magnetic or
+    # geographic pole for interpolation to be accurate.
+    MAX_CELL_SPREAD = 2.0
+
+    def __init__(self, key, values):
+        self.key = key
+        self.values = values
+
+    @classmethod
+    def nodes(cls):
+        """Return the list of (lat, lon) tuples for all nodes, in order."""
+        step = cls.STEP
+        return [ (-90 + i*step, -180 + j*step)
+                 for i in range(cls.NB_LAT) for j in range(cls.NB_LON) ]
+
+    def interpolate(self, lat, lon):
+        """Return the declination at (lat, lon) using bilinear interpolation.
+
+        Return None if the point is in a cell where the declination
+        varies too much for interpolation to be reliable.
+
+        """
+        step, nbLon = self.STEP, self.NB_LON
+        x = (lat + 90) / step
+        i = min(max(floor(x), 0), self.NB_LAT - 2)
+        t = x - i
+        y = ((lon + 180) % 360) / step
+        j = min(floor(y), nbLon - 2)
+        u = y - j
+
+        values = self.values
+        k = i*nbLon + j
+        d00 = values[k]
+        # Declinations are angles: express the other corners relative to
+        # d00 so that, e.g., 179° and -179° are seen as 2° apart.
+        d01, d10, d11 = [ d00 + ((values[m] - d00 + 180.0) % 360.0 - 180.0)
+                          for m in (k + 1, k + nbLon, k + nbLon + 1) ]
+
+        corners = (d00, d01, d10, d11)
+        if max(corners) - min(corners) > self.MAX_CELL_SPREAD:
+            return None
+
+        d = ((1 - t)*((1 - u)*d00 + u*d01) +
+             t*((1 - u)*d10 + u*d11))
+        return (d + 180.0) % 360.0 - 180.0
+
+    # Format of the file written by save(): MAGIC, then the following
+    # unsigned 64-bit integers in native byte order: BOM, format version,
+    # NB_LAT, NB_LON, length of the UTF-8 encoded key; then the key and the
+    # values (doubles).
+    def save(self, path):
+        """Write the grid to 'path' (atomically)."""
+        key = self.key.encode("utf-8")
+        tmpPath = path + ".new"
+        with open(tmpPath, "wb") as f:
+            f.write(self.MAGIC)
+            array.array("Q", (self.BOM, self.FMT_VERSION, self.NB_LAT,
+                              self.NB_LON, len(key))).tofile(f)
+            f.write(key)
+            self.values.tofile(f)
+
+        os.replace(tmpPath, path)
+
+    @classmethod
+    def load(cls, path, key):
+        """Read a grid written by save().
+
+        Return None if the file doesn't exist, can't be parsed, or was
+        written for another key.
+
+        """
+        try:
+            with open(path, "rb") as f:
+                if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                    return None
+
+                header = array.array("Q")
+                header.fromfile(f, 5)
+                bom, fmtVersion, nbLat, nbLon, keyLen = header
+                if (bom != cls.BOM or fmtVersion != cls.FMT_VERSION or
+                    nbLat != cls.NB_LAT or nbLon != cls.NB_LON or
+                    f.read(keyLen) != key.encode("utf-8")):
+                    return None
+
+                values = array.array("d")
+                values.fromfile(f, nbLat*nbLon)
+        except (OSError, EOFError) as e:
+            logger.debug("Can't read the magnetic declination grid from "
+                         "'{}': {}".format(path, e))
+            return None
+
+        return cls(key, values)
+
+
 class EarthMagneticField:
-    def __init__(self, config):
+    """Magnetic declinations computed with GeographicLib's MagneticField.
+
+    Running MagneticField for each query would take a noticeable amount
+    of time (process startup, loading of the magnetic model). Unless
+    'exact' mode is requested (either with the corresponding argument
+    of decl() and batchDecl(), or with the config.magDeclGrid option),
+    queries are therefore answered by interpolation in a
+    DeclinationGrid. The grid is computed with one MagneticField run
+    the first time it is needed on a given (UTC) day, and saved to
+    'gridPath' for later FFGo sessions. Points for which interpolation
+    isn't reliable (see DeclinationGrid.interpolate()) are passed to
+    MagneticField in a single batch.
+
+    Exact declinations are obtained from a long-lived MagneticField
+    process (MagneticFieldCoprocess) if enabled with useCoprocess(),
+    which the constructor calls according to config.magFieldCoprocess;
+    otherwise, or while the process is being checked, MagneticField is
+    run once per batch of queries. This is also the case for batches of
+    more than COPROCESS_MAX_LINES points (such as the grid nodes), for
+    which starting a new process costs little in comparison.
+
+    """
+
+    COPROCESS_MAX_LINES = 1000
+
+    def __init__(self, config, gridPath=MAG_DECL_GRID):
         self.config = config
+        self.gridPath = gridPath
+        self.grid = None
+        self.gridDay = None     # day for which self.grid is valid
+        self.coprocess = None   # MagneticFieldCoprocess instance or None
         self._checkGeographicLibMagneticField()
         # Just check this works. Other parts of the program will fetch the
         # description just in time in case GeographicLib has been updated while
         # FFGo is running.
         self.getBackendDescription()
+        self.useCoprocess(config.magFieldCoprocess.get())
+
+    def useCoprocess(self, enable):
+        """Enable or disable the long-lived MagneticField process.
+
+        When enabled, the process is started and checked right away in
+        a background thread (cf. MagneticFieldCoprocess.startProbe()),
+        so that the first query doesn't have to wait for it.
+
+        """
+        if not enable:
+            self.close()
+        elif self.coprocess is None:
+            executable = self.config.MagneticField_bin.get() or "MagneticField"
+            self.coprocess = MagneticFieldCoprocess(executable)
+            self.coprocess.startProbe(self._testQuery())
+
+    def close(self):
+        """Terminate the MagneticField coprocess, if any. This never raises."""
+        coprocess, self.coprocess = self.coprocess, None
+        if coprocess is not None:
+            coprocess.close()
 
     def getBackendDescription(self):
         return self._runMagneticField(justGetVersion=True).strip()
@@ -46,9 +420,12 @@ class EarthMagneticField:
         Raise MagVarUnavailable if not.
 
         """
+        self._runMagneticField(self._testQuery() + "\n")
+
+    @classmethod
+    def _testQuery(cls):
         # KSFO at 0 meters above the ellipsoid modelling the Earth
-        self._runMagneticField(
-            "{} 37.61777 -122.37526 0\n".format(self._utcDayString()))
+        return "{} 37.61777 -122.37526 0".format(cls._utcDayString())
 
     def _runMagneticField(self, input_=None, justGetVersion=False):
         executable = self.config.MagneticField_bin.get() or "MagneticField"
@@ -96,28 +473,8 @@ class EarthMagneticField:
             else:
                 while out.endswith('\n'):
                     out = out[:-1]
-                try:
-                    # List comprehensions are fast. This can be useful in case
-                    # we process many lines at once.
-                    res = [ float(line.split()[0])
-                            for line in out.split('\n') ]
-                except ValueError as e:
-                    try:
-                        # Slower version of the same loop, that allows to
-                        # access the line that triggered the exception
-                        for line in out.split('\n'):
-                            decl = line.split()[0]
-                            float(decl)
-                    except ValueError:
-                        problem = _(
-                            "returned magnetic declination is not a float: "
-                            "{0!r} [complete output: {1!r}]").format(decl,
-                                                                     line)
-                    else:
-                        assert False, \
-                            "We should have caught an exception here!"
-                else:
-                    ok = True
+                res, problem = self._parseDeclinations(out.split('\n'))
+                ok = (problem is None)
 
         if ok:
             return res
@@ -127,7 +484,72 @@ class EarthMagneticField:
                 _("'{exec}' doesn't seem to work properly ({pb})").format(
                     exec=executable, pb=problem))
 
-    def decl(self, lat, lon):
+    @classmethod
+    def _parseDeclinations(cls, lines):
+        """Extract the declinations from MagneticField output lines.
+
+        Return a tuple (res, problem) where 'res' is the list of
+        declinations and 'problem' None, or 'res' is None and 'problem'
+        a string describing the problem encountered.
+
+        """
+        try:
+            # List comprehensions are fast. This can be useful in case we
+            # process many lines at once.
+            return ([ float(line.split()[0]) for line in lines ], None)
+        except ValueError:
+            # Slower version of the same loop, that allows to access the
+            # line that triggered the exception
+            for line in lines:
+                decl = line.split()[0]
+                try:
+                    float(decl)
+                except ValueError:
+                    return (None, _(
+                        "returned magnetic declination is not a float: "
+                        "{0!r} [complete output: {1!r}]").format(decl, line))
+
+            assert False, "We should have caught an exception here!"
+
+    def _queryCoprocess(self, lines):
+        """Get declinations from self.coprocess.
+
+        Return None if the coprocess can't be used (yet). If it turned
+        out not to work, it is disabled for the lifetime of this
+        instance (unless useCoprocess() is called again).
+
+        """
+        coprocess = self.coprocess
+        if coprocess is None:
+            return None
+        elif not coprocess.isReady():
+            if coprocess.problem is not None:
+                self._disableCoprocess(coprocess, coprocess.problem)
+            return None
+
+        try:
+            out = coprocess.query(lines)
+        except CoprocessUnavailable as e:
+            self._disableCoprocess(coprocess, e)
+            return None
+
+        res, problem = self._parseDeclinations(out)
+        if problem is not None:
+            raise MagVarUnavailable(
+                _("'{exec}' doesn't seem to work properly ({pb})").format(
+                    exec=coprocess.executable, pb=problem))
+
+        return res
+
+    def _disableCoprocess(self, coprocess, problem):
+        logger.warning(
+            "Not using a long-lived MagneticField process anymore: {}"
+            .format(problem))
+        coprocess.close()
+        if self.coprocess is coprocess:
+            self.coprocess = None
+
+    def decl(self, lat, lon, exact=None):
         """Return an estimate of the magnetic variation at the given point.
 
         The result is the declination (direction of the horizontal
@@ -137,10 +559,78 @@ class EarthMagneticField:
         probably be different years earlier or later, as the Earth's
         magnetic field varies over time).
 
+        If 'exact' is None, the config.magDeclGrid option decides
+        whether the declination grid is used (see the class docstring).
+
+        """
+        return self.batchDecl( ((lat, lon),), exact=exact )[0]
+
+    def batchDecl(self, inputIterable, exact=None):
+        """Return the list of declinations for an iterable of (lat, lon).
+
+        See decl() for details.
+
         """
-        return self.batchDecl( ((lat, lon),) )[0]
+        if exact is None:
+            exact = not self.config.magDeclGrid.get()
+
+        if exact:
+            return self._exactBatchDecl(inputIterable)
+
+        grid = self._getGrid()
+        res = []
+        missing = []            # indices in 'res' and points to compute
 
-    def batchDecl(self, inputIterable):
+        for i, (lat, lon) in enumerate(inputIterable):
+            d = grid.interpolate(lat, lon)
+            res.append(d)
+            if d is None:
+                missing.append((i, (lat, lon)))
+
+        if missing:
+            for (i, point), d in zip(
+                    missing,
+                    self._exactBatchDecl([ point for i, point in missing ])):
+                res[i] = d
+
+        return res
+
+    def _gridKey(self):
+        """Return a string identifying the grid for today."""
+        executable = self.config.MagneticField_bin.get() or "MagneticField"
+        return repr((self._utcDayString(), executable,
+                     self.getBackendDescription()))
+
+    def _getGrid(self):
+        """Return an up-to-date DeclinationGrid instance.
+
+        The grid is read from self.gridPath if possible, otherwise
+        computed and saved there.
+
+        """
+        today = self._utcDayString()
+        if self.grid is not None and self.gridDay == today:
+            return self.grid
+
+        key = self._gridKey()
+        grid = DeclinationGrid.load(self.gridPath, key)
+
+        if grid is None:
+            logger.info("Computing the magnetic declination grid for {}"
+                        .format(today))
+            grid = DeclinationGrid(
+                key, array.array("d", self._exactBatchDecl(
+                    DeclinationGrid.nodes())))
+            try:
+                grid.save(self.gridPath)
+            except OSError as e:
+                logger.warning("Unable to write '{}': {}".format(
+                    self.gridPath, e))
+
+        self.grid, self.gridDay = grid, today
+        return grid
+
+    def _exactBatchDecl(self, inputIterable):
         l = []
         # GeographicLib versions 1.39 (released 2014-11-11) and later interpret
         # the string 'now' as the current UTC date. Emulate this for users of
@@ -161,10 +651,14 @@ class EarthMagneticField:
             # date, lat, lon, altitude
             l.append(' '.join((today, lat, lon, "0")))
 
-        if l:
-            l.append('')        # to obtain a final newline
-            text = '\n'.join(l)
-            return self._runMagneticField(input_=text)
-        else:
+        if not l:
             return []
 
+        if len(l) <= self.COPROCESS_MAX_LINES:
+            res = self._queryCoprocess(l)
+            if res is not None:
+                return res
+
+        l.append('')            # to obtain a final newline
+        text = '\n'.join(l)
+        return self._runMagneticField(input_=text)
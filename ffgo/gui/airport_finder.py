@@ -13,7 +13,7 @@ import tkinter as tk
 from tkinter import ttk
 from tkinter.messagebox import showinfo, showerror
 
-from ..constants import PROGNAME
+from ..constants import PROGNAME, GEODESIC_MEMO_SIZE
 from .. import common_transl
 from . import widgets
 from ..geo import geodesy
@@ -52,7 +52,9 @@ class ValidatingWidget:
 class AirportFinder:
     "Airport finder dialog."""
 
-    geodCalc = geodesy.GeodCalc()
+    # Results are memoized, so that searching again around the same reference
+    # airport (e.g., with different filters) doesn't recompute the geodesics.
+    geodCalc = geodesy.GeodCalc(memoSize=GEODESIC_MEMO_SIZE)
 
     def __init__(self, master, config, app):
         for attr in ("master", "config", "app"):
@@ -171,6 +173,9 @@ class AirportFinder:
         self.refIcao = tk.StringVar()
         self.refIcao.trace("w", self.onRefIcaoWritten)
         self.results = None
+        # Magnetic declinations for the airports of self.results, computed
+        # when needed by displayResults(): (magDeclAtRef, magDecl)
+        self.resultsMagDecl = None
 
         def rwyLengthFormatFunc(length):
             return "" if length is None else str(round(length))
@@ -198,13 +203,14 @@ class AirportFinder:
         refAirportSearchColumns = { col.name: col
                                     for col in refAirportSearchColumnsList }
 
-        refAirportSearchData = []
-        for icao in config.sortedIcao():
-            airport = config.airports[icao]
-            refAirportSearchData.append(
-                (icao, airport.name, airport.nbLandRunways,
-                 airport.nbWaterRunways, airport.nbHelipads,
-                 airport.minRwyLength, airport.maxRwyLength))
+        # Use the columns of the AirportTable, in order to avoid creating an
+        # AirportStub instance for every airport.
+        airports = config.airports
+        refAirportSearchData = [
+            (airports.icao(row), airports.name(row),
+             airports.nbLandRunways[row], airports.nbWaterRunways[row],
+             airports.nbHelipads[row]) + airports.rwyLengths(row)
+            for row in range(len(airports)) ]
 
         self.airportChooser = widgets.AirportChooser(
             self.master, self.config,
@@ -840,6 +846,7 @@ class AirportFinder:
     def onRefIcaoWritten(self, *args):
         icao = self.refIcao.get()
         self.results = None     # the results were for the previous ref airport
+        self.resultsMagDecl = None
 
         self.searchDescrLabelVar.set(
             _("Distance from ref. ({refIcao})").format(
@@ -914,34 +921,42 @@ class AirportFinder:
         maxRLLB = locale.atof(self.maxRwyLengthLowerBound.get())
 
         self.results = []
+        self.resultsMagDecl = None
         omittedResults = set()
 
         if refIcao:
-            refApt = self.config.airports[refIcao]
+            airports = self.config.airports
+            refApt = airports[refIcao]
             refAptLat, refAptLon = refApt.lat, refApt.lon # for performance
 
-            distCalcFunc = getattr(self.geodCalc, self.calcMethodVar.get())
-            airportsDict = self.config.airports
-
-            for apt in airportsDict.values():
-                try:
-                    g = distCalcFunc(apt.lat, apt.lon,
-                                     refAptLat, refAptLon)
-                except geodesy.VincentyInverseError:
-                    omittedResults.add(apt.icao)
-                    continue
-
-                if \
-            (minDist <= g["s12"] <= maxDist and
-             minNbLandRunways <= apt.nbLandRunways <= maxNbLandRunways and
-             minNbWaterRunways <= apt.nbWaterRunways <= maxNbWaterRunways and
-             minNbHelipads <= apt.nbHelipads <= maxNbHelipads and
-             (mustHaveLandOrWaterRwys and
-              (apt.minRwyLength is not None and apt.minRwyLength <= minRLUB and
-               apt.maxRwyLength is not None and apt.maxRwyLength >= maxRLLB) or
-              not mustHaveLandOrWaterRwys)):
-                    self.results.append(
-                        (apt, g["s12"], g["azi1"], g["azi2"]))
+            if mustHaveLandOrWaterRwys:
+                rwyLengthConditions = {"minRwyLengthAtMost": minRLUB,
+                                       "maxRwyLengthAtLeast": maxRLLB}
+            else:
+                rwyLengthConditions = {}
+
+            # Only consider the airports in cells of the spatial index that
+            # may be within maxDist, and apply the cheap, column-wise tests
+            # before computing any distance.
+            rows = airports.filterRows(
+                rows=self.config.getAirportIndex().radiusCandidates(
+                    refAptLat, refAptLon, maxDist),
+                nbLandRunways=(minNbLandRunways, maxNbLandRunways),
+                nbWaterRunways=(minNbWaterRunways, maxNbWaterRunways),
+                nbHelipads=(minNbHelipads, maxNbHelipads),
+                **rwyLengthConditions)
+
+            # Distances are only computed for airports that pass a cheap
+            # bounding test for the [minDist, maxDist] ring.
+            results, failures = self.geodCalc.inverseInRing(
+                airports.lat, airports.lon, refAptLat, refAptLon,
+                minDist, maxDist, method=self.calcMethodVar.get(),
+                indices=rows)
+
+            omittedResults.update(airports.icao(row) for row in failures)
+            self.results.extend(
+                (airports.stub(row), s12, azi1, azi2)
+                for row, s12, azi1, azi2 in results)
 
             return omittedResults
         else:
@@ -957,15 +972,20 @@ class AirportFinder:
 
         magBearings = (self.bearingsType.get() == "magnetic")
         if magBearings:
-            # This is correct, because self.results is set to None whenever
-            # self.refIcao is changed.
-            refApt = self.config.airports[self.refIcao.get()]
-            refAptLat, refAptLon = refApt.lat, refApt.lon
-            magDeclAtRef = magField.decl(refAptLat, refAptLon)
+            # The declinations don't depend on the display options, so they
+            # are only computed once for a given set of results.
+            if self.resultsMagDecl is None:
+                # This is correct, because self.results is set to None
+                # whenever self.refIcao is changed.
+                refApt = self.config.airports[self.refIcao.get()]
+                refAptLat, refAptLon = refApt.lat, refApt.lon
+
+                latLon = [ (airport.lat, airport.lon)
+                           for airport, *rest in self.results ]
+                self.resultsMagDecl = (magField.decl(refAptLat, refAptLon),
+                                       magField.batchDecl(latLon))
 
-            latLon = [ (airport.lat, airport.lon)
-                       for airport, *rest in self.results ]
-            magDecl = magField.batchDecl(latLon)
+            magDeclAtRef, magDecl = self.resultsMagDecl
 
         if self.lengthUnit.get() == "nautical mile":
             self.resultsColumns["distance"].formatFunc = (
@@ -1012,6 +1032,7 @@ class AirportFinder:
 
     def clearResults(self):
         self.results = []
+        self.resultsMagDecl = None
         self.displayResults(FFGoClearNbResultsTextVar=True)
         self.chooseSelectedAptButton.state(["disabled"])
 
@@ -14,7 +14,7 @@ import tkinter as tk
 from tkinter import ttk
 from tkinter.messagebox import showwarning
 
-from ..constants import PROGNAME
+from ..constants import PROGNAME, GEODESIC_MEMO_SIZE
 from .. import common_transl
 from . import widgets
 from ..geo import geodesy
@@ -40,7 +40,9 @@ def setupEarthMagneticFieldProvider(provider):
 class GPSTool:
     """GPS Tool dialog."""
 
-    geodCalc = geodesy.GeodCalc()
+    # Results are memoized, because updateResults() is called again each time
+    # the calculation method is changed.
+    geodCalc = geodesy.GeodCalc(memoSize=GEODESIC_MEMO_SIZE)
 
     def __init__(self, master, config, app):
         for attr in ("master", "config", "app"):
@@ -52,6 +54,9 @@ class GPSTool:
         # causing an update of widget B, itself causing an update of widget
         # A...
         self.dontUpdateFlightDuration = self.dontUpdateGroundSpeed = False
+        # (icaoA, icaoB) for the magnetic declinations in self.magDeclA and
+        # self.magDeclB
+        self.magDeclIcaos = None
 
         self.top = tk.Toplevel(self.master)
         self.top.transient(self.master)
@@ -496,10 +501,9 @@ class GPSTool:
         airportSearchColumns = { col.name: col
                                  for col in airportSearchColumnsList }
 
-        airportSearchData = []
-        for icao in self.config.sortedIcao():
-            airport = self.config.airports[icao]
-            airportSearchData.append((icao, airport.name))
+        airports = self.config.airports
+        airportSearchData = [ (airports.icao(row), airports.name(row))
+                              for row in range(len(airports)) ]
 
         airportChooser = widgets.AirportChooser(
             self.master, self.config,
@@ -534,17 +538,21 @@ class GPSTool:
         icaoB = self.icaoVarB.get()
 
         if icaoA and icaoB:     # we have two defined airports, go ahead
-            distCalcFunc = getattr(self.geodCalc, self.calcMethodVar.get())
             aptA = self.config.airports[icaoA]
             aptB = self.config.airports[icaoB]
 
-            if magField is not None:
+            # Only ask for the magnetic declinations if the airports changed
+            # (e.g., not when only the calculation method did).
+            if (magField is not None and
+                self.magDeclIcaos != (icaoA, icaoB)):
                 self.magDeclA, self.magDeclB = magField.batchDecl(
                     ((aptA.lat, aptA.lon), (aptB.lat, aptB.lon)))
+                self.magDeclIcaos = (icaoA, icaoB)
 
-            try:
-                g = distCalcFunc(aptA.lat, aptA.lon, aptB.lat, aptB.lon)
-            except geodesy.VincentyInverseError:
+            g = self.geodCalc.batchInverse(aptA.lat, aptA.lon,
+                                           aptB.lat, aptB.lon,
+                                           method=self.calcMethodVar.get())
+            if not g.ok[0]:
                 message = _('Unable to perform this calculation')
                 detail = _(
                     "Could not compute the distance and bearings between "
@@ -561,9 +569,9 @@ class GPSTool:
                             detail=detail, parent=self.top)
             else:
                 # The calculation went fine; set the relevant attributes.
-                self.distance = g["s12"]        # in meters
-                self.bearingABinit = g["azi1"]  # true bearing
-                self.bearingABfinal = g["azi2"] # ditto
+                self.distance = g.s12[0]        # in meters
+                self.bearingABinit = g.azi1[0]  # true bearing
+                self.bearingABfinal = g.azi2[0] # ditto
 
         self.updateDisplayedResults()
 
@@ -14,6 +14,7 @@ import functools
 import collections
 import enum
 import traceback
+import time
 from gettext import translation
 import threading
 import queue as queue_mod       # keep 'queue' available for variable bindings
@@ -46,6 +47,9 @@ from .. import constants
 from ..constants import *
 from .. import fgdata
 from ..fgdata.parking import ParkingSource
+from ..fgdata.airport_prefetch import AirportPrefetcher
+from ..fgdata.aircraft_metadata import AircraftMetadataIndexer
+from ..fgdata.scenery_watcher import SceneryMonitor
 from .pressure_converter import PressureConverterDialog
 
 try:
@@ -299,9 +303,14 @@ class App:
         # because this allows AircraftChooser.findMatches() to be a bit more
         # efficient (no need to store unused values in local variables for
         # *each* aircraft of the list).
+        #
+        # The invisible “metadata key” column contains the words read from
+        # the aircraft -set.xml file (description, author, tags...) when
+        # available (cf. AircraftMetadata.searchKey). It is also searched by
+        # AircraftChooser.findMatches(), for long enough queries.
         self.aircraftList = widgets.MyTreeview(
             self.frame12, columns=["match key", "name", "directory",
-                                   "use count"],
+                                   "use count", "metadata key"],
             displaycolumns=aircraftListDisplayColumns, show="headings",
             selectmode="browse", height=14,
             yscrollcommand=onAircraftListScrolled)
@@ -340,7 +349,8 @@ class App:
             widgets.Column("directory", _("Directory"), 2, "w", True),
             widgets.Column("use count", _("Use count"), 3, "e", False, "width",
                            widthText="M"*4,
-                           sortOrder=widgets.SortOrder.descending)]
+                           sortOrder=widgets.SortOrder.descending),
+            widgets.Column("metadata key", "", 4, "w", True)]
         aircraftListColumns = { col.name: col
                                for col in aircraftListColumnsList }
 
@@ -647,6 +657,8 @@ class App:
             # Once the Treeview is scrolled, the tooltip is likely not to match
             # the airport under the mouse pointer anymore.
             self.airportTooltip.hide()
+            # Other airports are now visible
+            self.prefetchAirportData()
 
         # Used below for the tooltip function
         airportListDisplayColumns = ["icao", "name", "use count"]
@@ -784,6 +796,9 @@ class App:
                                           # self.pressureConverterDialog to None
         self.setAirportFinderToNone() # Initialize self.airportFinder to None
         self.setGPSToolToNone()       # Initialize self.gpsTool to None
+        self.setupAirportPrefetcher()
+        self.setupAircraftMetadataIndexer()
+        self.setupSceneryMonitor()
 
         rereadCfgFile = self.proposeConfigChanges()
         # Will set self.FGCommand.{argList,lastConfigParsingExc}
@@ -1048,14 +1063,77 @@ want to follow this new default and set “Airport database update” to
         self.aboutTitle.destroy()
         self.aboutLicense.destroy()
 
-    def buildAircraftList(self, clearSearch=False):
-        matchKeyFunc = self.aircraftChooser.aircraftNameMatchKey
-        aircraftTreeData = [ (matchKeyFunc(ac.name), ac.name, ac.dir,
-                              ac.useCountForShow)
+    def buildAircraftList(self, clearSearch=False, preserveSelection=False):
+        treeDataFunc = self.aircraftChooser.treeDataForAircraft
+        aircraftTreeData = [ treeDataFunc(ac)
                              for ac in self.config.aircraftList ]
         # Update the aircraft list widget
         self.aircraftChooser.setTreeData(aircraftTreeData,
-                                         clearSearch=clearSearch)
+                                         clearSearch=clearSearch,
+                                         preserveSelection=preserveSelection)
+
+    def setupAircraftMetadataIndexer(self):
+        self.aircraftMetadataIndexer = AircraftMetadataIndexer(
+            notify=self._notifyAircraftMetadataIndexed)
+        self.master.bind("<<FFGoAircraftMetadataIndexed>>",
+                         self._onAircraftMetadataIndexed)
+
+    def indexAircraftMetadata(self):
+        """Attach -set.xml metadata to the aircraft of the aircraft list.
+
+        Metadata from the on-disk index is used right away, then the
+        index is checked and updated in a background thread (cf.
+        AircraftMetadataIndexer); _onAircraftMetadataIndexed() applies
+        the results.
+
+        """
+        if not self.config.aircraftMetadataIndexing.get():
+            return
+
+        index = self.config.getAircraftMetadataIndex()
+        for aircraft in self.config.aircraftList:
+            aircraft.metadata = index.get(aircraft.setFile)
+
+        setFiles = [ aircraft.setFile for aircraft in self.config.aircraftList ]
+        self.aircraftMetadataIndexer.start(index, setFiles,
+                                           fgRoot=self.config.FG_root.get())
+
+    def _notifyAircraftMetadataIndexed(self):
+        # Called from the indexer thread, cf. _notifyAirportDataPrefetched().
+        try:
+            self.master.event_generate("<<FFGoAircraftMetadataIndexed>>",
+                                       when="tail")
+            # In case Tk is not here anymore
+        except TclError:
+            pass
+
+    def _onAircraftMetadataIndexed(self, event=None):
+        res = self.aircraftMetadataIndexer.results()
+        if res is None:         # outdated job
+            return
+
+        generation, entries, nbParsed = res
+        index = self.config.getAircraftMetadataIndex()
+        index.entries = entries
+
+        if nbParsed:
+            logger.info("Read metadata from {} aircraft -set.xml files"
+                        .format(nbParsed))
+            try:
+                index.save()
+            except OSError as e:
+                logger.warning("Unable to write '{}': {}".format(index.path,
+                                                                 e))
+
+        changed = False
+        for aircraft in self.config.aircraftList:
+            metadata = index.get(aircraft.setFile)
+            if metadata != aircraft.metadata:
+                aircraft.metadata = metadata
+                changed = True
+
+        if changed:
+            self.buildAircraftList(preserveSelection=True)
 
     def buildAirportList(self, clearSearch=False):
         if (self.config.auto_update_apt.get() or
@@ -1073,8 +1151,8 @@ want to follow this new default and set “Airport database update” to
             # 'Config.airportStatsExpiryPeriod'.
             self.config.airportStatsManager.save()
 
-        # This is limited to the list of installed airports if
-        # 'Config.filteredAptList' is set to 1.
+        # Rows of 'self.config.airports'. This is limited to the list of
+        # installed airports if 'Config.filteredAptList' is set to 1.
         self.browsableAirports = self.config.readAptDigestFile()
 
         # Load the saved statistics into the new in-memory AirportStub
@@ -1083,13 +1161,20 @@ want to follow this new default and set “Airport database update” to
         # reload them afterwards).
         self.config.airportStatsManager.load()
 
-        airportListData = [ (airport.icao, airport.name,
-                             airport.useCountForShow)
-                            for airport in self.browsableAirports ]
+        self._updateAirportChooserData(clearSearch=clearSearch)
+        self.watchScenery()
+
+    def _updateAirportChooserData(self, clearSearch=False,
+                                  preserveSelection=False):
+        airports = self.config.airports
+        airportListData = [ (airports.icao(row), airports.name(row),
+                             airports.useCountForShow(row))
+                            for row in self.browsableAirports ]
         # Update the airport list widget (as opposed to
         # 'self.browsableAirports', which is also an airport list in some way)
         self.airportChooser.setTreeData(airportListData,
-                                        clearSearch=clearSearch)
+                                        clearSearch=clearSearch,
+                                        preserveSelection=preserveSelection)
 
     def commentText(self):
         """Highlight comments in text window."""
@@ -1371,11 +1456,9 @@ useless!). Thank you.""").format(prg=PROGNAME, startOfMsg=startOfMsg,
         False.
 
         """
-        for cachedIcao, cachedAirport in self.config.aptDatCache:
-            if cachedIcao == icao:
-                found = True
-                airport = cachedAirport
-                break
+        airport = self.config.aptDatCache.get(icao)
+        if airport is not None:
+            found = True
         else:
             # index[0] is the file index in Config.aptDatFilesInfoFromDigest,
             # index[1] is the byte offset in that file and
@@ -1393,7 +1476,7 @@ useless!). Thank you.""").format(prg=PROGNAME, startOfMsg=startOfMsg,
             self.config.aptDatSetManager.readAirportDataUsingIndex(icao, index)
 
             if found:
-                self.config.aptDatCache.append((icao, airport))
+                self.config.aptDatCache.put(icao, airport)
             else:
                 self._readAirportDataWrongIndexErrMsg(
                     "airport not found at index", icao, aptDatPath,
@@ -1401,6 +1484,177 @@ useless!). Thank you.""").format(prg=PROGNAME, startOfMsg=startOfMsg,
 
         return (found, airport)
 
+    def setupAirportPrefetcher(self):
+        # Identifier returned by Tk's after() method, used to delay
+        # prefetching until the selection and the airport list are stable
+        self._prefetchAfterId = None
+        self.airportPrefetcher = AirportPrefetcher(
+            notify=self._notifyAirportDataPrefetched)
+        self.master.bind("<<FFGoAirportDataPrefetched>>",
+                         self._onAirportDataPrefetched)
+
+    def setupSceneryMonitor(self):
+        self.sceneryMonitor = SceneryMonitor(
+            SCENERY_WATCH_INTERVAL / 1000,
+            notify=self._notifySceneryChanged)
+        self.master.bind("<<FFGoSceneryChanged>>", self._onSceneryChanged)
+
+    def watchScenery(self):
+        """Start or stop watching the scenery paths, as appropriate.
+
+        This is only needed when the airport list is limited to
+        installed airports. The scenery paths are polled in a background
+        thread (cf. SceneryMonitor); _onSceneryChanged() applies the
+        changes.
+
+        """
+        if self.config.filteredAptList.get():
+            sceneryPaths, watcher = self.config.takeSceneryWatcher()
+            self.sceneryMonitor.start(sceneryPaths, watcher)
+        else:
+            self.sceneryMonitor.stop()
+
+    def _notifySceneryChanged(self):
+        # Called from the scenery monitor thread, cf.
+        # _notifyAirportDataPrefetched().
+        try:
+            self.master.event_generate("<<FFGoSceneryChanged>>", when="tail")
+            # In case Tk is not here anymore
+        except TclError:
+            pass
+
+    def _onSceneryChanged(self, event=None):
+        """Apply scenery changes to the list of installed airports.
+
+        Only the rows of the added and removed airports are processed,
+        and only the corresponding items of the airport list are
+        inserted or deleted.
+
+        """
+        for addedTiles, removedTiles in self.sceneryMonitor.results():
+            try:
+                delta = self.config.updateInstalledAptList(addedTiles,
+                                                           removedTiles)
+            except OSError as e:
+                logger.warning("Unable to update the list of installed "
+                               "airports: {}".format(e))
+                continue
+
+            if delta is None:
+                continue
+
+            addedRows, removedRows = delta
+            rows = set(self.browsableAirports)
+            rows.difference_update(removedRows)
+            rows.update(addedRows)
+            # Rows are sorted the same way as ICAO codes
+            self.browsableAirports = sorted(rows)
+
+            airports = self.config.airports
+            self.airportChooser.updateAirports(
+                [ (airports.icao(row), airports.name(row),
+                   airports.useCountForShow(row)) for row in addedRows ],
+                { airports.icao(row) for row in removedRows })
+
+    def _notifyAirportDataPrefetched(self):
+        # Called from the prefetcher thread, cf.
+        # _monitorFgfsProcessThreadFunc().
+        try:
+            self.master.event_generate("<<FFGoAirportDataPrefetched>>",
+                                       when="tail")
+            # In case Tk is not here anymore
+        except TclError:
+            pass
+
+    def _onAirportDataPrefetched(self, event=None):
+        """Store prefetched airport data in self.config.aptDatCache.
+
+        This runs in the main thread, as the cache is not thread-safe.
+        The data only goes to the in-memory tier of the cache, which is
+        cheap; it is written to disk if and when it is actually used.
+
+        """
+        cache = self.config.aptDatCache
+
+        for icao, airport, generation in self.airportPrefetcher.results():
+            # Discard data read before the cache was invalidated (new
+            # apt.dat files, new apt digest file...)
+            if generation == cache.generation and icao not in cache:
+                cache.put(icao, airport, persist=False)
+
+    # Accept any arguments to allow safe use as a Tkinter variable observer
+    def prefetchAirportData(self, *args):
+        """Schedule prefetching of airport data likely to be needed soon.
+
+        The airports concerned are the selected one, its most used
+        neighbours and those visible in the airport list. Their data is
+        read in a background thread and stored in
+        self.config.aptDatCache, so that the runway and parking popups
+        can be opened without delay.
+
+        """
+        if self._prefetchAfterId is not None:
+            self.master.after_cancel(self._prefetchAfterId)
+
+        self._prefetchAfterId = self.master.after(
+            PREFETCH_AIRPORT_DATA_DELAY, self._prefetchAirportData)
+
+    def _prefetchAirportData(self):
+        self._prefetchAfterId = None
+
+        if not self.config.aptDataPrefetch.get():
+            self.airportPrefetcher.cancel()
+            return
+
+        airports = self.config.airports
+        cache = self.config.aptDatCache
+        rows = []
+
+        selectedRow = airports.row(self.config.airport.get())
+        if selectedRow is not None:
+            rows.append(selectedRow)
+            rows.extend(self._mostUsedNeighbours(selectedRow))
+
+        tree = self.airportList
+        children = tree.get_children()
+        if children:
+            top, bottom = tree.yview()
+            start = int(top*len(children))
+            end = int(bottom*len(children)) + 1
+            rows.extend(airports.rows(tree.set(item, "icao")
+                                      for item in children[start:end]))
+
+        items = []
+        for row in rows:
+            icao = airports.icao(row)
+            if icao not in cache:
+                items.append((icao, airports.airportIndex(row)))
+
+        self.airportPrefetcher.request(self.config.aptDatSetManager, items,
+                                       tag=cache.generation)
+
+    def _mostUsedNeighbours(self, row):
+        """Return the rows of the most used airports near the one at 'row'.
+
+        At most PREFETCH_AIRPORT_DATA_NB_NEIGHBOURS rows are returned,
+        sorted by decreasing use count (cf. AirportStatsManager).
+
+        """
+        airports = self.config.airports
+        candidates = self.config.getAirportIndex().radiusCandidates(
+            airports.lat[row], airports.lon[row],
+            PREFETCH_AIRPORT_DATA_NEIGHBOURS_RADIUS)
+
+        l = []
+        for neighbour in candidates:
+            useCount = airports.useCountForShow(neighbour)
+            if useCount and neighbour != row:
+                l.append((useCount, neighbour))
+
+        l.sort(reverse=True)
+        return [ neighbour for useCount, neighbour in
+                 l[:PREFETCH_AIRPORT_DATA_NB_NEIGHBOURS] ]
+
     def _readGroundnetFile(self, groundnetPath):
         parkings, exceptions = fgdata.parking.readGroundnetFile(groundnetPath)
 
@@ -1616,6 +1870,7 @@ useless!). Thank you.""").format(prg=PROGNAME, startOfMsg=startOfMsg,
         self.config.aircraftId.trace('w', self.FGCommand.update)
         self.config.airport.trace('w', self.resetRwyParkAndCarrier)
         self.config.airport.trace('w', self.FGCommand.update)
+        self.config.airport.trace('w', self.prefetchAirportData)
         self.config.scenario.trace('w', self.FGCommand.update)
         self.config.carrier.trace('w', self.FGCommand.update)
         self.config.FG_root.trace('w', self.FGCommand.update)
@@ -1638,7 +1893,13 @@ useless!). Thank you.""").format(prg=PROGNAME, startOfMsg=startOfMsg,
         # Don't call config.update() at application initialization
         # as config object is updated at its creation anyway.
         if readCfgFile:
-            self.config.update(path)
+            progressHandler = AircraftScanProgressFeedbackHandler(self.master)
+            self.config.aircraftScanProgressFeedbackHandler = progressHandler
+            try:
+                self.config.update(path)
+            finally:
+                progressHandler.close()
+                self.config.aircraftScanProgressFeedbackHandler = None
 
         setupTranslationHelper(self.config) # the language may have changed
 
@@ -1698,6 +1959,7 @@ useless!). Thank you.""").format(prg=PROGNAME, startOfMsg=startOfMsg,
         # Clear the aircraft search entry and rebuild the aircraft list at the
         # same time. The aircraft thumbnail is updated via an observer when
         # Config.aircraftId is set by Config.update().
+        self.indexAircraftMetadata()
         self.buildAircraftList(clearSearch=True)
         # Clear the airport search entry and rebuild the airport list at the
         # same time.
@@ -2345,6 +2607,49 @@ useless!). Thank you.""").format(prg=PROGNAME, startOfMsg=startOfMsg,
                              self.config.showFGOutputInSeparateWindow.get())
 
 
+class AircraftScanProgressFeedbackHandler(misc.ProgressFeedbackHandler):
+    """Show the progress of aircraft discovery (cf. Config._readAircraft()).
+
+    The progress window only appears if the scan lasts more than
+    AIRCRAFT_SCAN_PROGRESS_DELAY milliseconds. close() must be called
+    when the scan is over.
+
+    """
+    def __init__(self, master, *args, **kwargs):
+        self.master = master
+        self.window = None
+        self.startTime = time.monotonic()
+        self.progressTextVar = StringVar()
+        self.progressValueVar = StringVar()
+        misc.ProgressFeedbackHandler.__init__(self, *args, **kwargs)
+
+    def onUpdated(self):
+        if self.window is None:
+            if (1000*(time.monotonic() - self.startTime) <
+                AIRCRAFT_SCAN_PROGRESS_DELAY):
+                return
+
+            self.window = infowindow.InfoWindow(
+                self.master, text=_("Reading the aircraft directories..."),
+                withProgress=True,
+                progressLabelKwargs={"textvariable": self.progressTextVar},
+                progressWidgetKwargs={"orient": "horizontal",
+                                      "variable": self.progressValueVar,
+                                      "mode": "determinate"})
+
+        self.progressTextVar.set(self.text)
+        # The default range in ttk.Progressbar() is [0, 100]
+        self.progressValueVar.set(
+            100*(self.value - self.min)/self.amplitude)
+        # We don't get back to the Tk main loop during the scan
+        self.window.progressWidget.update_idletasks()
+
+    def close(self):
+        if self.window is not None:
+            self.window.destroy()
+            self.window = None
+
+
 class AttachableToplevel(Toplevel):
     """Class representing a Toplevel window that can be attached/detached.
 
@@ -3,7 +3,6 @@
 """Simple widget to display METAR reports from tgftp.nws.noaa.gov/."""
 
 
-import sys
 import socket
 from urllib.request import Request, build_opener, HTTPHandler
 from urllib.error import URLError
@@ -11,12 +10,10 @@ import threading
 import queue as queue_mod       # keep 'queue' available for variable bindings
 import functools
 import traceback
-import collections
 from tkinter import *
 
 from .. import constants
 from ..logging import logger
-from ..geo import geodesy
 
 
 socket.setdefaulttimeout(5.0)
@@ -25,8 +22,6 @@ HTTP_DEBUG_LEVEL = 0
 
 class Metar:
 
-    geodCalc = geodesy.GeodCalc()
-
     def __init__(self, app, master, config, background):
         self.app = app
         self.master = master
@@ -205,48 +200,15 @@ class Metar:
 
     def _isOnMetarList(self, icao):
         """Return True if selected airport is on METAR station list."""
-        return icao in self.metar_list
+        return self.config.getMetarStations().isStation(icao)
 
     def _nearestMetar(self, icao):
         """Find the nearest METAR station for 'icao'."""
-        shortestDist = sys.float_info.max
-        # We'll do a quick estimation of the distance for all candidates, and a
-        # precise calculation for the 15 closest to 'icao'.
-        closestStations = collections.deque(maxlen=15)
-
-        try:
-            airport = self.config.airports[icao]
-        except KeyError:
-            return ''
-
-        aptLat, aptLon = airport.lat, airport.lon # used many times
+        res = self.config.getMetarStations().nearest(icao)
 
-        for icao in self.metar_list:
-            try:
-                metarCandidate = self.config.airports[icao]
-            except KeyError:
-                continue
-
-            # Fast method, that doesn't give insane results for, e.g., points
-            # located on either side of the ±180° meridian.
-            distance = self.geodCalc.modifiedFccDistance(
-                aptLat, aptLon, metarCandidate.lat, metarCandidate.lon)
-            if distance <= shortestDist:
-                closestStations.append(metarCandidate)
-                shortestDist = distance
-
-        if closestStations:
-            # Final contest
-            def dist(metarCandidate):
-                # Moderately slow compared to modifiedFccDistance(), but very
-                # accurate. Since we are only using this method for a few
-                # airports, the delay won't be noticeable.
-                return self.geodCalc.inverse(
-                    aptLat, aptLon,
-                    metarCandidate.lat, metarCandidate.lon)["s12"]
-
-            closest = min(closestStations, key=dist)
-            return closest.icao
+        if res:
+            station, dist = res[0]
+            return station
         else:
             return ''
 
@@ -15,6 +15,7 @@ from tkinter import ttk
 
 from .. import misc
 from .. import constants
+from ..fgdata.aircraft_metadata import AircraftMetadata
 
 
 class error(Exception):
@@ -540,6 +541,40 @@ class IncrementalChooser(metaclass=abc.ABCMeta):
         self._autoUpdateTreeSelection(
             preserveSelection=preserveSelection)
 
+    def _sortKeyFunc(self):
+        """Return the sort key function for elements of 'self.treeData'."""
+        col = self.columnsMetadata[self.sortBy]
+        dataIndex = col.dataIndex
+
+        if col.sortFunc is not None:
+            return lambda data, f=col.sortFunc: f(data[dataIndex])
+        else:
+            return lambda data: data[dataIndex]
+
+    def _valuesFunc(self):
+        """Return a function giving the values to display for a tree item.
+
+        The function takes an element of 'self.treeData' and applies the
+        column formatters, if any.
+
+        """
+        hasSpecialFormatter = any(
+            ( col.formatFunc is not None for col in self.columns ))
+
+        if not hasSpecialFormatter:
+            # Optimize the case where no column has a formatter function
+            return lambda rawValues: rawValues
+
+        formatter = []
+        identity = lambda x: x
+        for col in self.columns:
+            formatter.append(identity if col.formatFunc is None
+                             else col.formatFunc)
+
+        return lambda rawValues: [
+            formatter[dataIndex](rawValue)
+            for dataIndex, rawValue in enumerate(rawValues) ]
+
     def _updateTreeWidget(self):
         """Update the contents of 'self.treeWidget' based on 'self.matches'."""
         tree = self.treeWidget
@@ -548,30 +583,77 @@ class IncrementalChooser(metaclass=abc.ABCMeta):
         # using tree.move() for each element.
         tree.delete(*tree.get_children())
 
-        hasSpecialFormatter = any(
-            ( col.formatFunc is not None for col in self.columns ))
+        values = self._valuesFunc()
+        for idx in self.matches:
+            tree.insert("", "end", values=values(self.treeData[idx]))
+
+        if self.treeUpdatedCallback is not None:
+            self.treeUpdatedCallback()
 
-        if hasSpecialFormatter:
-            columns = self.columns
+    def updateTreeData(self, addedData, removedIndices):
+        """Add and remove elements of 'self.treeData'.
 
-            formatter = []
-            identity = lambda x: x
-            for dataIndex in range(len(self.columns)):
-                f = columns[dataIndex].formatFunc
-                formatter.append(identity if f is None else f)
+        'addedData' is a sequence of new elements for 'self.treeData'
+        and 'removedIndices' an iterable of indices into
+        'self.treeData' for the elements to remove. Unlike
+        setTreeData(), this only inserts and deletes the
+        'self.treeWidget' items concerned, which is much faster when
+        the changes are small compared to the amount of data. The
+        selected item is preserved if it still exists.
 
-            for idx in self.matches:
-                rawValues = self.treeData[idx]
-                values = [ formatter[dataIndex](rawValue)
-                           for dataIndex, rawValue in enumerate(rawValues) ]
-                tree.insert("", "end", values=values)
-        else:
-            # Optimize the case where no column has a formatter function
-            for idx in self.matches:
-                tree.insert("", "end", values=self.treeData[idx])
+        """
+        removedIndices = set(removedIndices)
+        tree = self.treeWidget
+        # self.matches is in the same order as the tree items
+        # (cf. _updateTreeWidget()).
+        items = tree.get_children()
+        toDelete = [ items[pos] for pos, idx in enumerate(self.matches)
+                     if idx in removedIndices ]
+        if toDelete:
+            tree.delete(*toDelete)
+
+        # Remove the elements from self.treeData and renumber the matches
+        treeData = []
+        newIndex = {}
+        for i, data in enumerate(self.treeData):
+            if i not in removedIndices:
+                newIndex[i] = len(treeData)
+                treeData.append(data)
+
+        matches = [ newIndex[idx] for idx in self.matches
+                    if idx not in removedIndices ]
+        firstAdded = len(treeData)
+        treeData.extend(addedData)
+        self.treeData = treeData
 
-        if self.treeUpdatedCallback is not None:
-            self.treeUpdatedCallback()
+        # Find the added elements that match the current search query, and
+        # merge them into the sorted list of matches (timsort is fast on such
+        # data).
+        addedMatches = [ idx for idx in self.findMatches()
+                         if idx >= firstAdded ]
+        if addedMatches:
+            keyFunc = self._sortKeyFunc()
+            col = self.columnsMetadata[self.sortBy]
+            matches.extend(addedMatches)
+            matches.sort(key=lambda idx: keyFunc(treeData[idx]),
+                         reverse=int(col.sortOrder))
+
+            values = self._valuesFunc()
+            # Insert in increasing order of position, so that each position
+            # is valid at the time of insertion.
+            for pos, idx in enumerate(matches):
+                if idx >= firstAdded:
+                    tree.insert("", pos, values=values(treeData[idx]))
+
+        self.matches = matches
+
+        if toDelete or addedMatches:
+            if self.treeUpdatedCallback is not None:
+                self.treeUpdatedCallback()
+
+            if not tree.selection():
+                # The selected item was deleted (or the tree was empty)
+                self._autoUpdateTreeSelection(preserveSelection=True)
 
     def _autoUpdateTreeSelection(self, preserveSelection=False):
         """Select a suitable item in self.treeWidget, if it is non-empty.
@@ -767,11 +849,26 @@ class AirportChooser(IncrementalChooser):
         else:
             raise NoSuchItem(icao)
 
+    def updateAirports(self, addedData, removedIcaos):
+        """Add and remove airports without rebuilding 'self.treeWidget'.
+
+        'addedData' is a sequence of elements for 'self.treeData' and
+        'removedIcaos' a set of ICAO codes (cf. updateTreeData()).
+
+        """
+        removedIndices = [ i for i, (icao, *rest) in enumerate(self.treeData)
+                           if icao in removedIcaos ]
+        self.updateTreeData(addedData, removedIndices)
+
 
 class AircraftChooser(IncrementalChooser):
     """Glue logic turning three widgets into a convenient aircraft chooser."""
 
     acNameTranslationMap = str.maketrans("", "", " -_.,;:!?")
+    # Shorter search queries are only matched against aircraft names, since
+    # nearly every aircraft has a word starting with one or two given
+    # letters in its metadata.
+    METADATA_SEARCH_MIN_LENGTH = 3
 
     def __init__(self, *args, **kwargs):
         # Mapping for removing the listed characters from aircraft names
@@ -784,18 +881,39 @@ class AircraftChooser(IncrementalChooser):
         """Return the match key corresponding to a given aircraft name."""
         return acName.translate(cls.acNameTranslationMap).lower()
 
+    @classmethod
+    def treeDataForAircraft(cls, aircraft):
+        """Return the element of 'self.treeData' for an Aircraft instance."""
+        metadataKey = ("" if aircraft.metadata is None
+                       else aircraft.metadata.searchKey)
+        return (cls.aircraftNameMatchKey(aircraft.name), aircraft.name,
+                aircraft.dir, aircraft.useCountForShow, metadataKey)
+
     def findMatches(self):
         """Find all matches corresponding to the contents of 'self.searchVar'.
 
+        An aircraft matches if the search text is found in its name
+        (approximately, cf. aircraftNameMatchKey()) or, for search texts
+        of at least METADATA_SEARCH_MIN_LENGTH characters, if its words
+        start words of the metadata read from the aircraft -set.xml file
+        (case-insensitively, cf. AircraftMetadata.searchKeyForText()).
+
         Return a list of indices into 'self.treeData'.
 
         """
         unsortedMatches = []
-        text = self.searchVar.get().translate(
-            self.acNameTranslationMap).lower()
+        searchText = self.searchVar.get()
+        text = searchText.translate(self.acNameTranslationMap).lower()
+
+        if len(searchText.strip()) >= self.METADATA_SEARCH_MIN_LENGTH:
+            metadataText = AircraftMetadata.searchKeyForText(searchText)
+        else:
+            metadataText = ""
 
-        for i, (matchKey, *rest) in enumerate(self.treeData):
-            if text in matchKey:
+        for i, (matchKey, name, dir_, useCount, metadataKey) in enumerate(
+                self.treeData):
+            if text in matchKey or (metadataText and
+                                    metadataText in metadataKey):
                 unsortedMatches.append(i)
 
         return unsortedMatches
@@ -847,10 +965,7 @@ class AircraftChooser(IncrementalChooser):
         for i, (matchKey, name, dir_, *rest) in enumerate(self.treeData):
             if (name, dir_) == aircraftId:
                 aircraft = self.config.aircraftWithId(aircraftId)
-                self.treeData[i] = (self.aircraftNameMatchKey(aircraft.name),
-                                    aircraft.name,
-                                    aircraft.dir,
-                                    aircraft.useCountForShow)
+                self.treeData[i] = self.treeDataForAircraft(aircraft)
 
                 if updateTree:
                     # Update the tree, but don't change the selected item.
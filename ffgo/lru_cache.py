@@ -0,0 +1,105 @@
+# lru_cache.py --- Cache with a “least recently used” eviction policy
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016  Florent Rougon
+#
+# This file is distributed under the terms of the DO WHAT THE FUCK YOU WANT TO
+# PUBLIC LICENSE version 2, dated December 2004, by Sam Hocevar. You should
+# have received a copy of this license along with this file. You can also find
+# it at <http://www.wtfpl.net/>.
+
+# This module must not depend on 'constants' nor 'misc', so that low-level
+# modules such as geo.geodesy can use it whatever the import order.
+
+import collections
+
+
+class LRUCache:
+    """Mapping-like cache with a “least recently used” eviction policy.
+
+    Each entry has a size given by 'sizeFunc' (1 for every entry if
+    'sizeFunc' is None). When the total size of the entries exceeds
+    'maxSize', the least recently used entries are evicted. Lookups
+    with get() move the entry found to the “most recently used”
+    position, and update the 'hits' and 'misses' counters.
+
+    All operations except resize() take constant time.
+
+    """
+
+    def __init__(self, maxSize, sizeFunc=None):
+        self.maxSize = maxSize
+        self.sizeFunc = sizeFunc
+        # key -> (value, size), from least recently used to most recently
+        # used
+        self._data = collections.OrderedDict()
+        self.totalSize = 0
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        """Membership test (doesn't count as a use of the entry)."""
+        return key in self._data
+
+    def get(self, key, default=None):
+        """Return the value for 'key' and mark it as most recently used.
+
+        Return 'default' if 'key' is not in the cache.
+
+        """
+        try:
+            value, size = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Add or replace an entry, evicting old entries if needed."""
+        size = 1 if self.sizeFunc is None else self.sizeFunc(value)
+        old = self._data.pop(key, None)
+        if old is not None:
+            self.totalSize -= old[1]
+
+        self._data[key] = (value, size)
+        self.totalSize += size
+        self._evict()
+
+    def pop(self, key, default=None):
+        """Remove an entry and return its value."""
+        try:
+            value, size = self._data.pop(key)
+        except KeyError:
+            return default
+
+        self.totalSize -= size
+        return value
+
+    def resize(self, maxSize):
+        """Change the maximum total size, evicting entries if needed."""
+        self.maxSize = maxSize
+        self._evict()
+
+    def _evict(self):
+        # Always keep the most recently used entry, even if it is larger than
+        # self.maxSize on its own.
+        while self.totalSize > self.maxSize and len(self._data) > 1:
+            key, (value, size) = self._data.popitem(last=False)
+            self.totalSize -= size
+
+        if self.maxSize <= 0:
+            self._data.clear()
+            self.totalSize = 0
+
+    def clear(self):
+        self._data.clear()
+        self.totalSize = 0
+
+    def keys(self):
+        """Keys from the least recently used to the most recently used."""
+        return list(self._data.keys())
@@ -35,14 +35,6 @@ def earlyTkInit():
     master.title(PROGNAME)
     return master
 
-# When importing 'config', the 'infowindow' module is itself imported, which
-# defines an InfoWindow class. This in turn requires the tkinter.Tk() object
-# (at class definition time) because of the constructor's
-# 'font=tkFont.nametofont("TkTextFont")' optional argument.
-master = earlyTkInit()
-from .config import Config, AbortConfig
-from .gui.mainwindow import App
-
 
 def processCommandLine():
     params = argparse.Namespace()
@@ -97,6 +89,17 @@ FlightGear executable, with suitable arguments.""",
 
 def run(master, params):
     """Initialize the application."""
+    # When importing 'config', the 'infowindow' module is itself imported,
+    # which defines an InfoWindow class. This in turn requires the
+    # tkinter.Tk() object (at class definition time) because of the
+    # constructor's 'font=tkFont.nametofont("TkTextFont")' optional argument.
+    # These imports are done here rather than at module level, so that
+    # importing this module (which worker processes started with the 'spawn'
+    # method do, as it is the main module) doesn't create a Tk root window
+    # nor import the GUI.
+    from .config import Config, AbortConfig
+    from .gui.mainwindow import App
+
     # Initialize config object (passing 'master' allows things such as
     # obtaining the screen dpi in Config methods using
     # master.winfo_fpixels('1i')).
@@ -186,6 +189,7 @@ def main():
             python_version=misc.pythonVersionString()))
 
         try:
+            master = earlyTkInit()
             master.report_callback_exception = reportTkinterCallbackException
             res = run(master, params)
         except:
@@ -41,6 +41,28 @@ def executableFileName(base):
         return base
 
 
+def subdirectories(path):
+    """Return the list of (name, path) tuples for subdirectories of 'path'.
+
+    os.scandir() is used when available (Python 3.5 or later): on most
+    platforms, it tells whether an entry is a directory without any
+    additional system call.
+
+    """
+    if hasattr(os, "scandir"):
+        # Exhausting the iterator releases the underlying resources.
+        return [ (entry.name, entry.path) for entry in os.scandir(path)
+                 if entry.is_dir() ]
+    else:
+        res = []
+        for name in os.listdir(path):
+            p = os.path.join(path, name)
+            if os.path.isdir(p):
+                res.append((name, p))
+
+        return res
+
+
 def isDescendantWidget(maybeParent, widget):
     """Return True if 'widget' is 'maybeParent' or a descendant of it.
 
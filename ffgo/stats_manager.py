@@ -411,7 +411,9 @@ class AirportStatsManager(StatsManagerBase):
         return airport
 
     def items(self):
-        return self.config.airports.items()
+        # Airports for which no AirportStub instance has been created yet
+        # can't have any date of use.
+        return self.config.airports.loadedItems()
 
 
 class AircraftStatsManager(StatsManagerBase):
@@ -0,0 +1,51 @@
+# workers.py --- Entry points for FFGo's worker processes
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2016  Florent Rougon
+#
+# This file is distributed under the terms of the DO WHAT THE FUCK YOU WANT TO
+# PUBLIC LICENSE version 2, dated December 2004, by Sam Hocevar. You should
+# have received a copy of this license along with this file. You can also find
+# it at <http://www.wtfpl.net/>.
+
+"""Entry points for FFGo's worker processes.
+
+FFGo's process pools use the 'spawn' start method: a worker process
+starts with a fresh interpreter and imports the functions it has to
+run from their module. This module is that place; it is cheap to
+import, and takes care of importing 'constants' before 'misc', since
+importing 'misc' first would be circular. Modules that require the _()
+function are only imported once initWorkerProcess() has installed it.
+
+"""
+
+import builtins
+import gettext
+
+from . import constants
+
+
+def initWorkerProcess():
+    """Make sure the _() function is available in a worker process.
+
+    Worker processes started with the 'spawn' method don't inherit the
+    translation setup of the parent process. Since many FFGo modules
+    can't be imported before _() is in place, this function should be
+    used as the initializer of every multiprocessing.Pool.
+
+    """
+    if not hasattr(builtins, "_"):
+        gettext.install(constants.MESSAGES, constants.LOCALE_DIR)
+
+
+def aptDigestEntriesForChunk(*args, **kwargs):
+    """Worker process side of apt_dat.AptDatSetManager's parallel reading.
+
+    See apt_dat._aptDigestEntriesForChunk() for the arguments and
+    return value.
+
+    """
+    # This import requires the translation system [_() function] to be in
+    # place.
+    from .fgdata import apt_dat
+    return apt_dat._aptDigestEntriesForChunk(*args, **kwargs)
@@ -0,0 +1,109 @@
+# test_magfield.py --- Tests for ffgo/geo/magfield.py
+# -*- coding: utf-8 -*-
+#
+# This file is distributed under the terms of the DO WHAT THE FUCK YOU WANT TO
+# PUBLIC LICENSE version 2, dated December 2004, by Sam Hocevar. You should
+# have received a copy of this license along with this file. You can also find
+# it at <http://www.wtfpl.net/>.
+
+import builtins
+import os
+import stat
+import sys
+import tempfile
+import textwrap
+import threading
+import unittest
+
+if not hasattr(builtins, "_"):
+    builtins._ = lambda s: s
+
+from ffgo.geo.magfield import MagneticFieldCoprocess, EarthMagneticField
+
+
+# Stand-in for GeographicLib's MagneticField: the declination is the latitude
+# of the query. Output is flushed after each line, as with MagneticField
+# builds that can be used as a coprocess.
+FAKE_MAGNETICFIELD = textwrap.dedent("""\
+    #! {python}
+    import sys
+
+    if sys.argv[1:] == ["--version"]:
+        print("Fake MagneticField 1.0")
+        sys.exit(0)
+
+    for line in sys.stdin:
+        date, lat, lon, alt = line.split()
+        sys.stdout.write("{{}} 60 0 0 0 0 0\\n".format(float(lat)))
+        sys.stdout.flush()
+    """)
+
+
+class _Var:
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+class _Config:
+    def __init__(self, executable):
+        self.MagneticField_bin = _Var(executable)
+        self.magFieldCoprocess = _Var(1)
+        self.magDeclGrid = _Var(1)
+
+
+class TestMagneticFieldCoprocess(unittest.TestCase):
+
+    # Number of nodes of the declination grid
+    NB_LINES = 181*361
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.executable = os.path.join(self.tmpDir.name, "MagneticField")
+        with open(self.executable, "w", encoding="utf-8") as f:
+            f.write(FAKE_MAGNETICFIELD.format(python=sys.executable))
+        os.chmod(self.executable, stat.S_IRWXU)
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def _runWithTimeout(self, func, timeout=120):
+        # If the call hangs, the thread is left behind (a daemon thread
+        # doesn't prevent the interpreter from exiting).
+        res = []
+        thread = threading.Thread(target=lambda: res.append(func()),
+                                  daemon=True)
+        thread.start()
+        thread.join(timeout)
+        if thread.is_alive():
+            self.fail("call didn't return within {} seconds".format(timeout))
+        return res[0]
+
+    def test_large_query(self):
+        coprocess = MagneticFieldCoprocess(self.executable)
+        lines = [ "2016-01-01 {} 0 0".format(i % 90)
+                  for i in range(self.NB_LINES) ]
+        answers = self._runWithTimeout(lambda: coprocess.query(lines))
+        coprocess.close()
+
+        self.assertEqual(len(answers), self.NB_LINES)
+        self.assertEqual(float(answers[-1].split()[0]),
+                         (self.NB_LINES - 1) % 90)
+
+    def test_decl_with_grid(self):
+        gridPath = os.path.join(self.tmpDir.name, "grid")
+        field = EarthMagneticField(_Config(self.executable),
+                                   gridPath=gridPath)
+        # Wait for the coprocess to be ready, so that it would be used for
+        # the grid if it weren't too large for it.
+        self.assertTrue(field.coprocess._ready.wait(30))
+        decl = self._runWithTimeout(lambda: field.decl(45, 5))
+        field.close()
+
+        self.assertAlmostEqual(decl, 45.0)
+
+
+if __name__ == "__main__":
+    unittest.main()